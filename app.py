@@ -1,20 +1,20 @@
 import streamlit as st
 from client import StravaGPT
+from sessions import SharedResources, registry
+from scheduler import scheduler
 import urllib
+import uuid
 import dotenv
 import os
 import logging
+from log_config import configure_logging, preview
+from metrics import start_metrics_server
 
 # Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('run.log'),  # Logs to a file
-        logging.StreamHandler()  # Logs to console
-    ]
-)
-logging.getLogger("watchdog").setLevel(logging.WARNING)
+configure_logging()
+
+# Serve Prometheus metrics next to the app, once per process
+start_metrics_server(registry, scheduler)
 
 
 logging.info("Starting StravaGPT Streamlit app")
@@ -34,17 +34,22 @@ openai_key = os.getenv("OPENAI_KEY")
 mapbox_access_token = os.getenv("MAPBOX_KEY")
 tavily_api_key = os.getenv("TAVILY_API_KEY")
 
-logging.debug(f"Client ID: {client_id}, Client Secret: {client_secret}, Redirect URI: {redirect_uri}")
-logging.debug(f"OpenAI Key: {openai_key}, Mapbox Token: {mapbox_access_token}, Tavily API Key: {tavily_api_key}")
+logging.debug("Client ID: %s, Client Secret: %s, Redirect URI: %s", client_id, client_secret, redirect_uri)
+logging.debug("OpenAI Key: %s, Mapbox Token: %s, Tavily API Key: %s", openai_key, mapbox_access_token, tavily_api_key)
+
+# Clients, the system prompt template and tool schemas are shared by every session in the process
+@st.cache_resource
+def get_shared_resources():
+    logging.info("Creating shared resources")
+    return SharedResources(openai_key, tavily_api_key)
+
 
-# Initialize session state variables
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    logging.debug("Initialized session state 'messages'")
+shared = get_shared_resources()
 
-if "client" not in st.session_state:
-    st.session_state.client = None
-    logging.debug("Initialized session state 'client'")
+# Initialize session state variables. The StravaGPT session itself lives in the process-wide registry
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+    logging.debug("Initialized session state 'session_id'")
 
 if "authorised" not in st.session_state:
     st.session_state.authorised = False
@@ -54,12 +59,22 @@ if "data_fetched" not in st.session_state:
     st.session_state.data_fetched = False
     logging.debug("Initialized session state 'data_fetched'")
 
+# Evict idle sessions across the process before looking this one up
+registry.evict()
+strava_client = registry.get(st.session_state.session_id)
+
+if st.session_state.authorised and strava_client is None:
+    logging.info("Session was evicted while idle")
+    st.session_state.authorised = False
+    st.session_state.data_fetched = False
+    st.warning("Your session expired while idle, please authorize again.")
+
 # Authorize Strava client
-if st.session_state.client is None:
+if strava_client is None:
     logging.info("No existing Strava client found, creating new client")
-    strava_client = StravaGPT(client_id, redirect_uri, client_secret, openai_key, mapbox_access_token, tavily_api_key)
+    strava_client = StravaGPT(client_id, redirect_uri, client_secret, openai_key, mapbox_access_token, tavily_api_key, shared=shared)
     authorisation_url = strava_client.client.get_authorisation_url()
-    logging.debug(f"Generated authorisation URL: {authorisation_url}")
+    logging.debug("Generated authorisation URL: %s", authorisation_url)
 
     # Display authorization URL
     st.markdown(f"Please visit the following URL to authorize the app: [Authorize Strava]({authorisation_url})")
@@ -67,7 +82,7 @@ if st.session_state.client is None:
     auth_url = st.text_input("After authorizing, please enter the full redirect URL you were redirected to:")
 
     if auth_url:
-        logging.debug(f"Received redirect URL from user: {auth_url}")
+        logging.debug("Received redirect URL from user: %s", auth_url)
         # Parse URL to extract the authorization code
         parsed_url = urllib.parse.urlparse(auth_url)
         code = urllib.parse.parse_qs(parsed_url.query).get("code", [None])[0]
@@ -75,55 +90,90 @@ if st.session_state.client is None:
             logging.info("Authorization code found, exchanging for token")
             try:
                 token_response = strava_client.client.exchange_code_for_token(code)
-                logging.debug(f"Token response: {token_response}")
+                logging.debug("Token response: %s", preview(token_response))
                 strava_client.client.set_tokens(token_response)
-                st.session_state.client = strava_client
+                registry.add(st.session_state.session_id, strava_client)
                 st.session_state.authorised = True
                 st.success("Authorization successful!")
                 logging.info("Authorization successful, client initialized")
             except Exception as e:
-                logging.error(f"Error exchanging code for token: {e}")
+                logging.error("Error exchanging code for token: %s", e)
                 st.error(f"Error: {str(e)}")
         else:
             logging.warning("No authorization code found in URL")
             st.error("Error: No authorization code found in the URL.")
 else:
-    logging.info("Using existing Strava client from session state")
-    strava_client = st.session_state.client
+    logging.info("Using existing Strava client from session registry")
+    st.sidebar.caption(f"Session memory: {strava_client.memory_usage() / 1e6:.1f} MB, active sessions: {len(registry)}")
+    strava_budget = scheduler.metrics()
+    st.sidebar.caption(
+        f"Strava API: {strava_budget['short_used']}/{strava_budget['short_limit']} (15 min), "
+        f"{strava_budget['daily_used']}/{strava_budget['daily_limit']} (day)"
+    )
+
+# Show how much of the activity history the background sync has loaded, refreshing while it runs
+@st.fragment(run_every=1)
+def show_sync_progress(progress):
+    status = progress.to_dict()
+    loaded = status["fetched"] + status["stored"]
+    if status["state"] == "running":
+        back_to = f", back to {status['oldest'][:10]}" if status["oldest"] else ""
+        st.progress(status["fraction"], text=f"Loading activity history: {loaded} activities{back_to}")
+    else:
+        if status["state"] == "failed":
+            st.caption(f"Activity sync failed: {status['error']}")
+        else:
+            st.caption(f"Activity history loaded: {loaded} activities")
+        # One last full rerun picks up the finished sync and stops the refresh
+        if st.session_state.get("sync_state") == "running":
+            st.session_state.sync_state = status["state"]
+            st.rerun()
+    st.session_state.sync_state = status["state"]
 
-# Fetch Strava data
+
+# Fetch Strava data in the background, opening the chat as soon as the first page has arrived
 if st.session_state.authorised and not st.session_state.data_fetched:
     logging.info("User is authorized but data not fetched yet")
-    if st.button("Fetch Strava Data"):
-        logging.info("Fetch Strava Data button clicked")
+    sync_progress = strava_client.sync_progress
+    if sync_progress is None or (not sync_progress.running and strava_client.activities_pl is None):
+        if sync_progress is not None:
+            st.error(f"Error fetching Strava data: {sync_progress.error}" if sync_progress.error else "No Strava activities found")
+        if st.button("Fetch Strava Data"):
+            logging.info("Fetch Strava Data button clicked")
+            sync_progress = strava_client.start_sync()
+
+    if sync_progress is not None and (sync_progress.running or strava_client.activities_pl is not None):
         try:
             with st.spinner("Fetching Strava data..."):
-                strava_client.fetch_activities()
-                if strava_client.activities is None or strava_client.activities == []:
-                    logging.info("No Strava activities found")
-                    st.error("No Strava activities found")
-                    st.session_state.data_fetched = False
-                else:
-                    logging.debug("Strava activities fetched")
-
-                    strava_client.load_system_prompt()
-                    logging.debug("System prompt loaded")
-                    strava_client.update_system_prompt_with_data()
-                    logging.debug("System prompt updated with data")
-                    st.session_state.data_fetched = True
-                    st.success("Data fetched successfully!")
-                    logging.info("Data fe``tched successfully")
+                sync_progress.available.wait()
+            if strava_client.activities_pl is None:
+                logging.info("No Strava activities found")
+                st.rerun()
+
+            logging.debug("First Strava activities fetched")
+            strava_client.load_system_prompt()
+            logging.debug("System prompt loaded")
+            strava_client.update_system_prompt_with_data()
+            logging.debug("System prompt updated with data")
+            strava_client.start_prefetch()
+            st.session_state.data_fetched = True
+            st.success("Data fetched successfully!")
+            logging.info("Data fetched successfully")
         except Exception as e:
-            logging.error(f"Error fetching Strava data: {e}")
+            logging.error("Error fetching Strava data: %s", e)
             st.error(f"Error fetching Strava data: {str(e)}")
 
+if st.session_state.authorised and strava_client.sync_progress is not None:
+    with st.sidebar:
+        show_sync_progress(strava_client.sync_progress)
+
 # Main chat interface
 if st.session_state.authorised and st.session_state.data_fetched:
     logging.info("Displaying chat interface")
     
     # Display existing messages
-    for i, message in enumerate(st.session_state.messages):
-        logging.debug(f"Displaying message {i} - Role: {message['role']}")
+    for i, message in enumerate(strava_client.chat_history):
+        logging.debug("Displaying message %s - Role: %s", i, message['role'])
         if message["role"] == "user":
             with st.chat_message("user"):
                 st.markdown(message["content"])
@@ -131,44 +181,60 @@ if st.session_state.authorised and st.session_state.data_fetched:
             with st.chat_message("assistant"):
                 st.markdown(message["content"])
                 if "plots" in message and message["plots"]:
-                    logging.debug(f"Displaying {len(message['plots'])} plot(s)")
+                    logging.debug("Displaying %s plot(s)", len(message['plots']))
                     for fig in message["plots"]:
                         st.plotly_chart(fig, use_container_width=True)
 
     # User input
     if user_input := st.chat_input("Ask StravaGPT anything..."):
-        logging.debug(f"Received user input: {user_input}")
+        logging.debug("Received user input: %s", user_input)
         
         # Append user message to session state
-        st.session_state.messages.append({"role": "user", "content": user_input})
+        strava_client.chat_history.append({"role": "user", "content": user_input})
         logging.debug("User message appended to session state")
 
         # Display user message
         with st.chat_message("user"):
             st.markdown(user_input)
 
-        # Get StravaGPT's response and any generated plots
+        # Stream StravaGPT's response and tool progress as it arrives
         try:
-            response_text, generated_plots = strava_client.ask_question(user_input)
+            with st.chat_message("assistant"):
+                status = st.empty()
+                answer = st.empty()
+                response_text = ""
+                generated_plots = []
+
+                for event in strava_client.stream_question(user_input):
+                    if event["type"] == "token":
+                        response_text += event["content"]
+                        answer.markdown(response_text + "▌")
+                    elif event["type"] == "tool_start":
+                        status.caption(f"Running {event['name']}...")
+                    elif event["type"] == "tool_end":
+                        status.caption(f"Finished {event['name']} in {event['elapsed']:.1f}s")
+                    elif event["type"] == "done":
+                        response_text = event["content"]
+                        generated_plots = event["plots"]
+                        logging.debug("Time to first token: %s", event['time_to_first_token'])
+
+                status.empty()
+                answer.markdown(response_text)
+                if generated_plots:
+                    logging.debug("Displaying %s plot(s)", len(generated_plots))
+                    for fig in generated_plots:
+                        st.plotly_chart(fig, use_container_width=True)
             logging.debug("StravaGPT response received")
 
             # Append assistant response
-            st.session_state.messages.append({
+            strava_client.chat_history.append({
                 "role": "assistant",
                 "content": response_text,
                 "plots": generated_plots
             })
             logging.debug("Assistant response appended to session state")
-
-            # Display assistant response
-            with st.chat_message("assistant"):
-                st.markdown(response_text)
-                if generated_plots:
-                    logging.debug(f"Displaying {len(generated_plots)} plot(s)")
-                    for fig in generated_plots:
-                        st.plotly_chart(fig, use_container_width=True)
         except Exception as e:
-            logging.error(f"Error in StravaGPT response: {e}")
+            logging.error("Error in StravaGPT response: %s", e)
             st.error(f"Error: {str(e)}")
 
 logging.info("App execution completed")
@@ -0,0 +1,459 @@
+"""
+Offline stand-ins for Strava, OpenAI and Tavily, and synthetic athletes to feed them.
+
+The stand-ins replace the clients a StravaGPT session talks to, so the whole pipeline runs
+without accounts or network access:
+
+    athlete = SyntheticAthlete(10000)
+    session = offline_session(athlete)
+    session.fetch_activities()
+
+Every response is generated deterministically from the athlete's seed, so runs are
+comparable. Each stand-in can add a fixed latency per request to model the network.
+
+Importing this module points STRAVAGPT_DATA_DIR at a temporary directory, unless it is
+already set, so benchmarks never touch the real store and caches.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+
+os.environ.setdefault("STRAVAGPT_DATA_DIR", tempfile.mkdtemp(prefix="stravagpt-benchmark-"))
+os.environ.setdefault("SILENCE_TOKEN_WARNINGS", "true")
+
+from openai.types.chat import ChatCompletion  # noqa: E402
+
+from client import StravaGPT  # noqa: E402
+from sessions import SharedResources  # noqa: E402
+
+# Points returned per stream at each resolution, as documented by Strava
+RESOLUTION_POINTS = {"low": 100, "medium": 1000, "high": 10000}
+
+# Activities returned per page of the activities endpoint, as requested by stravalib
+PAGE_SIZE = 200
+
+# Sport, share of activities, typical distance in metres and typical speed in m/s
+SPORTS = [
+    ("Run", 0.45, 9000, 3.1),
+    ("Ride", 0.30, 45000, 7.5),
+    ("Walk", 0.10, 5000, 1.4),
+    ("Hike", 0.07, 12000, 1.1),
+    ("Swim", 0.05, 2000, 0.8),
+    ("WeightTraining", 0.03, 0, 0),
+]
+
+# Home bases near places in the gazetteer, so routes have landmarks to describe
+HOMES = [(51.5072, -0.1276), (53.4808, -2.2426), (55.9533, -3.1883), (45.7640, 4.8357)]
+
+# Earliest start of a synthetic activity
+HISTORY_START = datetime(2020, 1, 2, tzinfo=timezone.utc)
+
+_athlete_ids = iter(range(1, 1 << 30))
+_athlete_ids_lock = threading.Lock()
+
+
+class SyntheticActivity:
+    """A Strava activity summary, in the shape stravalib's models convert to."""
+
+    def __init__(self, data):
+        self.data = data
+        self.id = data["id"]
+        self.start_date = data["start_date"]
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class SyntheticAthlete:
+    """
+    An athlete with a history of synthetic activities, one every 1.2 days on average, ending
+    on 1 January 2025. Larger histories are packed closer together so they all start after
+    2020, where a first sync begins.
+
+    Activity ids are unique across athletes, so athletes can share one stream cache.
+
+    Parameters:
+    activities: int
+        The number of activities.
+    seed: int
+        Seeds every generated value, the same seed giving the same athlete.
+    """
+
+    def __init__(self, activities, seed=0):
+        with _athlete_ids_lock:
+            self.id = next(_athlete_ids)
+        self.count = activities
+        self.seed = seed
+        self.home = HOMES[seed % len(HOMES)]
+        self.activities = self._activities()
+        self.by_id = {activity.id: activity for activity in self.activities}
+
+    def _activities(self):
+        rng = np.random.default_rng(self.seed)
+        end = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        mean_gap = min(1.2 * 86400, (end - HISTORY_START).total_seconds() / self.count / 1.05)
+        gaps = rng.exponential(mean_gap, self.count)
+        first = end - timedelta(seconds=float(gaps.sum()))
+        starts = [first + timedelta(seconds=float(offset)) for offset in np.cumsum(gaps)]
+        sport_index = rng.choice(len(SPORTS), self.count, p=[share for _, share, _, _ in SPORTS])
+        return [
+            self._activity(rng, self.id * 10_000_000 + i, start, *SPORTS[sport])
+            for i, (start, sport) in enumerate(zip(starts, sport_index))
+        ]
+
+    def _activity(self, rng, activity_id, start, sport, _, distance, speed):
+        manual = distance == 0 or rng.random() < 0.01
+        distance = float(rng.gamma(4, distance / 4)) if distance else 0.0
+        moving_time = int(distance / (speed * rng.uniform(0.85, 1.15))) if speed else int(rng.uniform(1800, 5400))
+        heart_rate = not manual and rng.random() < 0.9
+        lat, lng = self.home[0] + rng.normal(0, 0.05), self.home[1] + rng.normal(0, 0.05)
+
+        data = {
+            "id": activity_id,
+            "name": f"{['Morning', 'Lunch', 'Evening'][int(rng.integers(3))]} {sport}",
+            "sport_type": sport,
+            "type": sport,
+            "workout_type": int(rng.integers(0, 4)) if sport == "Run" else None,
+            "start_date": start.isoformat(),
+            "start_date_local": start.replace(tzinfo=None).isoformat(),
+            "timezone": "(GMT+00:00) Europe/London",
+            "distance": distance,
+            "moving_time": moving_time,
+            "elapsed_time": int(moving_time * rng.uniform(1.0, 1.2)),
+            "total_elevation_gain": float(rng.gamma(2, distance / 200)) if distance else 0.0,
+            "average_speed": distance / moving_time if moving_time else 0.0,
+            "max_speed": speed * rng.uniform(1.3, 2.0),
+            "has_heartrate": heart_rate,
+            "average_heartrate": float(rng.normal(145, 12)) if heart_rate else None,
+            "max_heartrate": float(rng.normal(175, 8)) if heart_rate else None,
+            "average_cadence": float(rng.normal(85, 5)) if sport in ("Run", "Ride") else None,
+            "average_watts": float(rng.normal(190, 30)) if sport == "Ride" else None,
+            "kilojoules": float(rng.normal(190, 30) * moving_time / 1000) if sport == "Ride" else None,
+            "suffer_score": float(rng.gamma(3, 15)) if heart_rate else None,
+            "start_latlng": None if manual else [lat, lng],
+            "end_latlng": None if manual else [lat + rng.normal(0, 0.002), lng + rng.normal(0, 0.002)],
+            "gear_id": f"g{self.id}{int(rng.integers(3))}",
+            "device_name": "Garmin Forerunner 965",
+            "commute": sport == "Ride" and rng.random() < 0.3,
+            "trainer": False,
+            "manual": manual,
+            "private": False,
+            "kudos_count": int(rng.poisson(8)),
+            "comment_count": int(rng.poisson(1)),
+            "achievement_count": int(rng.poisson(2)),
+            "pr_count": int(rng.poisson(0.5)),
+            "athlete_count": int(rng.integers(1, 4)),
+            "total_photo_count": int(rng.poisson(0.6)),
+            "athlete": {"id": self.id},
+            "map": {"id": f"a{activity_id}", "summary_polyline": "_p~iF~ps|U_ulLnnqC_mqNvxq`@"},
+        }
+        if sport == "Run" and distance >= 1000:
+            km = int(distance // 1000)
+            data["splits_metric"] = [
+                {"split": i + 1, "distance": 1000.0, "moving_time": int(moving_time / (distance / 1000)), "elevation_difference": float(rng.normal(0, 5))}
+                for i in range(km)
+            ]
+            data["laps"] = [{"lap_index": i + 1, "distance": distance / max(km, 1), "moving_time": moving_time // max(km, 1)} for i in range(min(km, 5))]
+        return SyntheticActivity(data)
+
+    # Activities started after a date, oldest first, as the activities endpoint returns them with after=
+    def activities_after(self, after=None, before=None):
+        activities = self.activities
+        if after is not None:
+            after = after if after.tzinfo else after.replace(tzinfo=timezone.utc)
+            activities = [a for a in activities if datetime.fromisoformat(a.data["start_date"]) > after]
+        if before is not None:
+            before = before if before.tzinfo else before.replace(tzinfo=timezone.utc)
+            activities = [a for a in activities if datetime.fromisoformat(a.data["start_date"]) < before]
+        return activities
+
+    # The most recent activities with a GPS track, newest first
+    def recent_routes(self, count):
+        routes = [a.id for a in reversed(self.activities) if a.data["start_latlng"] and a.data["distance"] > 1000]
+        return routes[:count]
+
+    # Streams of one activity, sampled at the resolution's number of points
+    def streams(self, activity_id, types, resolution="medium"):
+        # The model passes ids as strings, as declared in the tool schema
+        activity_id = int(activity_id)
+        data = self.by_id[activity_id].data
+        if data["manual"]:
+            return {}
+        rng = np.random.default_rng(activity_id)
+        n = max(2, min(RESOLUTION_POINTS.get(resolution, 1000), data["elapsed_time"]))
+
+        time_s = np.linspace(0, data["elapsed_time"], n).round()
+        speed = np.clip(data["average_speed"] * (1 + 0.1 * np.sin(time_s / 300) + rng.normal(0, 0.05, n)), 0, None)
+        distance = np.concatenate([[0.0], np.cumsum(np.diff(time_s) * speed[1:])])
+        distance *= data["distance"] / max(distance[-1], 1.0)
+
+        # A loop out and back to the start, wobbling like a real route
+        angle = np.linspace(0, 2 * np.pi, n) + rng.normal(0, 0.02, n).cumsum() * 0.1
+        radius = max(data["distance"], 1.0) / (2 * np.pi) / 111_000
+        lat0, lng0 = data["start_latlng"]
+        lat = lat0 + radius * (np.sin(angle))
+        lng = lng0 + radius * (1 - np.cos(angle)) / np.cos(np.radians(lat0))
+
+        altitude = 80 + 30 * np.sin(distance / 2000) + rng.normal(0, 0.5, n).cumsum()
+        heartrate = np.clip(110 + 40 * (1 - np.exp(-time_s / 600)) + rng.normal(0, 3, n), 60, 200)
+
+        values = {
+            "time": time_s.astype(int),
+            "distance": distance,
+            "latlng": np.column_stack([lat, lng]),
+            "altitude": altitude,
+            "velocity_smooth": speed,
+            "heartrate": heartrate.astype(int) if data["has_heartrate"] else None,
+            "cadence": np.clip(rng.normal(85, 4, n), 0, None).astype(int) if data["average_cadence"] else None,
+            "watts": np.clip(rng.normal(data["average_watts"] or 0, 40, n), 0, None).astype(int) if data["average_watts"] else None,
+            "temp": np.full(n, 15),
+            "moving": speed > 0.5,
+            "grade_smooth": np.gradient(altitude) / np.maximum(np.gradient(distance), 1) * 100,
+        }
+        return {
+            stream_type: SimpleNamespace(type=stream_type, data=values[stream_type].tolist(), resolution=resolution)
+            for stream_type in types
+            if values.get(stream_type) is not None
+        }
+
+
+class FakeStravaClient:
+    """
+    Stand-in for stravalib.Client serving a synthetic athlete.
+
+    Parameters:
+    athlete: SyntheticAthlete
+        The athlete whose data is served.
+    latency: float
+        Seconds each request takes, per page for the activities endpoint.
+    """
+
+    def __init__(self, athlete, latency=0.0):
+        self.athlete = athlete
+        self.latency = latency
+        self.access_token = "offline"
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _request(self):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def authorization_url(self, client_id, redirect_uri, **kwargs):
+        return f"https://www.strava.com/oauth/authorize?client_id={client_id}&redirect_uri={redirect_uri}"
+
+    def exchange_code_for_token(self, client_id, client_secret, code, **kwargs):
+        return {"access_token": "offline", "refresh_token": "offline", "expires_at": int(time.time()) + 21600}
+
+    def get_athlete(self):
+        self._request()
+        return SimpleNamespace(
+            id=self.athlete.id, firstname="Synthetic", lastname=f"Athlete {self.athlete.id}", sex="F",
+            city="London", state="England", country="United Kingdom",
+        )
+
+    def get_athlete_stats(self, athlete_id):
+        self._request()
+        totals = {}
+        for sport in ("Ride", "Run", "Swim"):
+            activities = [a.data for a in self.athlete.activities if a.data["sport_type"] == sport]
+            totals[sport] = SimpleNamespace(
+                count=len(activities),
+                distance=sum(a["distance"] for a in activities),
+                elapsed_time=sum(a["elapsed_time"] for a in activities),
+                elevation_gain=sum(a["total_elevation_gain"] for a in activities),
+                moving_time=sum(a["moving_time"] for a in activities),
+            )
+        return SimpleNamespace(all_ride_totals=totals["Ride"], all_run_totals=totals["Run"], all_swim_totals=totals["Swim"])
+
+    # Activities are paged lazily, like stravalib's BatchedResultsIterator, and newest first without after=
+    def get_activities(self, after=None, before=None, limit=None):
+        activities = self.athlete.activities_after(after, before)
+        if after is None:
+            activities = activities[::-1]
+        activities = activities[:limit]
+        for start in range(0, len(activities), PAGE_SIZE):
+            self._request()
+            yield from activities[start:start + PAGE_SIZE]
+
+    def get_activity_streams(self, activity_id, types=None, resolution="medium", **kwargs):
+        self._request()
+        return self.athlete.streams(activity_id, types or ["time", "latlng", "altitude"], resolution)
+
+    def get_activity_photos(self, activity_id, size=None, only_instagram=False):
+        self._request()
+        count = self.athlete.by_id[int(activity_id)].data["total_photo_count"]
+        return [
+            SimpleNamespace(unique_id=f"{activity_id}-{i}", urls={str(size): f"https://photos.example/{activity_id}/{i}-{size}.jpg"})
+            for i in range(count)
+        ]
+
+
+class ScriptedOpenAI:
+    """
+    Stand-in for the OpenAI client that plays a scripted conversation.
+
+    Each turn of the script names the user's question, the rounds of tool calls the model
+    makes for it, and its final answer. Chat completions look up the turn by the latest
+    user message and return the next round of tool calls, then the answer. Vision requests
+    get a canned description per image.
+
+    Parameters:
+    script: list of dict
+        Turns of {"question": str, "rounds": [[(tool name, arguments), ...], ...], "answer": str}.
+    latency: float
+        Seconds each request takes.
+    """
+
+    def __init__(self, script=(), latency=0.0):
+        self.turns = {turn["question"]: turn for turn in script}
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        messages = [m if isinstance(m, dict) else m.model_dump(exclude_none=True) for m in messages]
+        if isinstance(messages[-1].get("content"), list):
+            return self._describe(model, messages, kwargs.get("response_format"))
+
+        last_user = max(i for i, m in enumerate(messages) if m["role"] == "user")
+        turn = self.turns.get(messages[last_user]["content"], {"rounds": [], "answer": "I don't know."})
+        step = sum(1 for m in messages[last_user:] if m["role"] == "assistant" and m.get("tool_calls"))
+
+        if step < len(turn["rounds"]):
+            tool_calls = [
+                {"id": f"call_{step}_{i}", "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+                for i, (name, arguments) in enumerate(turn["rounds"][step])
+            ]
+            message, finish_reason = {"role": "assistant", "content": None, "tool_calls": tool_calls}, "tool_calls"
+        else:
+            message, finish_reason = {"role": "assistant", "content": turn["answer"]}, "stop"
+        return _completion(model, message, finish_reason, messages)
+
+    def _describe(self, model, messages, response_format):
+        images = [part for part in messages[-1]["content"] if part["type"] == "image_url"]
+        descriptions = [f"A runner on a trail, photo {i + 1} of {len(images)}" for i in range(len(images))]
+        if response_format:
+            content = json.dumps({"descriptions": descriptions})
+        else:
+            content = descriptions[0]
+        return _completion(model, {"role": "assistant", "content": content}, "stop", messages)
+
+
+# A chat completion with token usage estimated at four characters a token
+def _completion(model, message, finish_reason, messages):
+    prompt_tokens = len(json.dumps(messages, default=str)) // 4
+    completion_tokens = len(json.dumps(message)) // 4
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-offline",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    })
+
+
+class FakeTavily:
+    """
+    Stand-in for TavilyClient returning synthetic results with long page contents.
+
+    Parameters:
+    latency: float
+        Seconds each search takes.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+
+    def search(self, query, max_results=5, **kwargs):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        words = query.split()
+        return {
+            "query": query,
+            "answer": None,
+            "results": [
+                {
+                    "title": f"{query.title()} - result {i + 1}",
+                    "url": f"https://example.com/{'-'.join(words)}/{i}",
+                    "content": " ".join(words * 40),
+                    "score": 1 - i / 10,
+                    "raw_content": None,
+                }
+                for i in range(max_results)
+            ],
+        }
+
+
+# A scripted conversation about the athlete's own activities, touching every tool
+def conversation_script(athlete):
+    # Activity ids are strings in tool calls, as declared in the tool schema
+    routes = [str(activity_id) for activity_id in athlete.recent_routes(2)]
+    return [
+        {
+            "question": "How many runs did I do and how far did I run in total?",
+            "rounds": [[("query_data", {"query": "SELECT COUNT(*) AS runs, SUM(distance) / 1000 AS km FROM self WHERE sport_type = 'Run'"})]],
+            "answer": "You ran a lot.",
+        },
+        {
+            "question": "How did my heart rate change during my last run, and where did I go?",
+            "rounds": [
+                [("query_data", {"query": "SELECT id, name, distance FROM self WHERE sport_type = 'Run' ORDER BY start_date DESC LIMIT 1"})],
+                [
+                    ("get_activity_data", {"activity_id": routes[0], "stream_types": ["heartrate", "altitude"], "resolution": "medium"}),
+                    ("plot_route", {"activity_id": routes[0], "zoom": 12}),
+                ],
+            ],
+            "answer": "Your heart rate rose steadily on a loop from home.",
+        },
+        {
+            "question": "Compare my two most recent routes and show me the photos.",
+            "rounds": [[
+                ("plot_route", {"activity_id": routes[0], "zoom": 12}),
+                ("plot_route", {"activity_id": routes[1], "zoom": 12}),
+                ("get_activity_photos", {"activity_id": routes[0], "max_resolution": 1000}),
+            ]],
+            "answer": "Both routes are loops.",
+        },
+        {
+            "question": "What is a good marathon training plan for me?",
+            "rounds": [[
+                ("query_data", {"query": "SELECT AVG(distance) AS avg_distance, AVG(average_speed) AS avg_speed FROM self WHERE sport_type = 'Run'"}),
+                ("search", {"query": "marathon training plan intermediate runner"}),
+            ]],
+            "answer": "Build up your long run gradually.",
+        },
+    ]
+
+
+# Shared clients and assets backed by the stand-ins, reusable across offline sessions
+def offline_shared(openai_latency=0.0, tavily_latency=0.0, script=()):
+    shared = SharedResources("offline", "offline")
+    shared.openai_client = ScriptedOpenAI(script, latency=openai_latency)
+    shared.tavily = FakeTavily(latency=tavily_latency)
+    return shared
+
+
+# A StravaGPT session for the athlete, talking only to the stand-ins
+def offline_session(athlete, shared=None, strava_latency=0.0):
+    shared = shared or offline_shared(script=conversation_script(athlete))
+    session = StravaGPT("offline", "http://localhost:5000/authorized", "offline", "offline", None, "offline", shared=shared)
+    session.client.client = FakeStravaClient(athlete, latency=strava_latency)
+    session.client.access_token = "offline"
+    return session
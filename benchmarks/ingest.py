@@ -0,0 +1,96 @@
+"""
+Benchmark activity ingest time against the number of activities.
+
+Run from the repository root:
+    python -m benchmarks.ingest
+    python -m benchmarks.ingest --sizes 1000 2000 4000 --legacy
+
+The time per activity should stay roughly flat as the count grows, showing that
+ingest is linear. Pass --legacy to compare against the old per-row pd.concat path, which
+needs pandas from requirements-dev.txt.
+"""
+import argparse
+import importlib.util
+import random
+import time
+from datetime import datetime, timedelta
+
+from schema import ACTIVITY_SCHEMA
+from ingest import activities_to_polars
+
+
+class SyntheticActivity:
+    def __init__(self, activity_id, start_date):
+        self.data = {
+            "id": activity_id,
+            "name": f"Activity {activity_id}",
+            "sport_type": random.choice(["Run", "Ride", "Swim", "Walk"]),
+            "distance": random.uniform(1000, 40000),
+            "moving_time": random.randint(600, 10000),
+            "elapsed_time": random.randint(600, 12000),
+            "total_elevation_gain": random.uniform(0, 800),
+            "start_date": start_date.isoformat(),
+            "start_latlng": [random.uniform(50, 55), random.uniform(-5, 1)],
+            "average_speed": random.uniform(2, 10),
+            "has_heartrate": True,
+            "average_heartrate": random.uniform(120, 170),
+            "map": {"id": f"a{activity_id}", "summary_polyline": "abc"},
+            "athlete": {"id": 1},
+        }
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+def synthetic_activities(count):
+    start = datetime(2020, 1, 1)
+    return (SyntheticActivity(i, start + timedelta(hours=i)) for i in range(count))
+
+
+# The legacy baseline needs pandas, which the app itself no longer depends on
+def legacy_available():
+    return importlib.util.find_spec("pandas") is not None
+
+
+# The previous ingest path, kept here only as a baseline for comparison
+def legacy_ingest(activities):
+    import pandas as pd
+    import polars as pl
+
+    df = pd.DataFrame(columns=list(ACTIVITY_SCHEMA))
+    for activity in activities:
+        df = pd.concat([df, pd.DataFrame([activity.to_dict()])], ignore_index=True)
+    return pl.from_pandas(df)
+
+
+def time_ingest(ingest, count, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        activities = synthetic_activities(count)
+        start = time.perf_counter()
+        ingest(activities)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 1000, 2000, 4000, 8000, 16000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--legacy", action="store_true", help="Also time the old pd.concat ingest")
+    args = parser.parse_args()
+    if args.legacy and not legacy_available():
+        parser.error("--legacy needs pandas, install it with pip install -r requirements-dev.txt")
+
+    random.seed(0)
+    print(f"{'activities':>10} {'ingest (s)':>12} {'us/activity':>12}" + (f" {'legacy (s)':>12}" if args.legacy else ""))
+    for count in args.sizes:
+        elapsed = time_ingest(activities_to_polars, count, args.repeats)
+        line = f"{count:>10} {elapsed:>12.4f} {elapsed / count * 1e6:>12.2f}"
+        if args.legacy:
+            line += f" {time_ingest(legacy_ingest, count, 1):>12.4f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
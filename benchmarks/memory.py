@@ -0,0 +1,82 @@
+"""
+Benchmark the memory held by a session's activity data.
+
+Run from the repository root:
+    python -m benchmarks.memory
+    python -m benchmarks.memory --sizes 1000 5000
+
+Each path runs in a fresh process. Steady-state is the growth in resident memory once the
+activity frames are built and the raw activities dropped, peak is the high-water mark of
+resident memory while building them. The legacy path keeps both the pandas frame and its
+polars copy alive, as sessions did before; the current path keeps only the polars frame.
+The legacy path needs pandas from requirements-dev.txt and is skipped without it.
+"""
+import argparse
+import multiprocessing
+import random
+import resource
+import sys
+
+from benchmarks.ingest import synthetic_activities, legacy_available, legacy_ingest
+from ingest import ingest_activities
+
+
+# Current resident memory of this process in bytes
+def _rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def _measure(path, count, results):
+    import pandas as pd
+
+    random.seed(0)
+    activities = list(synthetic_activities(count))
+    before = _rss()
+
+    if path == "legacy":
+        activities_pl = legacy_ingest(activities)
+        activities_df = pd.DataFrame([activity.to_dict() for activity in activities])
+        frame_bytes = activities_pl.estimated_size() + int(activities_df.memory_usage(deep=True).sum())
+    else:
+        activities_pl, nested = ingest_activities(activities)
+        frame_bytes = activities_pl.estimated_size() + sum(table.estimated_size() for table in nested.values())
+
+    del activities
+    results.put({
+        "steady": _rss() - before,
+        "peak": max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, _rss()) - before,
+        "frames": frame_bytes,
+    })
+
+
+def measure(path, count):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(path, count, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 4000])
+    args = parser.parse_args()
+
+    paths = ("legacy", "current")
+    if not legacy_available():
+        print("Skipping the legacy path, it needs pandas: pip install -r requirements-dev.txt", file=sys.stderr)
+        paths = ("current",)
+
+    mb = 1024 * 1024
+    print(f"{'activities':>10} {'path':>8} {'frames (MB)':>12} {'steady (MB)':>12} {'peak (MB)':>10}")
+    for count in args.sizes:
+        for path in paths:
+            result = measure(path, count)
+            print(f"{count:>10} {path:>8} {result['frames'] / mb:>12.2f} {result['steady'] / mb:>12.2f} {result['peak'] / mb:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
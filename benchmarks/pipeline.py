@@ -0,0 +1,196 @@
+"""
+Benchmark the chat pipeline end to end against offline stand-ins for Strava, OpenAI and Tavily.
+
+Run from the repository root:
+    python -m benchmarks.pipeline
+    python -m benchmarks.pipeline --sizes 100 1000 50000 --repeats 5 --output results.json
+    python -m benchmarks.pipeline --strava-latency 0.2 --openai-latency 0.8
+
+For each synthetic athlete size this times:
+    fetch_activities        cold sync into an empty store, and a warm restart from the store
+    index_features          the background feature index built after the sync
+    query_data              representative SQL queries, uncached and cached
+    get_activity_data       summaries of a new activity and of one already in the stream cache
+    plot_route              figure and route description of a new and of a cached activity
+    ask_question            a scripted four question conversation touching every tool
+
+Results are printed as a table and, with --output, written as JSON for tracking regressions.
+A benchmark whose call returns an error, or whose conversation has a failed tool call, fails
+the run rather than being timed as a fast call.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import polars as pl
+
+from benchmarks.fixtures import SyntheticAthlete, conversation_script, offline_session, offline_shared
+
+QUERIES = {
+    "count_by_sport": "SELECT sport_type, COUNT(*) AS activities, SUM(distance) AS distance FROM self GROUP BY sport_type",
+    "longest_runs": "SELECT id, name, distance FROM self WHERE sport_type = 'Run' ORDER BY distance DESC LIMIT 10",
+    "monthly_totals": (
+        "SELECT EXTRACT(YEAR FROM start_date) AS year, EXTRACT(MONTH FROM start_date) AS month, SUM(distance) AS distance "
+        "FROM self GROUP BY year, month ORDER BY year, month"
+    ),
+    "splits_join": "SELECT s.activity_id, AVG(s.moving_time) AS pace FROM splits_metric s GROUP BY s.activity_id LIMIT 20",
+}
+
+
+def _stats(samples):
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "max": max(samples),
+    }
+
+
+def _time(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def result(name, size, samples, **extra):
+    return {"benchmark": name, "activities": size, "repeats": len(samples), "seconds": _stats(samples), **extra}
+
+
+# Whether a pipeline call failed: tools return "Error: ..." strings, plot_route an (error, None) pair
+# and query_data None
+def is_error(value):
+    if isinstance(value, tuple):
+        value = value[0]
+    return value is None or isinstance(value, str) and value.startswith("Error")
+
+
+# Time fn once per argument, each call getting its own argument so cold runs stay cold
+def measure(name, size, fn, arguments, **extra):
+    samples = []
+    for argument in arguments:
+        started = time.perf_counter()
+        value = fn(argument)
+        samples.append(time.perf_counter() - started)
+        if is_error(value):
+            raise RuntimeError(f"{name} failed for {argument!r}: {value}")
+    return result(name, size, samples, **extra)
+
+
+# Sync each session, timing the sync and then the feature index it starts in the background
+def measure_fetch(name, size, sessions):
+    fetch_samples, index_samples = [], []
+    for session in sessions:
+        fetch_samples.append(_time(session.fetch_activities))
+        if session.sync_progress.state != "done":
+            raise RuntimeError(f"fetch_activities.{name} failed: {session.sync_progress.error}")
+        index_samples.append(_time(session.feature_thread.join))
+    requests = statistics.median(session.client.client.requests for session in sessions)
+    loaded = sessions[0].activities_pl.height
+    return [
+        result(f"fetch_activities.{name}", size, fetch_samples, strava_requests=requests, activities_loaded=loaded),
+        result(f"index_features.{name}", size, index_samples),
+    ]
+
+
+# Activities with routes that no benchmark has fetched streams for yet
+def fresh_routes(athlete, used, count):
+    return [a for a in athlete.recent_routes(len(used) + count) if a not in used][:count]
+
+
+def bench_size(size, repeats, latency):
+    # Every cold sync needs an athlete with an empty store
+    athletes = [SyntheticAthlete(size, seed=i) for i in range(repeats)]
+    results = measure_fetch("cold", size, [offline_session(athlete, strava_latency=latency["strava"]) for athlete in athletes])
+
+    # Restarts of the first athlete load its store and find nothing new to sync
+    athlete = athletes[0]
+    shared = offline_shared(latency["openai"], latency["tavily"], conversation_script(athlete))
+    restarts = [offline_session(athlete, shared, strava_latency=latency["strava"]) for _ in range(repeats)]
+    results += measure_fetch("warm", size, restarts)
+
+    session = restarts[-1]
+    for name, query in QUERIES.items():
+        def uncached(_):
+            session.query_cache.clear()
+            return session.query_data(query)
+        results.append(measure(f"query_data.{name}", size, uncached, range(repeats)))
+        results.append(measure(f"query_data.{name}.cached", size, lambda _: session.query_data(query), range(repeats)))
+
+    # Routes of the conversation are left cold for it. Ids are passed as strings, as the model sends them
+    used = athlete.recent_routes(2)
+    stream_types = ["heartrate", "altitude", "velocity_smooth", "cadence"]
+    activity_ids = fresh_routes(athlete, used, repeats)
+    results.append(measure("get_activity_data.cold", size, lambda a: session.get_activity_data(str(a), stream_types, "medium"), activity_ids))
+    results.append(measure("get_activity_data.cached", size, lambda a: session.get_activity_data(str(a), stream_types, "medium"), activity_ids))
+    activity_ids = fresh_routes(athlete, used + activity_ids, repeats)
+    results.append(measure("plot_route.cold", size, lambda a: session.plot_route(str(a), 12), activity_ids))
+    results.append(measure("plot_route.cached", size, lambda a: session.plot_route(str(a), 12), activity_ids))
+
+    # The conversation is replayed in a new session each time, starting from an empty query cache
+    script = conversation_script(athlete)
+
+    def conversation(chat):
+        for turn in script:
+            chat.ask_question(turn["question"])
+        failed = [tool.name for trace in chat.traces for iteration in trace.iterations for tool in iteration.tools if tool.error]
+        if failed:
+            raise RuntimeError(f"ask_question.conversation had failed tool calls: {', '.join(failed)}")
+        return chat
+
+    chats = []
+    for _ in range(repeats):
+        chat = offline_session(athlete, shared, strava_latency=latency["strava"])
+        chat.set_activities(session.activities_pl, session.store.scan_nested())
+        chat.load_system_prompt()
+        chats.append(chat)
+    results.append(measure("ask_question.conversation", size, conversation, chats, questions=len(script)))
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": sys.version.split()[0],
+        "polars": pl.__version__,
+        "platform": platform.platform(),
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--strava-latency", type=float, default=0.0, help="Seconds per Strava request")
+    parser.add_argument("--openai-latency", type=float, default=0.0, help="Seconds per OpenAI request")
+    parser.add_argument("--tavily-latency", type=float, default=0.0, help="Seconds per Tavily search")
+    parser.add_argument("--output", help="Write the results as JSON to this file, - for stdout")
+    args = parser.parse_args()
+
+    latency = {"strava": args.strava_latency, "openai": args.openai_latency, "tavily": args.tavily_latency}
+    report = {"environment": environment(), "latency": latency, "results": []}
+
+    print(f"{'benchmark':<34} {'activities':>10} {'min (ms)':>10} {'median (ms)':>12}", file=sys.stderr)
+    for size in args.sizes:
+        for entry in bench_size(size, args.repeats, latency):
+            report["results"].append(entry)
+            seconds = entry["seconds"]
+            print(f"{entry['benchmark']:<34} {size:>10} {seconds['min'] * 1e3:>10.2f} {seconds['median'] * 1e3:>12.2f}", file=sys.stderr)
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+    elif args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,94 @@
+import asyncio
 import base64
-import pandas as pd
-import polars as pl
+import hashlib
 import json
-from datetime import datetime
-import os
-from openai import OpenAI
-from tavily import TavilyClient
-import plotly.io as pio
-import requests
-
-from strava import Strava
+import time
+import polars as pl
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from collections import deque
+
+from strava import Strava, HISTORY_START
 from plotter import create_route_plot
-from constants import columns, tools, banner
+from route import describe_route
+from renderer import render_pool
+from ingest import ingest_activities
+from schema import describe_schema, to_utc
+from store import ActivityStore
+from sessions import SharedResources
+from summarise import summarise_streams
+from features import FEATURE_STREAMS, activity_features, features_frame
+from prefetch import Prefetcher, prefetch_order
+from sync import SyncProgress, batches, fetch_shards, newest_first, shard_count, shard_ranges, unseen
+from scheduler import scheduler, BULK, PREFETCH
+from context import ContextWindow, message_text
+from tracing import QuestionTrace, ToolSpan
+from query_cache import QueryCache
+from search import normalise_query, trim_results
+from log_config import preview
+from metrics import external_call, question_seconds, tool_loop_seconds, tool_seconds, tool_errors, openai_seconds, tavily_seconds
+from constants import banner, max_tool_workers, tool_concurrency, summary_max_points, trace_history, feature_index_limit, feature_index_batch, feature_stream_resolution, sync_page_size, sync_workers, vision_model, photo_description_workers, photo_batch_size, search_max_results
 
 import concurrent.futures
 import logging
+import threading
+
+
+# Cache key of a photo's description: its Strava unique id, or a hash of its URL, and the vision model
+def _photo_cache_key(photo):
+    photo_id = photo.get("id") or hashlib.sha256(photo["url"].encode()).hexdigest()
+    return f"{vision_model}:{photo_id}"
+
 
-# Set up logging configuration
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('run.log'),  # Logs to a file
-        logging.StreamHandler()  # Logs to console
-    ]
-)
-logging.getLogger("watchdog").setLevel(logging.WARNING)
+# Rough size of a Plotly figure from the data arrays of its traces
+def _figure_size(fig):
+    size = 0
+    for trace in fig.data:
+        for key in ("x", "y", "lat", "lon", "z"):
+            values = getattr(trace, key, None)
+            if values is not None:
+                size += len(values) * 8
+    return size
 
 
 class StravaGPT:
-    def __init__(self, client_id, redirect_uri, client_secret, openai_key, mapbox_access_token, tavily_api_key):
+    def __init__(self, client_id, redirect_uri, client_secret, openai_key, mapbox_access_token, tavily_api_key, shared=None):
         logging.info("Initializing StravaGPT with provided API keys and credentials.")
-        
+
+        # Sessions in a multi-user server share clients and read-only assets, standalone use gets its own
+        self.shared = shared or SharedResources(openai_key, tavily_api_key)
         self.mapbox_access_token = mapbox_access_token
-        self.openai_client = OpenAI(api_key=openai_key)
-        self.client = Strava(client_id, redirect_uri, client_secret)
-        self.tavily = TavilyClient(api_key=tavily_api_key)
-        self.tools = tools
+        self.openai_client = self.shared.openai_client
+        self.async_openai_client = self.shared.async_openai_client
+        self.client = Strava(client_id, redirect_uri, client_secret, requests_session=self.shared.strava_session)
+        self.tavily = self.shared.tavily
+        self.stream_cache = self.shared.stream_cache
+        self.tools = self.shared.tools
+        self.tool_semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in tool_concurrency.items()}
 
         # Initialize empty attributes to store fetched data
-        self.activities_df = pd.DataFrame(columns=columns)
+        self.athlete = None
+        self.store = None
+        self.activities = None
         self.activities_pl = None
+        self.nested_tables = {}  # Lazily scanned nested tables (laps, splits, ...) joined on activity_id
+        self.feature_thread = None  # Background thread building the feature index
+        self.sync_thread = None  # Background thread syncing activities from Strava
+        self.sync_progress = None
+        self.prefetcher = Prefetcher(self.get_streams, lambda: self.client.rate_usage)
         self.schema = None
+        self.data_version = 0  # Bumped whenever activities_pl changes, invalidating cached query results
+        self.sql_context = None
+        self.query_cache = QueryCache()
         self.system_prompt = None
         self.messages = []
+        self.context = ContextWindow()
         self.generated_plots = []  # Initialize an empty list to store generated plots
         self.images = []  # Initialize an empty list to store generated images
+        self.chat_history = []  # Messages and plots shown in the UI
+        self.last_time_to_first_token = None
+        self.traces = deque(maxlen=trace_history)  # Profiles of the most recent questions
+        self.last_trace = None
 
         logging.info("StravaGPT initialized successfully.")
 
@@ -55,50 +98,224 @@ class StravaGPT:
         self.client.authorise()
         logging.info("Strava client authorization complete.")
 
-    # Fetch the activities and prepare the data for further use
-    def fetch_activities(self):
+    # Get the authenticated athlete, fetching it from Strava only once
+    def get_athlete(self):
+        if self.athlete is None:
+            self.athlete = self.client.get_athlete()
+        return self.athlete
+
+    # Load the activities from the local store and sync any new ones from Strava, newest first
+    def fetch_activities(self, progress=None):
+        progress = progress or SyncProgress()
+        self.sync_progress = progress
         logging.info("Fetching activities from Strava.")
         try:
-            self.activities = self.client.get_activities()
-            logging.debug(f"Fetched activities.")
-            for activity in self.activities:
-                activity_dict = activity.to_dict()
-                self.activities_df = pd.concat([self.activities_df, pd.DataFrame([activity_dict])], ignore_index=True)
-
-            #check records in activities_df
-            logging.debug(f"Activities DataFrame shape: {self.activities_df.shape}")
-
-            if self.activities_df.shape[0] == 0:
+            self.store = ActivityStore(self.get_athlete().id)
+
+            # Returning users can start from the local store straight away
+            stored_activities_pl = self.store.load()
+            stored_nested = self.store.scan_nested()
+            if stored_activities_pl is not None:
+                logging.info("Loaded %s activities from local store.", stored_activities_pl.height)
+                self.set_activities(stored_activities_pl, stored_nested)
+
+            # Only ask Strava for activities newer than the last one synced
+            high_water_mark = self.store.high_water_mark()
+            progress.start(high_water_mark or HISTORY_START, stored=self.activities_pl.height if self.activities_pl is not None else 0)
+            logging.debug("Syncing activities after %s", high_water_mark)
+
+            # Ingest a page or shard at a time, making what has arrived so far queryable after each one
+            pages, nested_pages = [], {}
+            with scheduler.priority(BULK):
+                for page_pl, page_nested, span in self._sync_pages(high_water_mark):
+                    pages.append(page_pl)
+                    pages.sort(key=newest_first)
+                    for table, frame in page_nested.items():
+                        nested_pages.setdefault(table, []).append(frame)
+                    self._publish_snapshot(pages, nested_pages, stored_activities_pl, stored_nested)
+                    progress.page(page_pl, span)
+                    logging.debug("Synced page %s with %s activities", progress.pages, page_pl.height)
+
+            # Only the complete sync is stored, so an interrupted one never leaves a gap below the high-water mark
+            if pages:
+                new_activities_pl = pl.concat(pages, how="diagonal_relaxed")
+                new_nested = {table: pl.concat(frames, how="diagonal_relaxed") for table, frames in nested_pages.items()}
+                logging.debug("New activities DataFrame shape: %s", new_activities_pl.shape)
+                merged = self.store.merge(new_activities_pl, nested=new_nested, existing=stored_activities_pl)
+                self.set_activities(merged, self.store.scan_nested())
+
+            progress.finish()
+            if self.activities_pl is None:
                 logging.info("No activities found.")
                 return
 
-            # Convert the pandas DataFrame to a polars DataFrame and store its schema
-            self.activities_pl = pl.from_pandas(self.activities_df)
-            self.schema = self.activities_pl.schema
             logging.info("Activities fetched and processed into DataFrame.")
+            self.index_features()
+        except Exception as e:
+            logging.error("Error fetching activities: %s", e)
+            progress.fail(e)
+
+    # Fetch and ingest the activities started after a date, yielding (activities, nested tables, span) as they arrive.
+    # The newest page is always fetched first, so the chat opens on recent activities. A long history below it is
+    # then split into time shards fetched concurrently, a short one is paged through newest first
+    def _sync_pages(self, since):
+        start = since or HISTORY_START
+        self.activities = self.client.get_activities(start_date=since, newest_first=True)
+        pages = batches(self.activities, sync_page_size)
+        first = next(pages, None)
+        if first is None:
+            return
+        first_pl, first_nested = ingest_activities(first)
+        yield first_pl, first_nested, None
+
+        # A short first page was the whole history
+        boundary = first_pl["start_date"].min()
+        shards = shard_count(start, boundary) if len(first) == sync_page_size and boundary is not None else 1
+        if shards <= 1:
+            for page in pages:
+                yield *ingest_activities(page), None
+            return
+
+        # Shards reach a second past the oldest activity of the first page, so others starting with it are not missed
+        logging.info("Syncing activities from %s to %s in %s shards", start, boundary, shards)
+        seen = {activity.id for activity in first}
+        ranges = shard_ranges(start, to_utc(boundary) + timedelta(seconds=1), shards)
+        for shard_start, shard_end, activities in fetch_shards(self._fetch_shard, ranges, sync_workers):
+            activities_pl, nested = ingest_activities(unseen(activities, seen)[::-1])
+            yield activities_pl, nested, (shard_end - shard_start).total_seconds()
+
+    # Fetch the activities of one time shard, oldest first, on a worker thread
+    def _fetch_shard(self, start, end):
+        with scheduler.priority(BULK):
+            return list(self.client.get_activities(start_date=start, end_date=end))
+
+    # Make the stored activities and the pages synced so far queryable, newest first
+    def _publish_snapshot(self, pages, nested_pages, stored_activities_pl, stored_nested):
+        frames = pages + ([stored_activities_pl] if stored_activities_pl is not None else [])
+        nested = dict(stored_nested)
+        for table, new_frames in nested_pages.items():
+            lazy_frames = ([nested[table]] if table in nested else []) + [frame.lazy() for frame in new_frames]
+            nested[table] = pl.concat(lazy_frames, how="diagonal_relaxed")
+        self.set_activities(pl.concat(frames, how="diagonal_relaxed"), nested)
+
+    # Sync activities in a background thread, so the caller can carry on while the history loads
+    def start_sync(self):
+        if self.sync_thread is not None and self.sync_thread.is_alive():
+            return self.sync_progress
+        self.sync_progress = SyncProgress()
+        self.sync_thread = threading.Thread(target=self.fetch_activities, args=(self.sync_progress,), name="stravagpt-sync", daemon=True)
+        self.sync_thread.start()
+        return self.sync_progress
+
+    # Build the feature index of activities that are not indexed yet, most recent first, in a background thread
+    def index_features(self, limit=feature_index_limit):
+        if self.store is None or self.activities_pl is None:
+            return None
+        if self.feature_thread is not None and self.feature_thread.is_alive():
+            return self.feature_thread
+        self.feature_thread = threading.Thread(target=self._index_features, args=(limit,), name="stravagpt-features", daemon=True)
+        self.feature_thread.start()
+        return self.feature_thread
+
+    def _index_features(self, limit):
+        # Indexing is background work, so it only uses the share of Strava's rate limits left for prefetching
+        with scheduler.priority(PREFETCH):
+            self._index_features_batches(limit)
+
+    def _index_features_batches(self, limit):
+        try:
+            indexed = self.nested_tables["features"].select("activity_id").collect()["activity_id"]
+            activity_ids = (
+                self.activities_pl
+                # Manual activities have no streams to compute features from
+                .filter(~pl.col("id").is_in(indexed.implode()) & ~pl.col("manual").fill_null(False))
+                .head(limit)["id"]
+                .to_list()
+            )
+            logging.info("Indexing features of %s activities", len(activity_ids))
+
+            max_heart_rate = self._max_heart_rate()
+            rows = []
+            for activity_id in activity_ids:
+                try:
+                    streams = self.get_streams(activity_id, FEATURE_STREAMS, feature_stream_resolution)
+                    rows.append(activity_features(activity_id, streams, max_heart_rate))
+                except Exception as e:
+                    logging.error("Error computing features of activity %s: %s", activity_id, e)
+
+                if len(rows) >= feature_index_batch:
+                    self._save_features(rows)
+                    rows = []
+            if rows:
+                self._save_features(rows)
+        except Exception as e:
+            logging.error("Error indexing features: %s", e)
+
+    # Write feature rows to the store and make them queryable
+    def _save_features(self, rows):
+        self.store.merge_tables({"features": features_frame(rows)})
+        self.set_activities(self.activities_pl, self.store.scan_nested())
+        logging.info("Indexed features of %s activities", len(rows))
+
+    # Warm the stream cache with the activities the user is most likely to ask about while the session is idle
+    def start_prefetch(self):
+        if self.activities_pl is None:
+            return
+        interest = self.store.load_interest() if self.store is not None else {}
+        self.prefetcher.schedule(prefetch_order(self.activities_pl, interest))
+        self.prefetcher.start()
+
+    # Stop background work when the session ends
+    def close(self):
+        self.prefetcher.stop()
+
+    # Remember which activities the user asks about, so later sessions prefetch them first
+    def _record_interest(self, activity_id):
+        try:
+            if self.store is not None:
+                self.store.record_interest(activity_id)
         except Exception as e:
-            logging.error(f"Error fetching activities: {str(e)}")
+            logging.error("Error recording interest in activity %s: %s", activity_id, e)
+
+    # Replace the activities being queried, invalidating any cached query results
+    def set_activities(self, activities_pl, nested_tables=None):
+        if activities_pl is None or activities_pl.height == 0:
+            return
+
+        self.activities_pl = activities_pl
+        # The features table is always queryable, even before any activity has been indexed
+        self.nested_tables = {"features": features_frame().lazy(), **(nested_tables or {})}
+        self.schema = activities_pl.schema
+        self.sql_context = pl.SQLContext(frames={"self": activities_pl.lazy(), **self.nested_tables})
+        self.data_version += 1
+        self.query_cache.clear()
+        logging.debug("Activities updated to version %s with %s rows", self.data_version, activities_pl.height)
+
+    # Describe the activities table and the nested tables compactly for the system prompt
+    def describe_tables(self):
+        if self.schema is None:
+            return "No activities"
+        description = f"self({describe_schema(self.schema)})"
+        for table, frame in self.nested_tables.items():
+            description += f"; {table}({describe_schema(frame.collect_schema())})"
+        return description
 
     # Load the system prompt template from a file
     def load_system_prompt(self):
         logging.info("Loading system prompt template.")
         try:
-            package_dir = os.path.dirname(__file__)
-            system_prompt_path = os.path.join(package_dir, "system_prompt.txt")
-
-            with open(system_prompt_path, "r") as f:
-                self.system_prompt = f.read().replace("***schema***", str(self.schema))
+            self.system_prompt = self.shared.system_prompt_template.replace("***schema***", self.describe_tables())
 
             self.system_prompt = self.system_prompt.replace("***current_date***", str(datetime.now()))
             logging.info("System prompt loaded successfully.")
         except Exception as e:
-            logging.error(f"Error loading system prompt: {str(e)}")
+            logging.error("Error loading system prompt: %s", e)
 
     # Update the system prompt with athlete data and stats
     def update_system_prompt_with_data(self):
         logging.info("Updating system prompt with athlete data and statistics.")
         try:
-            athlete = self.client.get_athlete()
+            athlete = self.get_athlete()
             athlete_data = {
                 "name": athlete.firstname + " " + athlete.lastname,
                 "sex": athlete.sex,
@@ -114,7 +331,7 @@ class StravaGPT:
             self.messages.append({"role": "system", "content": self.system_prompt})
             logging.info("System prompt updated with athlete data and stats.")
         except Exception as e:
-            logging.error(f"Error updating system prompt with data: {str(e)}")
+            logging.error("Error updating system prompt with data: %s", e)
 
     # Helper method to extract athlete statistics
     def _extract_athlete_stats(self, athlete_stats_data):
@@ -150,7 +367,7 @@ class StravaGPT:
                 }
             ]
         except Exception as e:
-            logging.error(f"Error extracting athlete stats: {str(e)}")
+            logging.error("Error extracting athlete stats: %s", e)
             return []
 
     # Encode image to base64
@@ -159,254 +376,553 @@ class StravaGPT:
         try:
             return base64.b64encode(image_bytes).decode('utf-8')
         except Exception as e:
-            logging.error(f"Error encoding image: {str(e)}")
+            logging.error("Error encoding image: %s", e)
             return None
 
-    # Query data using SQL
+    # Query data using SQL, serving repeated queries from the query cache
     def query_data(self, query):
-        logging.info(f"Querying data with query: {query}")
+        logging.info("Querying data with query: %s", query)
         try:
-            return self.activities_pl.sql(query)
+            version = self.data_version
+            result = self.query_cache.get(query, version)
+            if result is not None:
+                return result
+
+            # Run the query lazily so polars can push projections and predicates down
+            result = self.sql_context.execute(query, eager=False).collect()
+            self.query_cache.put(query, version, result)
+            return result
         except Exception as e:
-            logging.error(f"Error querying data: {str(e)}")
+            logging.error("Error querying data: %s", e)
             return None
 
     # Generate image description using OpenAI Vision capabilities
     def generate_image_description(self, image_url):
-        logging.info(f"Generating image description for image at: {image_url}")
+        logging.info("Generating image description for image at: %s", image_url)
         try:
-            messages = [
-                {
-                    "role": "system",
-                    "content": "You are an assistant that provides detailed descriptions of images."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Describe the image"},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_url
-                            },
+            # Concurrent requests to describe the same image, from any session, share one vision call
+            return self.shared.single_flight.do(("describe_image", image_url), lambda: self._describe_image(image_url))
+        except Exception as e:
+            logging.error("Error generating image description: %s", e)
+            return None
+
+    # Ask the vision model to describe one image
+    def _describe_image(self, image_url):
+        messages = [
+            {
+                "role": "system",
+                "content": "You are an assistant that provides detailed descriptions of images."
+            },
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Describe the image"},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url
                         },
-                    ]
-                },
-            ]
+                    },
+                ]
+            },
+        ]
 
+        with external_call("openai"), openai_seconds.labels("vision").time():
             response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
+                model=vision_model,
                 messages=messages,
                 temperature=0.5,
                 max_tokens=300,
             )
 
-            return response.choices[0].message.content
-        except Exception as e:
-            logging.error(f"Error generating image description: {str(e)}")
-            return None
+        return response.choices[0].message.content
+
+    # Ask the vision model to describe several images in one request, returning a description per image
+    def _describe_images(self, image_urls):
+        content = [{
+            "type": "text",
+            "text": f"Describe each of these {len(image_urls)} images. Reply with a JSON object "
+                    "{\"descriptions\": [...]} holding one description per image, in the order given.",
+        }]
+        content += [{"type": "image_url", "image_url": {"url": image_url}} for image_url in image_urls]
+        messages = [
+            {"role": "system", "content": "You are an assistant that provides detailed descriptions of images."},
+            {"role": "user", "content": content},
+        ]
+
+        with external_call("openai"), openai_seconds.labels("vision_batch").time():
+            response = self.openai_client.chat.completions.create(
+                model=vision_model,
+                messages=messages,
+                temperature=0.5,
+                max_tokens=300 * len(image_urls),
+                response_format={"type": "json_object"},
+            )
+
+        descriptions = json.loads(response.choices[0].message.content).get("descriptions")
+        if not isinstance(descriptions, list) or len(descriptions) != len(image_urls):
+            raise ValueError(f"Expected {len(image_urls)} descriptions in the batched vision response")
+        return [str(description) for description in descriptions]
 
-    # Plot route and return the figure and description
+    # Describe a batch of image URLs, falling back to one request per image if the batched request fails
+    def _describe_batch(self, image_urls):
+        if len(image_urls) > 1:
+            try:
+                return self.shared.single_flight.do(("describe_images", tuple(image_urls)), lambda: self._describe_images(image_urls))
+            except Exception as e:
+                logging.warning("Batched image description failed, describing images one by one: %s", e)
+        return [self.generate_image_description(image_url) for image_url in image_urls]
+
+    # Describe photos, serving descriptions from the persistent cache and sending the rest to the vision model
+    def describe_photos(self, photos):
+        cache = self.shared.photo_descriptions
+        keys = [_photo_cache_key(photo) for photo in photos]
+        descriptions = cache.get_many(keys)
+
+        pending = {key: photo["url"] for key, photo in zip(keys, photos) if key not in descriptions}
+        if pending:
+            batch_size = max(photo_batch_size, 1)
+            items = list(pending.items())
+            batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+            # Bounded, so an activity with many photos cannot flood the vision API
+            with concurrent.futures.ThreadPoolExecutor(max_workers=photo_description_workers) as executor:
+                results = executor.map(lambda batch: self._describe_batch([url for _, url in batch]), batches)
+                for batch, batch_descriptions in zip(batches, results):
+                    for (key, _), description in zip(batch, batch_descriptions):
+                        if description is not None:
+                            cache.put(key, description)
+                            descriptions[key] = description
+
+        logging.info("Described %s photos, %s from the cache", len(photos), len(photos) - len(pending))
+        return [descriptions.get(key) for key in keys]
+
+    # Get activity streams, only asking Strava for the types that are not in this athlete's cache yet
+    def get_streams(self, activity_id, stream_types, resolution):
+        athlete_id = self.get_athlete().id
+        streams, missing = self.stream_cache.get(athlete_id, activity_id, stream_types, resolution)
+        if missing:
+            fetched = self.client.get_activity_streams(activity_id, types=missing, resolution=resolution)
+            streams.update(self.stream_cache.put(athlete_id, activity_id, resolution, fetched, requested=missing))
+        return {stream_type: streams[stream_type] for stream_type in stream_types if stream_type in streams}
+
+    # Plot route and return the figure and a geometric description of the route
     def plot_route(self, activity_id, zoom):
-        logging.info(f"Plotting route for activity ID: {activity_id} with zoom level: {zoom}")
+        logging.info("Plotting route for activity ID: %s with zoom level: %s", activity_id, zoom)
         try:
-            streams = self.client.get_activity_streams(activity_id, types=["latlng"], resolution="medium")
+            streams = self.get_streams(activity_id, ["latlng", "altitude"], resolution="medium")
             fig = create_route_plot(streams["latlng"], self.mapbox_access_token, zoom)
 
-            # Convert figure to image and encode to base64
-            image_bytes = fig.to_image(format="jpeg")
-            image_base64 = self.encode_image(image_bytes)
-            image_url = f"data:image/jpeg;base64,{image_base64}"
-
-            # Generate description of the plot
-            description = self.generate_image_description(image_url)
+            # Describe the route from its coordinates, the figure is only rasterised if an image is needed
+            altitude = streams["altitude"].data if "altitude" in streams else None
+            description = describe_route(streams["latlng"].data, altitude, gazetteer=self.shared.gazetteer)
 
-            logging.info(f"Route plotted successfully for activity ID: {activity_id}")
+            logging.info("Route plotted successfully for activity ID: %s", activity_id)
             return fig, description  # Return the Plotly figure and description
         except Exception as e:
-            logging.error(f"Error plotting route: {str(e)}")
+            logging.error("Error plotting route: %s", e)
             return f"Error: {str(e)}", None
 
-    # Get activity data
-    def get_activity_data(self, activity_id, stream_types, resolution):
-        logging.info(f"Fetching activity data for activity ID: {activity_id}")
+    # Rasterise a generated plot, for frontends that cannot show interactive figures
+    def render_image(self, fig, format="png"):
+        return render_pool.render(fig, format=format)
+
+    # Get the athlete's max heart rate from their activities, if any recorded one
+    def _max_heart_rate(self):
         try:
-            streams = self.client.get_activity_streams(activity_id, types=stream_types, resolution=resolution)
-            return list(zip(*[streams[key].data for key in streams.keys()]))
+            return self.activities_pl["max_heartrate"].cast(pl.Float64, strict=False).max()
+        except Exception:
+            return None
+
+    # Get activity data, summarised unless the raw data points are asked for
+    def get_activity_data(self, activity_id, stream_types, resolution, detail="summary", max_points=summary_max_points):
+        logging.info("Fetching activity data for activity ID: %s", activity_id)
+        try:
+            if detail == "raw":
+                streams = self.get_streams(activity_id, stream_types, resolution)
+                return list(zip(*[streams[key].data.tolist() for key in streams.keys()]))
+
+            # Time and distance are needed for zones and splits, and are served from the cache after the first call
+            summary_types = list(dict.fromkeys([*stream_types, "time", "distance"]))
+            streams = self.get_streams(activity_id, summary_types, resolution)
+            summary = summarise_streams(streams, max_points, max_heart_rate=self._max_heart_rate())
+            summary["activity_id"] = activity_id
+            return summary
         except Exception as e:
-            logging.error(f"Error fetching activity data: {str(e)}")
+            logging.error("Error fetching activity data: %s", e)
             return f"Error: {str(e)}"
 
-    # Get activity photos and generate descriptions in parallel
+    # Get activity photos and their descriptions
     def get_activity_photos(self, activity_id, max_resolution=2000):
-        logging.info(f"Fetching activity photos for activity ID: {activity_id}")
+        logging.info("Fetching activity photos for activity ID: %s", activity_id)
         try:
             photos = self.client.get_activity_photos(activity_id, max_resolution)
+            descriptions = self.describe_photos(photos)
+            photo_descriptions = [
+                {"url": photo["url"], "description": description}
+                for photo, description in zip(photos, descriptions)
+            ]
 
-            def process_photo(photo_url):
-                try:
-                    # Generate description
-                    description = self.generate_image_description(photo_url)
-
-                    return {
-                        "url": photo_url,
-                        "description": description
-                    }
-                except Exception as e:
-                    logging.error(f"Error processing photo: {str(e)}")
-                    return {
-                        "url": photo_url,
-                        "description": f"Error in processing image: {str(e)}"
-                    }
-
-            # Process photos in parallel
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                photo_descriptions = list(executor.map(process_photo, photos))
-
-            logging.info(f"Fetched and processed {len(photo_descriptions)} photos for activity ID: {activity_id}")
+            logging.info("Fetched and processed %s photos for activity ID: %s", len(photo_descriptions), activity_id)
             return photo_descriptions
         except Exception as e:
-            logging.error(f"Error fetching activity photos: {str(e)}")
+            logging.error("Error fetching activity photos: %s", e)
             return []
 
+    # Search the web, serving repeated searches from the cache and keeping only what the model needs of each result
     def search(self, query):
-        logging.info(f"Performing search with query: {query}")
-        return self.tavily.search(query)
-
-    # Process tool calls
-    def process_tool_calls(self, messages, response):
-        for tool_call in response.choices[0].message.tool_calls:
-            tool_name = tool_call.function.name
-            tool_id = tool_call.id
-            tool_args = json.loads(tool_call.function.arguments)
-            logging.info(f"Processing tool call: {tool_name} with arguments: {tool_args}")
+        logging.info("Performing search with query: %s", query)
+        key = normalise_query(query)
+        results = self.shared.search_results.get(key)
+        if results is not None:
+            logging.debug("Search cache hit for: %s", key)
+            return results
+
+        # Concurrent identical searches, from any session, share one Tavily request
+        results = self.shared.single_flight.do(
+            ("search", key),
+            lambda: trim_results(self._tavily_search(query)),
+        )
+        self.shared.search_results.put(key, results)
+        return results
+
+    # Send a search to Tavily
+    def _tavily_search(self, query):
+        with external_call("tavily"), tavily_seconds.time():
+            return self.tavily.search(query, max_results=search_max_results)
+
+    # Run a single tool call and return its result message and any generated plot
+    def run_tool_call(self, tool_call):
+        tool_name = tool_call.function.name
+        tool_id = tool_call.id
+        tool_args = json.loads(tool_call.function.arguments)
+        logging.info("Processing tool call: %s with arguments: %s", tool_name, preview(tool_args))
+        if "activity_id" in tool_args:
+            self._record_interest(tool_args["activity_id"])
+
+        # Bound how many calls of each tool run at once so Strava-backed tools stay within rate limits
+        semaphore = self.tool_semaphores.get(tool_name)
+        if semaphore is None:
+            logging.error("Unknown tool call: %s", tool_name)
+            return {"role": "tool", "tool_call_id": tool_id, "content": f"Error: Unknown tool {tool_name}"}, None
+
+        with semaphore:
+            plot = None
 
             if tool_name == "query_data":
                 logging.info("Processing query_data tool call")
-                messages.append(response.choices[0].message)
                 sql_query = tool_args["query"]
-                logging.info(f"SQL query: {sql_query}")
+                logging.info("SQL query: %s", sql_query)
                 try:
                     result = str(self.query_data(sql_query).to_dicts())
-                    logging.info(f"Query result: {result}")
+                    logging.info("Query result: %s", preview(result))
                 except Exception as e:
                     result = {"Error": str(e)}
-
-                tool_call_result_message = {
-                    "role": "tool",
-                    "tool_call_id": tool_id,
-                    "content": json.dumps(result)
-                }
-                messages.append(tool_call_result_message)
-                logging.info(f"Tool call result message: {tool_call_result_message}")
+                content = json.dumps(result)
 
             elif tool_name == "get_activity_data":
                 logging.info("Processing get_activity_data tool call")
-                messages.append(response.choices[0].message)
                 activity_id = tool_args["activity_id"]
                 stream_types = tool_args["stream_types"]
                 resolution = tool_args["resolution"]
-                logging.info(f"Activity ID: {activity_id}, stream types: {stream_types}, resolution: {resolution}")
-                result = self.get_activity_data(activity_id, stream_types, resolution)
-                tool_call_result_message = {
-                    "role": "tool",
-                    "tool_call_id": tool_id,
-                    "content": json.dumps(result)
-                }
-                messages.append(tool_call_result_message)
-                logging.info(f"Tool call result message: {tool_call_result_message}")
+                detail = tool_args.get("detail", "summary")
+                max_points = tool_args.get("max_points", summary_max_points)
+                logging.info("Activity ID: %s, stream types: %s, resolution: %s, detail: %s", activity_id, stream_types, resolution, detail)
+                result = self.get_activity_data(activity_id, stream_types, resolution, detail, max_points)
+                content = json.dumps(result)
 
             elif tool_name == "plot_route":
                 logging.info("Processing plot_route tool call")
-                messages.append(response.choices[0].message)
-
                 activity_id = tool_args["activity_id"]
                 zoom = tool_args["zoom"]
-                logging.info(f"Activity ID: {activity_id}, zoom: {zoom}")
+                logging.info("Activity ID: %s, zoom: %s", activity_id, zoom)
                 result, description = self.plot_route(activity_id, zoom)
 
                 if isinstance(result, str) and "Error" in result:
                     logging.error("Error plotting route")
-                    tool_call_result_message = {
-                        "role": "tool",
-                        "tool_call_id": tool_id,
-                        "content": result
-                    }
-                    messages.append(tool_call_result_message)
+                    content = result
                 else:
-                    logging.info(f"Successfully plotted route for {activity_id} with description: {description}")
+                    logging.info("Successfully plotted route for %s with description: %s", activity_id, preview(description))
                     # result is the figure
-                    self.generated_plots.append(result)  # Store the figure
+                    plot = result
                     # Add description to the conversation
-                    tool_call_result_message = {
-                        "role": "tool",
-                        "tool_call_id": tool_id,
-                        "content": f"Plot generated for activity {activity_id}. Description: {description}"
-                    }
-                    messages.append(tool_call_result_message)
+                    content = json.dumps({"plot": f"Route map of activity {activity_id} shown to the user", "route": description})
 
             elif tool_name == "get_activity_photos":
                 logging.info("Processing get_activity_photos tool call")
-                messages.append(response.choices[0].message)
                 activity_id = tool_args["activity_id"]
                 max_resolution = tool_args.get("max_resolution", 250)
-                logging.info(f"Activity ID: {activity_id}, max resolution: {max_resolution}")
+                logging.info("Activity ID: %s, max resolution: %s", activity_id, max_resolution)
                 result = self.get_activity_photos(activity_id, max_resolution)
-
-                tool_call_result_message = {
-                    "role": "tool",
-                    "tool_call_id": tool_id,
-                    "content": json.dumps(result)
-                }
-                messages.append(tool_call_result_message)
-                logging.info(f"Tool call result message: {tool_call_result_message}")
+                content = json.dumps(result)
 
             elif tool_name == "search":
-                messages.append(response.choices[0].message)
                 query = tool_args["query"]
-                logging.info(f"Doing search with query: {query}")
+                logging.info("Doing search with query: %s", query)
                 result = self.search(query)
-                tool_call_result_message = {
-                    "role": "tool",
-                    "tool_call_id": tool_id,
-                    "content": json.dumps(result)
-                }
-                messages.append(tool_call_result_message)
-                logging.info(f"Tool call result message: {tool_call_result_message}")
-
+                content = json.dumps(result)
+
+            elif tool_name == "get_stored_result":
+                ref = tool_args["ref"]
+                logging.info("Fetching stored result: %s", ref)
+                content = self.context.get_stored_result(ref) or f"Error: No stored result with ref {ref}"
+
+        tool_call_result_message = {
+            "role": "tool",
+            "tool_call_id": tool_id,
+            "content": content
+        }
+        logging.info("Tool call result message: %s", preview(tool_call_result_message))
+        return tool_call_result_message, plot
+
+    # Run a tool call, turning any unexpected failure into an error result message, and profile it
+    def _safe_run_tool_call(self, tool_call):
+        started = time.perf_counter()
+        strava_calls = self.client.thread_api_calls()
+        try:
+            tool_call_result_message, plot = self.run_tool_call(tool_call)
+            error = str(tool_call_result_message["content"]).startswith("Error")
+        except Exception as e:
+            logging.error("Error processing tool call %s: %s", tool_call.function.name, e)
+            tool_call_result_message, plot = {"role": "tool", "tool_call_id": tool_call.id, "content": f"Error: {str(e)}"}, None
+            error = True
+
+        span = ToolSpan(
+            name=tool_call.function.name,
+            tool_call_id=tool_call.id,
+            seconds=time.perf_counter() - started,
+            strava_calls=self.client.thread_api_calls() - strava_calls,
+            error=error
+        )
+        tool_seconds.labels(span.name).observe(span.seconds)
+        if error:
+            tool_errors.labels(span.name).inc()
+        return tool_call_result_message, plot, span
+
+    # Append the assistant message and the results of its tool calls to the conversation in tool call order
+    def _append_tool_results(self, messages, assistant_message, results, iteration=None):
+        messages.append(assistant_message)
+        for tool_call_result_message, plot, span in results:
+            messages.append(tool_call_result_message)
+            if plot is not None:
+                self.generated_plots.append(plot)  # Store the figure
+            if iteration is not None:
+                iteration.tools.append(span)
         return messages
 
-    # Ask question and handle the conversation
-    def ask_question(self, question):
-        logging.info(f"User: {question}")
-        self.generated_plots = []  # Reset generated plots
-        self.messages.append({"role": "user", "content": question})
+    # Process tool calls, running the calls from one assistant turn concurrently
+    def process_tool_calls(self, messages, response, iteration=None):
+        tool_calls = response.choices[0].message.tool_calls
+        max_workers = min(max_tool_workers, len(tool_calls))
 
-        response = self.openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=self.messages,
-            tools=self.tools,
-            temperature=0.3
-        )
+        with tool_loop_seconds.time(), concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(self._safe_run_tool_call, tool_calls))
 
-        while response.choices[0].finish_reason == "tool_calls":
-            logging.info("Processing tool calls")
-            self.messages = self.process_tool_calls(self.messages, response)
+        return self._append_tool_results(messages, response.choices[0].message, results, iteration)
 
+    # Request a chat completion and record its latency and token usage in the trace
+    def _create_completion(self, trace):
+        iteration = trace.start_iteration()
+        started = time.perf_counter()
+        with external_call("openai"):
             response = self.openai_client.chat.completions.create(
                 model="gpt-4o-mini",
-                messages=self.messages,
+                messages=self.context.fit(self.messages),
                 tools=self.tools,
                 temperature=0.3
             )
-        logging.info("Done processing tool calls")
+        iteration.model_seconds = time.perf_counter() - started
+        openai_seconds.labels("chat").observe(iteration.model_seconds)
+        iteration.finish_reason = response.choices[0].finish_reason
+        trace.record_usage(iteration, response.usage)
+        return response
+
+    # Keep the finished trace of a question and log it as one structured line
+    def _finish_trace(self, trace, mode):
+        trace.finish()
+        question_seconds.labels(mode).observe(trace.seconds)
+        self.traces.append(trace)
+        self.last_trace = trace
+        logging.info("Question trace: %s", preview(trace.to_dict(), limit=None))
 
-        # Append assistant's final message to the conversation
-        self.messages.append({"role": "assistant", "content": response.choices[0].message.content})
+    # Ask question and handle the conversation
+    def ask_question(self, question):
+        # Background prefetching yields to the question being answered
+        with self.prefetcher.foreground():
+            logging.info("User: %s", question)
+            self.generated_plots = []  # Reset generated plots
+            self.messages.append({"role": "user", "content": question})
+
+            trace = QuestionTrace(question)
+            response = self._create_completion(trace)
+
+            while response.choices[0].finish_reason == "tool_calls":
+                logging.info("Processing tool calls")
+                self.messages = self.process_tool_calls(self.messages, response, trace.iterations[-1])
+                response = self._create_completion(trace)
+            logging.info("Done processing tool calls")
+
+            # Append assistant's final message to the conversation
+            self.messages.append({"role": "assistant", "content": response.choices[0].message.content})
+
+            logging.info("Assistant: %s", response.choices[0].message.content)
+            self._finish_trace(trace, "ask")
+
+            return response.choices[0].message.content, self.generated_plots
+
+    # Ask question and stream tokens and tool progress events as they arrive
+    async def ask_question_stream(self, question):
+        """
+        Answer a question using the async OpenAI client with streamed output.
+
+        Yields event dictionaries:
+        {"type": "token", "content": str}
+            A chunk of the assistant's answer.
+        {"type": "tool_start", "id": str, "name": str, "arguments": dict}
+            A tool call has been dispatched.
+        {"type": "tool_end", "id": str, "name": str, "elapsed": float}
+            A tool call has finished.
+        {"type": "done", "content": str, "plots": list, "time_to_first_token": float}
+            The final answer, any generated plots and the seconds until the first answer token.
+        """
+        logging.info("User: %s", question)
+        self.generated_plots = []  # Reset generated plots
+        self.messages.append({"role": "user", "content": question})
 
-        logging.info(f"Assistant: {response.choices[0].message.content}")
+        started = time.perf_counter()
+        time_to_first_token = None
+        trace = QuestionTrace(question)
 
-        return response.choices[0].message.content, self.generated_plots
+        while True:
+            iteration = trace.start_iteration()
+            iteration_started = time.perf_counter()
+            with external_call("openai"):
+                stream = await self.async_openai_client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=self.context.fit(self.messages),
+                    tools=self.tools,
+                    temperature=0.3,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+
+            content_parts = []
+            tool_call_parts = {}
+            finish_reason = None
+
+            async for chunk in stream:
+                # The last chunk carries the token usage of the whole request and no choices
+                if chunk.usage is not None:
+                    trace.record_usage(iteration, chunk.usage)
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                delta = choice.delta
+
+                if delta.content:
+                    if time_to_first_token is None:
+                        time_to_first_token = time.perf_counter() - started
+                        logging.info("Time to first token: %.3fs", time_to_first_token)
+                    content_parts.append(delta.content)
+                    yield {"type": "token", "content": delta.content}
+
+                # Tool calls arrive as fragments that have to be stitched together by index
+                for tool_call_delta in delta.tool_calls or []:
+                    part = tool_call_parts.setdefault(tool_call_delta.index, {"id": None, "name": "", "arguments": ""})
+                    if tool_call_delta.id:
+                        part["id"] = tool_call_delta.id
+                    if tool_call_delta.function and tool_call_delta.function.name:
+                        part["name"] += tool_call_delta.function.name
+                    if tool_call_delta.function and tool_call_delta.function.arguments:
+                        part["arguments"] += tool_call_delta.function.arguments
+
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+
+            iteration.model_seconds = time.perf_counter() - iteration_started
+            iteration.finish_reason = finish_reason
+            openai_seconds.labels("chat_stream").observe(iteration.model_seconds)
+            if finish_reason != "tool_calls":
+                break
+
+            logging.info("Processing tool calls")
+            tool_calls = [
+                SimpleNamespace(id=part["id"], function=SimpleNamespace(name=part["name"], arguments=part["arguments"]))
+                for _, part in sorted(tool_call_parts.items())
+            ]
+            assistant_message = {
+                "role": "assistant",
+                "content": "".join(content_parts) or None,
+                "tool_calls": [
+                    {
+                        "id": tool_call.id,
+                        "type": "function",
+                        "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments}
+                    }
+                    for tool_call in tool_calls
+                ]
+            }
+
+            async def run(index, tool_call):
+                return index, await asyncio.to_thread(self._safe_run_tool_call, tool_call)
+
+            for tool_call in tool_calls:
+                try:
+                    arguments = json.loads(tool_call.function.arguments)
+                except ValueError:
+                    arguments = {}
+                yield {"type": "tool_start", "id": tool_call.id, "name": tool_call.function.name, "arguments": arguments}
+
+            # Report each tool as it finishes, then append the results in tool call order
+            results = [None] * len(tool_calls)
+            tools_started = time.perf_counter()
+            for task in asyncio.as_completed([run(i, tool_call) for i, tool_call in enumerate(tool_calls)]):
+                index, result = await task
+                results[index] = result
+                tool_call = tool_calls[index]
+                yield {"type": "tool_end", "id": tool_call.id, "name": tool_call.function.name, "elapsed": result[2].seconds}
+
+            tool_loop_seconds.observe(time.perf_counter() - tools_started)
+            self._append_tool_results(self.messages, assistant_message, results, iteration)
+
+        logging.info("Done processing tool calls")
+        content = "".join(content_parts)
+
+        # Append assistant's final message to the conversation
+        self.messages.append({"role": "assistant", "content": content})
+        self.last_time_to_first_token = time_to_first_token
+        trace.time_to_first_token = time_to_first_token
+
+        logging.info("Assistant: %s", content)
+        self._finish_trace(trace, "stream")
+        yield {"type": "done", "content": content, "plots": self.generated_plots, "time_to_first_token": time_to_first_token}
+
+    # Iterate over the events of ask_question_stream from synchronous code such as Streamlit
+    def stream_question(self, question):
+        # Run on the shared event loop so the async OpenAI client can keep its connections open
+        events = self.ask_question_stream(question)
+        with self.prefetcher.foreground():
+            try:
+                while True:
+                    try:
+                        yield self.shared.run(events.__anext__())
+                    except StopAsyncIteration:
+                        break
+            finally:
+                self.shared.run(events.aclose())
+
+    # Estimate the memory held by this session in bytes
+    def memory_usage(self):
+        total = 0
+        if self.activities_pl is not None:
+            total += self.activities_pl.estimated_size()
+        total += sum(result.estimated_size() for result in list(self.query_cache.entries.values()))
+        total += sum(len(message_text(message)) for message in list(self.messages))
+        total += sum(len(result) for result in list(self.context.stored_results.values()))
+
+        plots = list(self.generated_plots) + [fig for message in self.chat_history for fig in message.get("plots") or []]
+        total += sum(_figure_size(fig) for fig in {id(fig): fig for fig in plots}.values())
+        return total
 
     # Chat indefinitely (if used outside Streamlit)
     def chat_indefinitely(self):
@@ -427,12 +943,27 @@ class StravaGPT:
                     print("Goodbye!")
                     break
                 
-                # Process the user's input and get the response
-                response_text, _ = self.ask_question(user_input)
-                
-                # Print the assistant's response
-                print(f"Assistant > {response_text}")
+                # Print the assistant's response and tool progress as it streams in
+                print("Assistant > ", end="", flush=True)
+                for event in self.stream_question(user_input):
+                    if event["type"] == "token":
+                        print(event["content"], end="", flush=True)
+                    elif event["type"] == "tool_start":
+                        print(f"\n  [running {event['name']}...]", end="", flush=True)
+                    elif event["type"] == "tool_end":
+                        print(f"\n  [{event['name']} done in {event['elapsed']:.1f}s]", end="", flush=True)
+                    elif event["type"] == "done":
+                        if event["time_to_first_token"] is not None:
+                            print(f"\n  [first token after {event['time_to_first_token']:.2f}s]", end="")
+                        print()
+
+                        # The terminal cannot show interactive plots, so rasterise them to files in one render pass
+                        for i, image in enumerate(render_pool.render_many(event["plots"])):
+                            output_file = f"plot_{int(time.time())}_{i}.png"
+                            with open(output_file, "wb") as f:
+                                f.write(image)
+                            print(f"  [plot saved to {output_file}]")
             
             except Exception as e:
                 # Handle any exceptions in a graceful way
-                print(f"Error: {str(e)}. Please try again.")
\ No newline at end of file
+                print(f"Error: {str(e)}. Please try again.")
@@ -1,19 +1,115 @@
-columns = [
-            "id", "achievement_count", "athlete", "athlete_count", "average_speed", "average_watts",
-            "comment_count", "commute", "device_watts", "distance", "elapsed_time", "elev_high",
-            "elev_low", "end_latlng", "external_id", "flagged", "gear_id", "has_kudoed",
-            "hide_from_home", "kilojoules", "kudos_count", "manual", "map", "max_speed", "max_watts",
-            "moving_time", "name", "photo_count", "private", "sport_type", "start_date",
-            "start_date_local", "start_latlng", "timezone", "total_elevation_gain", "total_photo_count",
-            "trainer", "type", "upload_id", "upload_id_str", "weighted_average_watts", "workout_type",
-            "best_efforts", "calories", "description", "device_name", "embed_token", "gear", "laps",
-            "photos", "segment_efforts", "splits_metric", "splits_standard", "guid", "utc_offset",
-            "location_city", "location_state", "location_country", "start_latitude", "start_longitude",
-            "pr_count", "suffer_score", "has_heartrate", "average_heartrate", "max_heartrate",
-            "average_cadence", "average_temp", "instagram_primary_photo", "partner_logo_url",
-            "partner_brand_tag", "from_accepted_tag", "segment_leaderboard_opt_out", "perceived_exertion"
-        ]
+import os
 
+# Directory holding the local activity store and caches
+data_dir = os.getenv("STRAVAGPT_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".stravagpt"))
+
+# Size budget of the on-disk activity stream cache
+stream_cache_max_bytes = int(os.getenv("STRAVAGPT_STREAM_CACHE_MB", "256")) * 1024 * 1024
+
+# Logging: root level, log file (empty to log to the console only), JSON lines instead of plain text,
+# and the number of characters of a large payload (query results, tool output) kept in a log message
+log_level = os.getenv("STRAVAGPT_LOG_LEVEL", "INFO").upper()
+log_file = os.getenv("STRAVAGPT_LOG_FILE", "run.log")
+log_json = os.getenv("STRAVAGPT_LOG_JSON", "0").lower() in ("1", "true", "yes")
+log_preview_chars = int(os.getenv("STRAVAGPT_LOG_PREVIEW_CHARS", "500"))
+
+# Prometheus metrics endpoint (port 0 turns it off), and a file run_locally.py writes the metrics to on exit
+metrics_host = os.getenv("STRAVAGPT_METRICS_HOST", "127.0.0.1")
+metrics_port = int(os.getenv("STRAVAGPT_METRICS_PORT", "9464"))
+metrics_file = os.getenv("STRAVAGPT_METRICS_FILE", "")
+
+# Maximum number of tool calls from one assistant turn that run at the same time
+max_tool_workers = 8
+
+# Per-tool concurrency limits. Tools backed by the Strava API are kept low to respect its rate limits
+tool_concurrency = {
+    "query_data": 4,
+    "get_activity_data": 3,
+    "plot_route": 2,
+    "get_activity_photos": 2,
+    "search": 4,
+    "get_stored_result": 4,
+}
+
+# Heart rate zone lower bounds as fractions of max heart rate (zones 1-5)
+heart_rate_zone_bounds = [0.5, 0.6, 0.7, 0.8, 0.9]
+
+# Default number of points kept per downsampled stream in get_activity_data summaries
+summary_max_points = 60
+
+# Activities per page of Strava's activities list. A sync publishes what it has loaded after every page
+sync_page_size = 200
+
+# Bulk sync: long ranges, such as a first sync, are split into up to sync_shards time shards of at least
+# sync_shard_min_days, fetched sync_workers at a time. Shards of 1 turns it off and pages through the range instead
+sync_shards = int(os.getenv("STRAVAGPT_SYNC_SHARDS", "8"))
+sync_shard_min_days = 90
+sync_workers = int(os.getenv("STRAVAGPT_SYNC_WORKERS", "4"))
+
+# Feature index: activities indexed per sync (each may cost a Strava streams request), rows written per batch
+feature_index_limit = int(os.getenv("STRAVAGPT_FEATURE_INDEX_LIMIT", "50"))
+feature_index_batch = 10
+feature_stream_resolution = "high"
+
+# Strava API limits per 15 minutes and per day, assumed until Strava reports the app's own in its headers
+strava_short_limit = int(os.getenv("STRAVA_RATE_LIMIT_15MIN", "100"))
+strava_daily_limit = int(os.getenv("STRAVA_RATE_LIMIT_DAILY", "1000"))
+
+# Background stream prefetch: its share of Strava's rate limits, its own budget per 15 minutes and per
+# day (shared by all sessions), how long after a question it waits, and what it fetches
+prefetch_rate_share = 0.5
+prefetch_max_per_window = int(os.getenv("STRAVAGPT_PREFETCH_PER_15MIN", "30"))
+prefetch_max_per_day = int(os.getenv("STRAVAGPT_PREFETCH_PER_DAY", "300"))
+prefetch_idle_seconds = 2
+prefetch_activities = 20
+prefetch_stream_types = ["time", "distance", "latlng", "altitude", "heartrate", "velocity_smooth", "cadence", "watts", "moving"]
+prefetch_resolution = "medium"
+
+# Share of each Strava rate-limit window that each request priority class may use, and retries of 429s and 5xxs
+strava_priority_shares = {"interactive": 1.0, "bulk": 0.8, "prefetch": prefetch_rate_share}
+strava_max_retries = 3
+strava_backoff_seconds = 1
+strava_backoff_max_seconds = 30
+
+# Vision model describing photos, how many photos are described at once, and how many go in one request
+# (1 sends each photo on its own). Descriptions are cached on disk per photo and model
+vision_model = os.getenv("STRAVAGPT_VISION_MODEL", "gpt-4o-mini")
+photo_description_workers = int(os.getenv("STRAVAGPT_PHOTO_WORKERS", "4"))
+photo_batch_size = int(os.getenv("STRAVAGPT_PHOTO_BATCH_SIZE", "4"))
+photo_description_cache_size = 10000
+
+# Web search: results kept per search, characters kept of each result, and how long cached results stay valid
+search_max_results = 5
+search_snippet_chars = 500
+search_cache_ttl_seconds = int(os.getenv("STRAVAGPT_SEARCH_TTL", str(24 * 60 * 60)))
+search_cache_size = 2000
+
+# Gazetteer of named places used to describe routes, and how far from the route places are looked up
+gazetteer_path = os.getenv("STRAVAGPT_GAZETTEER", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.csv.gz"))
+route_landmark_radius_m = 15000
+route_max_landmarks = 5
+
+# Warm kaleido renderer: Chromium tabs rendering at once, queued requests, batching window and cached images
+renderer_workers = int(os.getenv("STRAVAGPT_RENDER_WORKERS", "2"))
+renderer_queue_size = 32
+renderer_batch_seconds = 0.02
+render_cache_size = 64
+render_timeout_seconds = 60
+
+# Token budget of each chat completion request, and how the conversation is compacted to fit it
+context_max_tokens = int(os.getenv("STRAVAGPT_CONTEXT_MAX_TOKENS", "24000"))
+context_keep_turns = 2
+context_compact_tokens = 500
+
+# Number of query_data results kept in the per-session query cache
+query_cache_size = 128
+
+# Idle sessions are evicted after this many seconds, and LRU sessions once all of them use more than the budget
+session_ttl_seconds = int(os.getenv("STRAVAGPT_SESSION_TTL", "1800"))
+session_memory_budget_bytes = int(os.getenv("STRAVAGPT_SESSION_MEMORY_MB", "1024")) * 1024 * 1024
+
+# Number of question traces kept per session
+trace_history = 50
 
 tools = [
     {
@@ -39,7 +135,7 @@ tools = [
     "type": "function",
     "function": {
         "name": "plot_route",
-        "description": "Plot the route of an activity. Call this to get a map of the route of an activity.",
+        "description": "Plot the route of an activity. Call this to show the user a map of the route of an activity. Also returns a description of the route: its length, shape, bounding box, dominant heading, elevation profile and nearby places.",
         "parameters": {
             "type": "object",
             "properties": {
@@ -61,7 +157,7 @@ tools = [
     "type": "function",
     "function": {
         "name": "get_activity_data",
-        "description": "Get the stream data of an activity. Call this to get in-depth data of an activity.",
+        "description": "Get the stream data of an activity. Call this to get in-depth data of an activity. Returns a compact summary by default.",
         "parameters": {
             "type": "object",
             "properties": {
@@ -82,6 +178,15 @@ tools = [
                     "description": "Indicates desired number of data points. ‘low’ (100) or ‘medium’ (1000)",
                     "enum": ["low", "medium"],
                 },
+                "detail": {
+                    "type": "string",
+                    "description": "‘summary’ (default) returns stats, heart rate zones, per-km splits, downsampled series and a simplified route. ‘raw’ returns every data point, only use it when the summary is not enough.",
+                    "enum": ["summary", "raw"],
+                },
+                "max_points": {
+                    "type": "integer",
+                    "description": "Maximum number of points per downsampled series in the summary, default 60. Increase it to drill down.",
+                },
             },
             "required": ["activity_id", "stream_types", "resolution"],
             "additionalProperties": False,
@@ -110,6 +215,24 @@ tools = [
         },
     }
 },
+{
+    "type": "function",
+    "function": {
+        "name": "get_stored_result",
+        "description": "Get the full content of an earlier tool result that was stored out of the conversation to save space.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "ref": {
+                    "type": "string",
+                    "description": "The reference of the stored result",
+                },
+            },
+            "required": ["ref"],
+            "additionalProperties": False,
+        },
+    }
+},
 {
     "type": "function",
     "function": {
@@ -0,0 +1,120 @@
+import json
+import logging
+import uuid
+
+from constants import context_max_tokens, context_keep_turns, context_compact_tokens
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken is optional, fall back to a rough characters-per-token estimate
+    _encoding = None
+
+
+# Role of a message, whether it is a dict or an OpenAI message object
+def _role(message):
+    if isinstance(message, dict):
+        return message.get("role")
+    return getattr(message, "role", None)
+
+
+# Text of a message that is sent to the model, including any tool call arguments
+def message_text(message):
+    if not isinstance(message, dict):
+        message = message.model_dump(exclude_none=True)
+    text = message.get("content") or ""
+    if not isinstance(text, str):
+        text = json.dumps(text)
+    for tool_call in message.get("tool_calls") or []:
+        text += tool_call["function"]["name"] + tool_call["function"]["arguments"]
+    return text
+
+
+class ContextWindow:
+    """
+    Keep the conversation sent to the model within a token budget.
+
+    Large tool outputs from older turns are swapped for a short reference that the model can
+    resolve again with the get_stored_result tool. If the conversation is still over budget,
+    the oldest turns are dropped. System messages and the most recent turns are never touched.
+
+    Parameters:
+    max_tokens: int
+        The token budget of each request.
+    keep_turns: int
+        The number of most recent user turns that are always sent in full.
+    compact_tokens: int
+        Tool outputs in older turns larger than this are replaced by a reference.
+    """
+
+    def __init__(self, max_tokens=context_max_tokens, keep_turns=context_keep_turns, compact_tokens=context_compact_tokens):
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.compact_tokens = compact_tokens
+        self.stored_results = {}
+        self._token_counts = {}
+
+    # Count the tokens of a message, caching counts by message text
+    def count_tokens(self, message):
+        text = message_text(message)
+        count = self._token_counts.get(text)
+        if count is None:
+            count = len(_encoding.encode(text)) if _encoding else len(text) // 4
+            if len(self._token_counts) > 4096:
+                self._token_counts.clear()
+            self._token_counts[text] = count
+        # Every message carries a few tokens of role and formatting overhead
+        return count + 4
+
+    def total_tokens(self, messages):
+        return sum(self.count_tokens(message) for message in messages)
+
+    # Look up the original content of a compacted tool output
+    def get_stored_result(self, ref):
+        return self.stored_results.get(ref)
+
+    # Compact the conversation in place so it fits the token budget, and return it
+    def fit(self, messages):
+        user_indices = [i for i, message in enumerate(messages) if _role(message) == "user"]
+        protected_from = user_indices[-self.keep_turns] if len(user_indices) >= self.keep_turns else 0
+
+        # Swap large tool outputs in older turns for stored references
+        for i in range(protected_from):
+            message = messages[i]
+            if _role(message) == "tool" and self.count_tokens(message) > self.compact_tokens:
+                messages[i] = self._store(message)
+
+        total = self.total_tokens(messages)
+
+        # Drop the oldest turns, keeping system messages, until the conversation fits
+        while total > self.max_tokens:
+            user_indices = [i for i, message in enumerate(messages[:protected_from]) if _role(message) == "user"]
+            if not user_indices:
+                break
+            start = user_indices[0]
+            end = user_indices[1] if len(user_indices) > 1 else protected_from
+
+            kept = [message for message in messages[start:end] if _role(message) == "system"]
+            total -= self.total_tokens(messages[start:end]) - self.total_tokens(kept)
+            messages[start:end] = kept
+            protected_from -= end - start - len(kept)
+
+        if total > self.max_tokens:
+            logging.warning("Conversation is %s tokens, over the %s token budget after compaction", total, self.max_tokens)
+        else:
+            logging.debug("Conversation is %s tokens", total)
+
+        return messages
+
+    def _store(self, message):
+        ref = uuid.uuid4().hex[:8]
+        content = message["content"]
+        self.stored_results[ref] = content
+        logging.debug("Stored tool output %s (%s characters) out of the conversation", ref, len(content))
+
+        preview = content[:200].replace("\n", " ")
+        return {
+            "role": "tool",
+            "tool_call_id": message["tool_call_id"],
+            "content": f"[Stored result {ref}, starts with: {preview}... Call get_stored_result with ref \"{ref}\" to see it again.]"
+        }
@@ -0,0 +1,151 @@
+import numpy as np
+import polars as pl
+
+from constants import heart_rate_zone_bounds
+from summarise import heart_rate_zones
+
+# Streams the features are computed from
+FEATURE_STREAMS = ["time", "distance", "heartrate", "watts", "altitude"]
+
+# Standard distances in metres that best efforts are computed for
+BEST_EFFORT_DISTANCES = {
+    "400m": 400,
+    "1k": 1000,
+    "1mile": 1609.34,
+    "5k": 5000,
+    "10k": 10000,
+    "half_marathon": 21097.5,
+    "marathon": 42195,
+}
+
+# Durations in seconds of the power curve points
+POWER_CURVE_SECONDS = {"5s": 5, "1min": 60, "5min": 300, "20min": 1200, "60min": 3600}
+
+# A climb ends once the altitude drops this many metres below its top, and must gain at least min_gain
+CLIMB_DROP_TOLERANCE = 10
+CLIMB_MIN_GAIN = 20
+
+# Typed columns of the features table, named with their units
+FEATURE_SCHEMA = {
+    "activity_id": pl.Int64,
+    **{f"best_{name}_s": pl.Float64 for name in BEST_EFFORT_DISTANCES},
+    **{f"hr_zone_{zone}_s": pl.Int64 for zone in range(1, len(heart_rate_zone_bounds) + 1)},
+    **{f"best_{name}_watts": pl.Float64 for name in POWER_CURVE_SECONDS},
+    "climb_count": pl.Int32,
+    "climb_gain_m": pl.Float64,
+    "biggest_climb_gain_m": pl.Float64,
+    "biggest_climb_length_m": pl.Float64,
+    "biggest_climb_grade_pct": pl.Float64,
+}
+
+
+# Fastest time in seconds to cover target metres anywhere in the activity, or None if it is shorter
+def best_effort_seconds(distance, time, target):
+    if distance.size < 2 or distance[-1] - distance[0] < target:
+        return None
+
+    # For every start point, interpolate the time at which target metres further is reached
+    starts = distance <= distance[-1] - target
+    end_times = np.interp(distance[starts] + target, distance, time)
+    return round(float(np.min(end_times - time[starts])), 1)
+
+
+# Highest average of values over any window of the given seconds, or None if the activity is shorter
+def best_average(values, time, seconds):
+    if time.size < 2 or time[-1] - time[0] < seconds:
+        return None
+
+    # Resample to one value per second so windows cover equal time, then slide with a cumulative sum
+    grid = np.arange(time[0], time[-1] + 1)
+    resampled = np.interp(grid, time, np.nan_to_num(values))
+    totals = np.concatenate(([0], np.cumsum(resampled)))
+    return round(float(np.max(totals[seconds:] - totals[:-seconds]) / seconds), 1)
+
+
+# Sustained climbs as (gain, length) pairs in metres, from a smoothed altitude profile
+def climbs(distance, altitude):
+    # Pad with the edge values so the moving average stays aligned with distance without pulling the ends towards 0
+    window = min(5, altitude.size)
+    padded = np.pad(altitude, ((window - 1) // 2, window // 2), mode="edge")
+    altitude = np.convolve(padded, np.ones(window) / window, mode="valid")
+
+    found = []
+
+    def record(bottom, top):
+        if altitude[top] - altitude[bottom] >= CLIMB_MIN_GAIN:
+            found.append((float(altitude[top] - altitude[bottom]), float(distance[top] - distance[bottom])))
+
+    bottom = top = 0
+    for i in range(1, altitude.size):
+        if altitude[i] > altitude[top]:
+            top = i
+        elif altitude[top] - altitude[i] > CLIMB_DROP_TOLERANCE:
+            record(bottom, top)
+            bottom = top = i
+        if altitude[i] < altitude[bottom]:
+            bottom = top = i
+
+    # A climb still rising, or within the tolerance of its top, at the end of the activity
+    record(bottom, top)
+    return found
+
+
+def activity_features(activity_id, streams, max_heart_rate=None):
+    """
+    Compute the feature index row of one activity from its streams.
+
+    Parameters:
+    activity_id: int
+        The Strava activity id.
+    streams: dict
+        Stream type to stream object with a .data array, as returned by StravaGPT.get_streams.
+    max_heart_rate: float, optional
+        The athlete's max heart rate, used for zones. Defaults to the highest value in the stream.
+
+    Returns:
+    row: dict
+        Best efforts, heart rate zone time, power curve and climbs, keyed by the FEATURE_SCHEMA
+        columns. Features the streams cannot provide are None.
+    """
+    data = {stream_type: np.asarray(stream.data, dtype=float) for stream_type, stream in streams.items() if stream_type in FEATURE_STREAMS}
+    time = data.get("time")
+    distance = data.get("distance")
+    row = dict.fromkeys(FEATURE_SCHEMA)
+    row["activity_id"] = int(activity_id)
+
+    def aligned(stream_type, reference):
+        values = data.get(stream_type)
+        return values if values is not None and reference is not None and values.size == reference.size and values.size else None
+
+    if aligned("distance", time) is not None:
+        for name, target in BEST_EFFORT_DISTANCES.items():
+            row[f"best_{name}_s"] = best_effort_seconds(distance, time, target)
+
+    heartrate = aligned("heartrate", time)
+    if heartrate is not None and not np.all(np.isnan(heartrate)):
+        zones = heart_rate_zones(heartrate, time, max_heart_rate or float(np.nanmax(heartrate)))
+        for zone in range(1, len(heart_rate_zone_bounds) + 1):
+            row[f"hr_zone_{zone}_s"] = zones[f"zone_{zone}"]["seconds"]
+
+    watts = aligned("watts", time)
+    if watts is not None:
+        for name, seconds in POWER_CURVE_SECONDS.items():
+            row[f"best_{name}_watts"] = best_average(watts, time, seconds)
+
+    altitude = aligned("altitude", distance)
+    if altitude is not None:
+        found = climbs(distance, altitude)
+        row["climb_count"] = len(found)
+        row["climb_gain_m"] = round(sum(gain for gain, _ in found), 1)
+        if found:
+            gain, length = max(found)
+            row["biggest_climb_gain_m"] = round(gain, 1)
+            row["biggest_climb_length_m"] = round(length, 1)
+            row["biggest_climb_grade_pct"] = round(gain / length * 100, 1) if length > 0 else None
+
+    return row
+
+
+# Build the typed features table from feature rows
+def features_frame(rows=()):
+    return pl.DataFrame(list(rows), schema=FEATURE_SCHEMA, strict=False)
@@ -0,0 +1,75 @@
+import polars as pl
+
+from schema import ACTIVITY_SCHEMA, activity_row, nested_rows, nested_frame
+
+
+# Convert a stravalib activity model into a plain dictionary
+def activity_to_dict(activity):
+    if hasattr(activity, "to_dict"):
+        return activity.to_dict()
+    return activity.model_dump(exclude={"bound_client"})
+
+
+class ActivityIngest:
+    """
+    Stream activities into typed per-column buffers and build a polars DataFrame in one pass.
+
+    Each activity is normalised to the typed activity schema and appended to one list per
+    column, so ingest cost grows linearly with the number of activities instead of
+    re-copying the whole frame per row. Nested fields (laps, splits, best efforts, ...)
+    are collected into separate tables keyed by activity_id.
+
+    Parameters:
+    size_hint: int, optional
+        The expected number of activities, used to pre-size the column buffers.
+    """
+
+    def __init__(self, size_hint=None):
+        self.rows = 0
+        self.size_hint = size_hint
+        self.buffers = {column: [None] * (size_hint or 0) for column in ACTIVITY_SCHEMA}
+        self.nested = {}
+
+    # Append a single activity to the column buffers
+    def add(self, activity):
+        activity_dict = activity_to_dict(activity)
+
+        for key, value in activity_row(activity_dict).items():
+            buffer = self.buffers[key]
+            if self.rows < len(buffer):
+                buffer[self.rows] = value
+            else:
+                buffer.append(value)
+
+        for table, rows in nested_rows(activity_dict).items():
+            self.nested.setdefault(table, []).extend(rows)
+
+        self.rows += 1
+
+    # Stream an iterable of activities into the column buffers
+    def extend(self, activities):
+        for activity in activities:
+            self.add(activity)
+        return self
+
+    # Build the typed activities DataFrame from the column buffers
+    def to_polars(self):
+        return pl.DataFrame(
+            [pl.Series(key, buffer[:self.rows], dtype=ACTIVITY_SCHEMA[key], strict=False) for key, buffer in self.buffers.items()]
+        )
+
+    # Build one DataFrame per nested table
+    def nested_to_polars(self):
+        return {table: nested_frame(rows) for table, rows in self.nested.items() if rows}
+
+
+# Build the activities DataFrame and nested tables from an iterable of stravalib activities
+def ingest_activities(activities):
+    size_hint = len(activities) if hasattr(activities, "__len__") else None
+    ingest = ActivityIngest(size_hint=size_hint).extend(activities)
+    return ingest.to_polars(), ingest.nested_to_polars()
+
+
+# Build only the activities DataFrame from an iterable of stravalib activities
+def activities_to_polars(activities):
+    return ingest_activities(activities)[0]
@@ -0,0 +1,144 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+from datetime import datetime, timezone
+
+from constants import log_level, log_file, log_json, log_preview_chars
+
+_listener = None
+_lock = threading.Lock()
+
+
+class Preview:
+    """
+    Size-capped, lazily rendered view of a log payload.
+
+    Pass it as a %-style logging argument: the payload is only converted to text if the
+    record is actually emitted, and then only the first limit characters are kept. Dicts and
+    lists are rendered as JSON.
+
+    Parameters:
+    value: object
+        The payload, e.g. a query result or a tool result message.
+    limit: int, optional
+        The maximum number of characters shown. The payload is shown in full without one.
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit=log_preview_chars):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        if isinstance(self.value, str):
+            text = self.value
+        elif isinstance(self.value, (dict, list)):
+            text = json.dumps(self.value, default=str)
+        else:
+            text = str(self.value)
+        if self.limit is None or len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... ({len(text)} chars)"
+
+    __repr__ = __str__
+
+
+def preview(value, limit=log_preview_chars):
+    return Preview(value, limit)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line: time, level, logger, thread and message, plus
+    any fields passed with extra={"fields": {...}} and the formatted exception.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # Hand the record over unformatted, so messages are built on the listener thread rather than the
+    # request thread. Tracebacks are rendered now, while the frames they refer to still exist
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    # Build the message once on the listener thread, rather than once per handler. A call with bad
+    # arguments is reported like a handler would, and its raw message written, so the listener never dies
+    def prepare(self, record):
+        try:
+            message = record.getMessage()
+        except Exception:
+            if self.handlers:
+                self.handlers[0].handleError(record)
+            message = f"{record.msg} (bad logging arguments: {record.args!r})"
+        record.msg = message
+        record.args = None
+        return record
+
+
+def configure_logging(level=log_level, path=log_file, structured=log_json):
+    """
+    Configure logging for the whole process, once. Later calls are ignored.
+
+    Records go onto an in-memory queue and are written to the console and the log file by a
+    background listener thread, so logging never blocks a request on I/O.
+
+    Parameters:
+    level: str
+        The root log level, e.g. "INFO" or "DEBUG".
+    path: str, optional
+        The log file. Only the console is used without one.
+    structured: bool
+        Write JSON lines instead of plain text.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+
+        if structured:
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+        handlers = [logging.StreamHandler()]
+        if path:
+            handlers.append(logging.handlers.RotatingFileHandler(path, maxBytes=50 * 1024 * 1024, backupCount=3))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        records = queue.SimpleQueue()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_QueueHandler(records))
+        root.setLevel(level)
+        logging.getLogger("watchdog").setLevel(logging.WARNING)
+
+        _listener = _QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
@@ -0,0 +1,137 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram, start_http_server, write_to_textfile, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+from constants import metrics_host, metrics_port
+
+# Latency buckets in seconds, wide enough for multi-step questions that run for tens of seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+question_seconds = Histogram(
+    "stravagpt_question_seconds", "Time to answer a question, tool calls included", ["mode"], buckets=LATENCY_BUCKETS,
+)
+tool_loop_seconds = Histogram(
+    "stravagpt_tool_loop_seconds", "Time to run the tool calls of one assistant turn", buckets=LATENCY_BUCKETS,
+)
+tool_seconds = Histogram(
+    "stravagpt_tool_seconds", "Latency of a single tool call", ["tool"], buckets=LATENCY_BUCKETS,
+)
+tool_errors = Counter(
+    "stravagpt_tool_errors_total", "Tool calls that returned an error", ["tool"],
+)
+strava_call_seconds = Histogram(
+    "stravagpt_strava_call_seconds", "Latency of Strava client calls, rate limit waits included", ["call"], buckets=LATENCY_BUCKETS,
+)
+openai_seconds = Histogram(
+    "stravagpt_openai_seconds", "Latency of OpenAI requests, until the last chunk for streamed ones", ["kind"], buckets=LATENCY_BUCKETS,
+)
+tavily_seconds = Histogram(
+    "stravagpt_tavily_seconds", "Latency of Tavily searches", buckets=LATENCY_BUCKETS,
+)
+render_seconds = Histogram(
+    "stravagpt_render_seconds", "Time to rasterise one batch of figures", buckets=LATENCY_BUCKETS,
+)
+api_calls = Counter(
+    "stravagpt_api_calls_total", "Requests sent to external APIs", ["service", "outcome"],
+)
+cache_requests = Counter(
+    "stravagpt_cache_requests_total", "Cache lookups", ["cache", "result"],
+)
+
+
+# Count a cache lookup as a hit or a miss
+def record_cache(cache, hit, count=1):
+    if count:
+        cache_requests.labels(cache, "hit" if hit else "miss").inc(count)
+
+
+# Count a request to an external service as ok or failed
+@contextmanager
+def external_call(service):
+    try:
+        yield
+    except Exception:
+        api_calls.labels(service, "error").inc()
+        raise
+    api_calls.labels(service, "ok").inc()
+
+
+class SessionCollector:
+    """
+    Collect gauges of the live sessions and the Strava request budget when metrics are scraped.
+
+    Parameters:
+    sessions: SessionRegistry
+        The registry of live sessions.
+    request_scheduler: RequestScheduler
+        The scheduler of Strava API requests.
+    """
+
+    def __init__(self, sessions, request_scheduler):
+        self.sessions = sessions
+        self.request_scheduler = request_scheduler
+
+    def collect(self):
+        usage = self.sessions.memory_usage()
+        yield GaugeMetricFamily("stravagpt_sessions", "Live chat sessions", value=len(usage))
+        memory = GaugeMetricFamily("stravagpt_session_memory_bytes", "Estimated memory held by each session", labels=["session"])
+        for session_id, size in usage.items():
+            memory.add_metric([str(session_id)], size)
+        yield memory
+
+        budget = self.request_scheduler.metrics()
+        used = GaugeMetricFamily("stravagpt_strava_budget_used", "Strava requests used in the current window", labels=["window"])
+        used.add_metric(["15min"], budget["short_used"])
+        used.add_metric(["daily"], budget["daily_used"])
+        yield used
+        waiting = GaugeMetricFamily("stravagpt_strava_waiting", "Strava requests waiting for budget", labels=["priority"])
+        for priority, count in budget["waiting"].items():
+            waiting.add_metric([priority], count)
+        yield waiting
+
+
+_server = None
+_lock = threading.Lock()
+
+
+def start_metrics_server(sessions, request_scheduler, host=metrics_host, port=metrics_port):
+    """
+    Report the sessions and Strava budget as gauges and serve the metrics on a local HTTP
+    endpoint, once per process. Later calls are ignored.
+
+    Parameters:
+    sessions: SessionRegistry
+        The registry of live sessions, reported as gauges.
+    request_scheduler: RequestScheduler
+        The scheduler of Strava API requests, whose budget is reported as gauges.
+    host: str
+        The interface to listen on.
+    port: int
+        The port to listen on. Nothing is served if it is 0.
+    """
+    global _server
+    with _lock:
+        if _server is not None:
+            return
+        REGISTRY.register(SessionCollector(sessions, request_scheduler))
+        _server = False
+        if not port:
+            return
+        try:
+            _server = start_http_server(port, addr=host)
+            logging.info("Serving metrics on http://%s:%s/metrics", host, port)
+        except OSError as e:
+            # Another process, e.g. a second Streamlit server, already serves the port
+            logging.error("Error starting metrics server on port %s: %s", port, e)
+
+
+# Write the current metrics in the Prometheus text format, e.g. for the node exporter's textfile collector
+def export_metrics(path):
+    try:
+        write_to_textfile(path, REGISTRY)
+        logging.info("Wrote metrics to %s", path)
+    except OSError as e:
+        logging.error("Error writing metrics to %s: %s", path, e)
@@ -1,14 +1,31 @@
-import plotly.express as px
+import numpy as np
+import polars as pl
 import plotly.graph_objects as go
-import pandas as pd
+
+from renderer import render_pool
+
+
+# Get the values of a stream as a numpy array, whether given a Stream object, a polars Series or an array
+def _to_numpy(stream):
+    if stream is None:
+        return None
+    if hasattr(stream, "data"):
+        stream = stream.data
+    if isinstance(stream, pl.Series):
+        # List columns, such as latlng pairs, become a 2D array
+        if isinstance(stream.dtype, (pl.List, pl.Array)):
+            return np.asarray(stream.to_list(), dtype=float)
+        return stream.to_numpy()
+    return np.asarray(stream)
+
 
 def create_route_plot(lnglat_data, mapbox_access_token, zoom):
     """
     Plot a route based on a stream of longitude and latitude data.
     
     Parameters:
-    lnglat_list
-        A list of (latitude, longitude) tuples.
+    lnglat_data: Stream Object, polars Series or numpy.ndarray
+        The latlng stream, as (latitude, longitude) pairs.
     mapbox_access_token: str
         Your Mapbox access token.
     zoom: int
@@ -19,30 +36,24 @@ def create_route_plot(lnglat_data, mapbox_access_token, zoom):
         The Plotly figure object containing the route plot.
     """
     
+    coords = _to_numpy(lnglat_data)
+
     # Check if the data is empty
-    if not lnglat_data:
+    if coords is None or len(coords) == 0:
         raise ValueError("The lnglat_data list is empty.")
-    
-    coords = lnglat_data.data
 
-    # Convert the input data to a DataFrame
-    df = pd.DataFrame(coords, columns=['lat', 'lng'])
-    
-    # Create the Plotly map
-    fig = px.line_mapbox(
-        df,
-        lat='lat',
-        lon='lng',
-        zoom=zoom,
-        center={'lat': df['lat'].mean(), 'lon': df['lng'].mean()},
-        color_discrete_sequence=['orange']
-    )
-    
-    fig.update_layout(
-        mapbox_style="streets",
-        mapbox_accesstoken=mapbox_access_token,
-        margin={"r":0,"t":0,"l":0,"b":0}
-    )
+    lat, lng = coords[:, 0], coords[:, 1]
+    center = {'lat': float(lat.mean()), 'lon': float(lng.mean())}
+
+    # Plotly 7 removed the Mapbox traces in favour of the MapLibre based ones
+    if hasattr(go, 'Scattermapbox'):
+        fig = go.Figure(go.Scattermapbox(lat=lat, lon=lng, mode='lines', line=dict(color='orange')))
+        fig.update_layout(mapbox=dict(style='streets', accesstoken=mapbox_access_token, zoom=zoom, center=center))
+    else:
+        fig = go.Figure(go.Scattermap(lat=lat, lon=lng, mode='lines', line=dict(color='orange')))
+        fig.update_layout(map=dict(style='open-street-map', zoom=zoom, center=center))
+
+    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
     
     # Return the Plotly figure instead of saving it
     return fig
@@ -52,37 +63,35 @@ def plot_heart_rate_and_altitude(time_stream, heart_rate_stream, altitude_stream
     Plot heart rate and altitude data based on separate streams of timestamp, heart rate, and optionally altitude data.
     
     Parameters:
-    time_stream: Stream Object
-        A Stream object containing timestamps in seconds.
-    heart_rate_stream: Stream Object
-        A Stream object containing heart rate values.
-    altitude_stream: Stream Object, optional
-        A Stream object containing altitude values.
+    time_stream: Stream Object, polars Series or numpy.ndarray
+        Timestamps in seconds.
+    heart_rate_stream: Stream Object, polars Series or numpy.ndarray
+        Heart rate values.
+    altitude_stream: Stream Object, polars Series or numpy.ndarray, optional
+        Altitude values.
     output_file: str
         The path and file name to save the output image.
     """
     
+    time = _to_numpy(time_stream)
+    heart_rate = _to_numpy(heart_rate_stream)
+    altitude = _to_numpy(altitude_stream)
+
     # Check if data streams are all of the same length
-    if altitude_stream is not None and not (len(time_stream.data) == len(heart_rate_stream.data) == len(altitude_stream.data)):
+    if altitude is not None and not (len(time) == len(heart_rate) == len(altitude)):
         raise ValueError("All data streams must be of the same length.")
     
-    # Convert time to timedelta for better flexibility
-    df = pd.DataFrame({
-        'time': pd.to_timedelta(time_stream.data, unit='s'),
-        'heart_rate': heart_rate_stream.data
-    })
-    
-    if altitude_stream is not None:
-        df['altitude'] = altitude_stream.data
+    # Show elapsed seconds as a clock time from the start of the activity
+    elapsed = np.datetime64(0, 's') + time.astype('timedelta64[s]')
 
     # Create the Plotly figure
     fig = go.Figure()
 
     # Add altitude data as a filled area plot if provided
-    if altitude_stream is not None:
+    if altitude is not None:
         fig.add_trace(go.Scatter(
-            x=df['time'],
-            y=df['altitude'],
+            x=elapsed,
+            y=altitude,
             fill='tozeroy',
             name='Altitude',
             mode='none',
@@ -92,8 +101,8 @@ def plot_heart_rate_and_altitude(time_stream, heart_rate_stream, altitude_stream
 
     # Add heart rate data as a line plot
     fig.add_trace(go.Scatter(
-        x=df['time'],
-        y=df['heart_rate'],
+        x=elapsed,
+        y=heart_rate,
         mode='lines',
         name='Heart Rate',
         line=dict(color='red')
@@ -103,6 +112,7 @@ def plot_heart_rate_and_altitude(time_stream, heart_rate_stream, altitude_stream
     layout_updates = {
         'title': 'Heart Rate Over Time' if altitude_stream is None else 'Heart Rate and Altitude Over Time',
         'xaxis_title': 'Time',
+        'xaxis_tickformat': '%H:%M:%S',
         'yaxis_title': 'Heart Rate (bpm)',
         'template': 'plotly_white',
         'legend': dict(x=0.01, y=0.99, bgcolor='rgba(255,255,255,0.8)')
@@ -117,7 +127,8 @@ def plot_heart_rate_and_altitude(time_stream, heart_rate_stream, altitude_stream
         
     fig.update_layout(**layout_updates)
 
-    # Save the plot as a static image
-    fig.write_image(output_file, format='png')
+    # Save the plot as a static image, rendered by the shared warm renderer
+    with open(output_file, 'wb') as f:
+        f.write(render_pool.render(fig, format='png'))
 
     return output_file
\ No newline at end of file
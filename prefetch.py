@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from scheduler import scheduler, PREFETCH
+from constants import (
+    prefetch_max_per_window, prefetch_max_per_day, prefetch_rate_share, prefetch_idle_seconds,
+    prefetch_activities, prefetch_stream_types, prefetch_resolution,
+)
+
+SHORT_WINDOW_SECONDS = 15 * 60
+DAY_SECONDS = 24 * 60 * 60
+
+
+class RateBudget:
+    """
+    Local budget of background Strava requests, counted in Strava's own rate-limit windows:
+    quarter hours and UTC days.
+
+    Parameters:
+    max_per_window: int
+        The requests allowed in each 15 minute window.
+    max_per_day: int
+        The requests allowed in each UTC day.
+    """
+
+    def __init__(self, max_per_window=prefetch_max_per_window, max_per_day=prefetch_max_per_day):
+        self.max_per_window = max_per_window
+        self.max_per_day = max_per_day
+        self.window = self.day = None
+        self.window_calls = self.day_calls = 0
+        self.lock = threading.Lock()
+
+    def _roll(self, now):
+        window, day = int(now // SHORT_WINDOW_SECONDS), int(now // DAY_SECONDS)
+        if window != self.window:
+            self.window, self.window_calls = window, 0
+        if day != self.day:
+            self.day, self.day_calls = day, 0
+
+    # Take one request from the budget, returning how long to wait first if it is spent
+    def acquire(self):
+        now = time.time()
+        with self.lock:
+            self._roll(now)
+            if self.day_calls >= self.max_per_day:
+                return DAY_SECONDS - now % DAY_SECONDS
+            if self.window_calls >= self.max_per_window:
+                return SHORT_WINDOW_SECONDS - now % SHORT_WINDOW_SECONDS
+            self.window_calls += 1
+            self.day_calls += 1
+            return 0
+
+
+# Background requests of every session in this process share one budget
+prefetch_budget = RateBudget()
+
+
+# Seconds to hold off while Strava reports the app's usage above the share left for background work
+def usage_wait(rate_usage, share=prefetch_rate_share):
+    if rate_usage is None:
+        return 0
+    now = time.time()
+    if rate_usage.long_usage >= rate_usage.long_limit * share:
+        return DAY_SECONDS - now % DAY_SECONDS
+    if rate_usage.short_usage >= rate_usage.short_limit * share:
+        return SHORT_WINDOW_SECONDS - now % SHORT_WINDOW_SECONDS
+    return 0
+
+
+class Prefetcher:
+    """
+    Warm the stream cache in the background while the session is idle.
+
+    Activities the user asked about in earlier questions are fetched first, then the most
+    recent ones. The worker pauses while a question is being answered and for a short quiet
+    period after, and only spends requests the process-wide budget allows and that Strava's
+    reported usage leaves room for.
+
+    Parameters:
+    fetch: callable
+        Fetches and caches the streams of one activity: fetch(activity_id, stream_types, resolution).
+    rate_usage: callable
+        Returns the latest stravalib RequestRate reported by Strava, or None.
+    budget: RateBudget
+        The budget of background requests.
+    """
+
+    def __init__(self, fetch, rate_usage, budget=prefetch_budget):
+        self.fetch = fetch
+        self.rate_usage = rate_usage
+        self.budget = budget
+        self.queue = []
+        self.done = set()
+        self.foreground_count = 0
+        self.last_foreground = 0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.fetched = 0
+
+    # Queue activities to prefetch, in order, skipping ones already queued or fetched
+    def schedule(self, activity_ids):
+        with self.condition:
+            queued = set(self.queue)
+            self.queue.extend(a for a in dict.fromkeys(activity_ids) if a not in queued and a not in self.done)
+            self.condition.notify_all()
+
+    def start(self):
+        with self.condition:
+            self.stopped = False
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="stravagpt-prefetch", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    # Hold the prefetcher off while foreground work runs
+    @contextmanager
+    def foreground(self):
+        with self.condition:
+            self.foreground_count += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.foreground_count -= 1
+                self.last_foreground = time.monotonic()
+                self.condition.notify_all()
+
+    # Wait until there is work, no foreground request and the quiet period has passed
+    def _wait_for_turn(self):
+        with self.condition:
+            while not self.stopped:
+                quiet_for = time.monotonic() - self.last_foreground
+                if self.queue and self.foreground_count == 0 and quiet_for >= prefetch_idle_seconds:
+                    return self.queue.pop(0)
+                self.condition.wait(timeout=None if not self.queue else max(prefetch_idle_seconds - quiet_for, 0.1))
+        return None
+
+    def _sleep(self, seconds):
+        with self.condition:
+            self.condition.wait_for(lambda: self.stopped, timeout=seconds)
+
+    def _run(self):
+        logging.info("Stream prefetcher started")
+        while True:
+            activity_id = self._wait_for_turn()
+            if activity_id is None:
+                break
+
+            wait = usage_wait(self.rate_usage()) or self.budget.acquire()
+            if wait:
+                logging.info("Prefetch budget spent, pausing for %.0fs", wait)
+                with self.condition:
+                    self.queue.insert(0, activity_id)
+                self._sleep(wait)
+                continue
+
+            try:
+                with scheduler.priority(PREFETCH):
+                    self.fetch(activity_id, prefetch_stream_types, prefetch_resolution)
+                self.fetched += 1
+                logging.debug("Prefetched streams of activity %s", activity_id)
+            except Exception as e:
+                logging.error("Error prefetching streams of activity %s: %s", activity_id, e)
+            with self.condition:
+                self.done.add(activity_id)
+        logging.info("Stream prefetcher stopped after %s activities", self.fetched)
+
+
+# Activities to prefetch: the most asked about first, then the most recent
+def prefetch_order(activities_pl, interest, limit=prefetch_activities):
+    asked = [activity_id for activity_id, _ in sorted(interest.items(), key=lambda item: -item[1])]
+    recent = activities_pl["id"].head(limit).to_list() if activities_pl is not None else []
+    return list(dict.fromkeys(asked + recent))[:limit]
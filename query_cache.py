@@ -0,0 +1,63 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+from constants import query_cache_size
+from metrics import record_cache
+
+
+# Collapse whitespace outside string literals and drop trailing semicolons,
+# so trivially different spellings of the same query share a cache entry
+def normalise_sql(query):
+    parts = re.split(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")", query.strip().rstrip(";").strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+        parts[i] = re.sub(r"\s*([(),=<>])\s*", r"\1", parts[i])
+    return "".join(parts)
+
+
+class QueryCache:
+    """
+    LRU cache of query_data results keyed on the normalised SQL text and the data version.
+
+    The data version is bumped whenever the activities change, so results computed against
+    older data are never served; clear() drops them eagerly to free memory.
+
+    Parameters:
+    max_entries: int
+        The maximum number of results kept.
+    """
+
+    def __init__(self, max_entries=query_cache_size):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query, version):
+        key = (normalise_sql(query), version)
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                record_cache("query", False)
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        record_cache("query", True)
+        logging.debug("Query cache hit for: %s", key[0])
+        return result
+
+    def put(self, query, version, result):
+        key = (normalise_sql(query), version)
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
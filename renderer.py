@@ -0,0 +1,188 @@
+import asyncio
+import atexit
+import concurrent.futures
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import kaleido
+
+from constants import renderer_workers, renderer_queue_size, renderer_batch_seconds, render_cache_size, render_timeout_seconds
+from metrics import record_cache, render_seconds
+
+
+# Hash of everything that affects the rendered image, so identical plots share a cache entry
+def figure_key(fig, format, width=None, height=None, scale=None):
+    spec = fig.to_json() if hasattr(fig, "to_json") else str(fig)
+    return hashlib.sha256(f"{format}:{width}:{height}:{scale}:{spec}".encode()).hexdigest()
+
+
+class RendererPool:
+    """
+    A warm kaleido renderer shared by the whole process.
+
+    One headless Chromium with a fixed number of tabs is started on first use and kept
+    running on a background event loop, so renders no longer pay the browser start-up
+    cost or run on the request thread. Requests go through a bounded queue. Requests that
+    arrive within the batch window are rendered together in one pass, spread over the
+    tabs, and identical figures in a batch are rendered once. Rendered images are kept in
+    an LRU cache keyed on the hash of the figure spec.
+
+    Parameters:
+    workers: int
+        The number of Chromium tabs rendering at once.
+    queue_size: int
+        The maximum number of queued render requests before callers wait.
+    batch_seconds: float
+        How long the renderer waits for more requests to join a batch.
+    cache_size: int
+        The number of rendered images kept.
+    """
+
+    def __init__(self, workers=renderer_workers, queue_size=renderer_queue_size, batch_seconds=renderer_batch_seconds, cache_size=render_cache_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_seconds = batch_seconds
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = {}  # figure key -> future of a render that is queued or running
+        self.lock = threading.Lock()
+        self.loop = None
+        self.queue = None
+        self.server = None
+        self.serving = False
+        self.error = None
+        self.hits = 0
+        self.misses = 0
+
+    # Start the event loop thread and the renderer, or restart the renderer if it stopped
+    def _start(self):
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            threading.Thread(target=self.loop.run_forever, name="stravagpt-renderer", daemon=True).start()
+        if not self.serving:
+            self.serving = True
+            self.error = None
+            self.server = asyncio.run_coroutine_threadsafe(self._serve(), self.loop)
+
+    async def _serve(self):
+        try:
+            async with kaleido.Kaleido(n=self.workers) as renderer:
+                logging.info("Started kaleido renderer with %s tabs", self.workers)
+                while True:
+                    batch = [await self.queue.get()]
+
+                    # Give requests made at about the same time the chance to join this render pass
+                    await asyncio.sleep(self.batch_seconds)
+                    while not self.queue.empty():
+                        batch.append(self.queue.get_nowait())
+
+                    requests = [request for request in batch if request is not None]
+                    if requests:
+                        await self._render_batch(renderer, requests)
+                    if len(requests) < len(batch):
+                        break
+        except Exception as e:
+            logging.error("Kaleido renderer stopped: %s", e)
+            self.error = e
+        finally:
+            self.serving = False
+            self._drain()
+
+    # Fail every queued request once the renderer has stopped
+    def _drain(self):
+        while not self.queue.empty():
+            request = self.queue.get_nowait()
+            if request is not None:
+                self._finish(request[0], request[2], error=self.error or RuntimeError("The renderer was closed"))
+
+    async def _render_batch(self, renderer, requests):
+        logging.debug("Rendering a batch of %s figure(s)", len(requests))
+        with render_seconds.time():
+            results = await asyncio.gather(
+                *(renderer.calc_fig(fig, opts=opts) for _, fig, _, opts in requests),
+                return_exceptions=True,
+            )
+        for (key, _, future, _), result in zip(requests, results):
+            if isinstance(result, BaseException):
+                self._finish(key, future, error=result)
+            else:
+                self._finish(key, future, image=result)
+
+    def _finish(self, key, future, image=None, error=None):
+        with self.lock:
+            self.pending.pop(key, None)
+            if error is None:
+                self.cache[key] = image
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        if error is None:
+            future.set_result(image)
+        else:
+            future.set_exception(error)
+
+    # Queue figures for rendering, returning a future of the image bytes for each
+    def submit(self, figs, format="png", width=None, height=None, scale=None):
+        futures = []
+        queued = []
+        opts = {key: value for key, value in (("format", format), ("width", width), ("height", height), ("scale", scale)) if value is not None}
+
+        with self.lock:
+            for fig in figs:
+                key = figure_key(fig, format, width, height, scale)
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                    record_cache("render", True)
+                    future = concurrent.futures.Future()
+                    future.set_result(self.cache[key])
+                elif key in self.pending:
+                    # The same figure is already being rendered, share its result
+                    future = self.pending[key]
+                else:
+                    self.misses += 1
+                    record_cache("render", False)
+                    future = concurrent.futures.Future()
+                    self.pending[key] = future
+                    queued.append((key, fig, future, opts))
+                futures.append(future)
+            if queued:
+                self._start()
+
+        # Waits for room in the queue when the renderer is backed up
+        for request in queued:
+            asyncio.run_coroutine_threadsafe(self._put(request), self.loop).result()
+        return futures
+
+    async def _put(self, request):
+        await self.queue.put(request)
+        if not self.serving:
+            self._drain()
+
+    # Render several figures in one pass and return their image bytes, in order
+    def render_many(self, figs, format="png", width=None, height=None, scale=None, timeout=render_timeout_seconds):
+        futures = self.submit(figs, format, width, height, scale)
+        return [future.result(timeout=timeout) for future in futures]
+
+    # Render a single figure and return its image bytes
+    def render(self, fig, format="png", width=None, height=None, scale=None, timeout=render_timeout_seconds):
+        return self.render_many([fig], format, width, height, scale, timeout)[0]
+
+    # Stop the renderer, closing its Chromium
+    def close(self, timeout=10):
+        server = self.server
+        if not self.serving or server is None or server.done():
+            return
+        asyncio.run_coroutine_threadsafe(self._put(None), self.loop).result(timeout=timeout)
+        try:
+            server.result(timeout=timeout)
+        except Exception as e:
+            logging.error("Error closing kaleido renderer: %s", e)
+
+
+# The renderer shared by every session in this process
+render_pool = RendererPool()
+atexit.register(render_pool.close)
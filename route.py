@@ -0,0 +1,228 @@
+import logging
+import threading
+
+import numpy as np
+import polars as pl
+
+from constants import gazetteer_path, route_landmark_radius_m, route_max_landmarks
+from summarise import simplify_route
+
+EARTH_RADIUS_M = 6371008.8
+
+_COMPASS_POINTS = ["N", "NE", "E", "SE", "S", "SW", "W", "NW"]
+
+
+# Great-circle distances in metres between arrays of points given in degrees
+def haversine(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(values, dtype=float)) for values in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+# Initial compass bearings in degrees from each point to the next
+def bearings(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(values, dtype=float)) for values in (lat1, lng1, lat2, lng2))
+    x = np.sin(lng2 - lng1) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lng2 - lng1)
+    return np.degrees(np.arctan2(x, y)) % 360
+
+
+def compass_point(bearing):
+    return _COMPASS_POINTS[int(((bearing + 22.5) % 360) // 45)]
+
+
+class Gazetteer:
+    """
+    Local table of named places used to say where a route goes, loaded on first use.
+
+    The bundled gazetteer.csv.gz holds every GeoNames place with a population of at least
+    15,000 (CC BY 4.0, geonames.org). Any CSV with name, country, lat, lng and population
+    columns can be used instead, e.g. a denser GeoNames extract for rural areas.
+
+    Parameters:
+    path: str
+        The path of the gazetteer CSV, optionally gzipped.
+    """
+
+    def __init__(self, path=gazetteer_path):
+        self.path = path
+        self.places = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        with self.lock:
+            if self.places is None:
+                self.places = pl.read_csv(self.path, columns=["name", "country", "lat", "lng", "population"])
+                logging.info("Loaded %s places from gazetteer %s", self.places.height, self.path)
+        return self.places
+
+    # Places within radius_m of any of the given points, nearest first
+    def nearby(self, lat, lng, radius_m=route_landmark_radius_m, limit=route_max_landmarks):
+        places = self._load()
+        lat = np.asarray(lat, dtype=float)
+        lng = np.asarray(lng, dtype=float)
+
+        # Only measure distances to places inside the points' bounding box widened by the radius
+        margin_lat = np.degrees(radius_m / EARTH_RADIUS_M)
+        margin_lng = margin_lat / max(np.cos(np.radians(np.abs(lat).max())), 0.01)
+        candidates = places.filter(
+            pl.col("lat").is_between(lat.min() - margin_lat, lat.max() + margin_lat)
+            & pl.col("lng").is_between(lng.min() - margin_lng, lng.max() + margin_lng)
+        )
+        if candidates.height == 0:
+            return []
+
+        distances = haversine(
+            candidates["lat"].to_numpy()[:, None], candidates["lng"].to_numpy()[:, None], lat[None, :], lng[None, :]
+        ).min(axis=1)
+        candidates = candidates.with_columns(distance_m=distances).filter(pl.col("distance_m") <= radius_m)
+        return [
+            {"name": place["name"], "country": place["country"], "distance_km": round(place["distance_m"] / 1000, 1)}
+            for place in candidates.sort("distance_m").head(limit).iter_rows(named=True)
+        ]
+
+
+# Length-weighted share of the route heading towards each compass point
+def _heading_shares(lat, lng, segment_lengths):
+    sectors = ((bearings(lat[:-1], lng[:-1], lat[1:], lng[1:]) + 22.5) % 360 // 45).astype(int)
+    shares = np.bincount(sectors, weights=segment_lengths, minlength=8) / max(segment_lengths.sum(), 1e-9)
+    return dict(zip(_COMPASS_POINTS, shares))
+
+
+# Area enclosed by the route in square metres, on a local flat projection
+def _enclosed_area(lat, lng):
+    x = np.radians(lng - lng.mean()) * np.cos(np.radians(lat.mean())) * EARTH_RADIUS_M
+    y = np.radians(lat - lat.mean()) * EARTH_RADIUS_M
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+# Classify the route as a loop, an out-and-back or point-to-point
+def _route_shape(lat, lng, length):
+    gap = float(haversine(lat[0], lng[0], lat[-1], lng[-1]))
+    if gap > max(250, 0.05 * length):
+        return "point_to_point"
+
+    # A loop encloses an area, an out-and-back retraces itself and encloses almost none
+    compactness = 4 * np.pi * _enclosed_area(lat, lng) / max(length, 1e-9) ** 2
+    return "loop" if compactness > 0.05 else "out_and_back"
+
+
+def _elevation_profile(altitude, cumulative, length):
+    altitude = np.asarray(altitude, dtype=float)
+    valid = ~np.isnan(altitude)
+    if valid.sum() < 2:
+        return None
+    altitude, cumulative = altitude[valid], cumulative[valid]
+
+    # Smooth out GPS altitude noise before summing climbs and descents
+    window = min(5, altitude.size)
+    smoothed = np.convolve(altitude, np.ones(window) / window, mode="valid")
+    changes = np.diff(smoothed)
+    gain = float(changes[changes > 0].sum())
+    loss = float(-changes[changes < 0].sum())
+
+    gain_per_km = gain / max(length / 1000, 1e-9)
+    if gain_per_km < 5:
+        terrain = "flat"
+    elif gain_per_km < 15:
+        terrain = "rolling"
+    elif gain_per_km < 30:
+        terrain = "hilly"
+    else:
+        terrain = "mountainous"
+
+    highest = int(np.argmax(altitude))
+    samples = np.interp(np.linspace(0, cumulative[-1], 11), cumulative, altitude)
+    return {
+        "gain_m": round(gain),
+        "loss_m": round(loss),
+        "min_m": round(float(altitude.min())),
+        "max_m": round(float(altitude.max())),
+        "terrain": terrain,
+        "highest_point_at_km": round(float(cumulative[highest]) / 1000, 1),
+        "altitude_every_10_percent_m": [round(float(value)) for value in samples],
+    }
+
+
+def describe_route(latlng, altitude=None, gazetteer=None, max_points=60):
+    """
+    Describe a route geometrically from its latlng stream, without rendering it.
+
+    Parameters:
+    latlng: array-like
+        The route as (latitude, longitude) pairs.
+    altitude: array-like, optional
+        Altitude in metres at each latlng point, used for the elevation profile.
+    gazetteer: Gazetteer, optional
+        Places to look up along the route. Landmarks are left out without one.
+    max_points: int
+        The number of simplified route points that landmarks are searched around.
+
+    Returns:
+    description: dict
+        Length, bounding box, shape (loop, out_and_back or point_to_point), dominant heading,
+        farthest point from the start, elevation profile and nearby places.
+    """
+    points = np.asarray(latlng, dtype=float).reshape(-1, 2)
+    valid = ~np.isnan(points).any(axis=1)
+    if altitude is not None and len(altitude) == len(points):
+        altitude = np.asarray(altitude, dtype=float)[valid]
+    else:
+        altitude = None
+    points = points[valid]
+    if len(points) < 2:
+        raise ValueError("The route needs at least two points.")
+
+    lat, lng = points[:, 0], points[:, 1]
+    segment_lengths = haversine(lat[:-1], lng[:-1], lat[1:], lng[1:])
+    cumulative = np.concatenate(([0], np.cumsum(segment_lengths)))
+    length = float(cumulative[-1])
+
+    mid_lat = (lat.min() + lat.max()) / 2
+    description = {
+        "length_km": round(length / 1000, 2),
+        "shape": _route_shape(lat, lng, length),
+        "bounding_box": {
+            "south": round(float(lat.min()), 5), "north": round(float(lat.max()), 5),
+            "west": round(float(lng.min()), 5), "east": round(float(lng.max()), 5),
+            "width_km": round(float(haversine(mid_lat, lng.min(), mid_lat, lng.max())) / 1000, 2),
+            "height_km": round(float(haversine(lat.min(), lng.min(), lat.max(), lng.min())) / 1000, 2),
+        },
+        "start": [round(float(lat[0]), 5), round(float(lng[0]), 5)],
+        "end": [round(float(lat[-1]), 5), round(float(lng[-1]), 5)],
+    }
+
+    shares = _heading_shares(lat, lng, segment_lengths)
+    dominant = max(shares, key=shares.get)
+    description["dominant_heading"] = {"direction": dominant, "share": round(float(shares[dominant]), 2)}
+
+    if description["shape"] == "point_to_point":
+        bearing = float(bearings(lat[0], lng[0], lat[-1], lng[-1]))
+        description["start_to_end"] = {
+            "direction": compass_point(bearing),
+            "distance_km": round(float(haversine(lat[0], lng[0], lat[-1], lng[-1])) / 1000, 2),
+        }
+
+    from_start = haversine(lat[0], lng[0], lat, lng)
+    farthest = int(np.argmax(from_start))
+    description["farthest_from_start"] = {
+        "distance_km": round(float(from_start[farthest]) / 1000, 2),
+        "direction": compass_point(float(bearings(lat[0], lng[0], lat[farthest], lng[farthest]))),
+        "at_km": round(float(cumulative[farthest]) / 1000, 1),
+    }
+
+    if altitude is not None:
+        profile = _elevation_profile(altitude, cumulative, length)
+        if profile is not None:
+            description["elevation"] = profile
+
+    if gazetteer is not None:
+        try:
+            simplified = simplify_route(points, max_points)
+            description["nearby_places"] = gazetteer.nearby(simplified[:, 0], simplified[:, 1])
+            description["start_near"] = gazetteer.nearby(lat[:1], lng[:1], limit=1)
+            description["end_near"] = gazetteer.nearby(lat[-1:], lng[-1:], limit=1)
+        except Exception as e:
+            logging.error("Error looking up places along the route: %s", e)
+
+    return description
@@ -1,4 +1,9 @@
 from client import StravaGPT
+from log_config import configure_logging
+from metrics import start_metrics_server, export_metrics
+from sessions import registry
+from scheduler import scheduler
+from constants import metrics_file
 from dotenv import load_dotenv
 import os
 
@@ -7,6 +12,7 @@ load_dotenv()
 
 
 def main():
+    configure_logging()
     client_id = os.getenv("STRAVA_CLIENT_ID")
     client_secret = os.getenv("STRAVA_CLIENT_SECRET")
     openai_key = os.getenv("OPENAI_KEY")
@@ -14,7 +20,15 @@ def main():
     tavily_api_key = os.getenv("TAVILY_API_KEY")
     redirect_uri = "http://localhost:5000/authorized"
     strava_gpt = StravaGPT(client_id, redirect_uri, client_secret, openai_key, mapbox_access_token, tavily_api_key)
-    strava_gpt.chat_indefinitely()
+
+    # Report the session in the metrics, served while the chat runs and written to a file when it ends
+    registry.add("local", strava_gpt)
+    start_metrics_server(registry, scheduler)
+    try:
+        strava_gpt.chat_indefinitely()
+    finally:
+        if metrics_file:
+            export_metrics(metrics_file)
 
 
 
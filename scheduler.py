@@ -0,0 +1,255 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from requests.adapters import HTTPAdapter
+from stravalib.util.limiter import get_rates_from_response_headers
+
+from singleflight import SingleFlight
+from metrics import api_calls
+from constants import (
+    strava_short_limit, strava_daily_limit, strava_priority_shares, strava_max_retries,
+    strava_backoff_seconds, strava_backoff_max_seconds,
+)
+
+SHORT_WINDOW_SECONDS = 15 * 60
+DAY_SECONDS = 24 * 60 * 60
+
+# Priority classes, most urgent first
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PREFETCH = "prefetch"
+PRIORITIES = [INTERACTIVE, BULK, PREFETCH]
+
+# Only safe requests are retried
+RETRY_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class WindowBucket:
+    """
+    Token bucket for one of Strava's fixed rate-limit windows, refilled when the window rolls over.
+
+    Parameters:
+    limit: int
+        The requests allowed per window.
+    seconds: int
+        The window length, aligned to the epoch like Strava's quarter hours and UTC days.
+    """
+
+    def __init__(self, limit, seconds):
+        self.limit = limit
+        self.seconds = seconds
+        self.window = int(time.time() // seconds)
+        self.used = 0
+
+    def _roll(self, now):
+        window = int(now // self.seconds)
+        if window != self.window:
+            self.window, self.used = window, 0
+
+    # Tokens left for a priority class that may only use a share of the window
+    def available(self, share, now):
+        self._roll(now)
+        return int(self.limit * share) - self.used
+
+    def take(self):
+        self.used += 1
+
+    # Adopt the usage and limit Strava reports, which count every client of the app
+    def sync(self, used, limit, now):
+        self._roll(now)
+        self.limit = limit
+        self.used = used
+
+    def seconds_until_refill(self, now):
+        return self.seconds - now % self.seconds
+
+
+class RequestScheduler:
+    """
+    Process-wide scheduler of Strava API requests.
+
+    Every request takes a token from both the 15 minute and the daily bucket. The buckets
+    are kept in step with the usage Strava reports in its rate limit headers. Requests are
+    served in priority order, interactive first, and lower priority classes may only use
+    a share of each window so there is always room left for interactive requests. Safe
+    requests that get a 429 or a 5xx are retried with jittered exponential backoff, and
+    identical calls that are in flight at the same time share one result.
+
+    Parameters:
+    short_limit: int
+        The 15 minute limit assumed until Strava reports one.
+    daily_limit: int
+        The daily limit assumed until Strava reports one.
+    shares: dict
+        The share of each window that each priority class may use.
+    """
+
+    def __init__(self, short_limit=strava_short_limit, daily_limit=strava_daily_limit, shares=strava_priority_shares):
+        self.short = WindowBucket(short_limit, SHORT_WINDOW_SECONDS)
+        self.daily = WindowBucket(daily_limit, DAY_SECONDS)
+        self.shares = shares
+        self.condition = threading.Condition()
+        self.waiting = []  # heap of (priority rank, arrival order)
+        self.order = itertools.count()
+        self.local = threading.local()
+        self.flights = SingleFlight()  # Identical Strava calls in flight at the same time
+        self.rate_usage = None  # Latest RequestRate reported by Strava
+        self.requests = dict.fromkeys(PRIORITIES, 0)
+        self.retries = 0
+        self.throttled_seconds = 0.0
+
+    # Run the requests of the calling thread under a priority class
+    @contextmanager
+    def priority(self, name):
+        previous = getattr(self.local, "priority", INTERACTIVE)
+        self.local.priority = name
+        try:
+            yield
+        finally:
+            self.local.priority = previous
+
+    def current_priority(self):
+        return getattr(self.local, "priority", INTERACTIVE)
+
+    # Wait for a token from both windows, letting more urgent waiting requests go first
+    def acquire(self, priority=None):
+        priority = priority or self.current_priority()
+        share = self.shares.get(priority, 1.0)
+        entry = (PRIORITIES.index(priority), next(self.order))
+        started = time.monotonic()
+        warned = False
+
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            try:
+                while True:
+                    now = time.time()
+                    if self.waiting[0] == entry:
+                        short_left = self.short.available(share, now)
+                        daily_left = self.daily.available(share, now)
+                        if short_left > 0 and daily_left > 0:
+                            self.short.take()
+                            self.daily.take()
+                            self.requests[priority] += 1
+                            waited = time.monotonic() - started
+                            if waited > 0.01:
+                                self.throttled_seconds += waited
+                            break
+                        wait = self.daily.seconds_until_refill(now) if daily_left <= 0 else self.short.seconds_until_refill(now)
+                        if not warned:
+                            logging.warning("Strava %s budget spent, waiting up to %.0fs", priority, wait)
+                            warned = True
+                    else:
+                        wait = None
+                    self.condition.wait(timeout=wait)
+            finally:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+    # Update the buckets from a response's rate limit headers
+    def record_response(self, headers, method):
+        rates = get_rates_from_response_headers(headers, method)
+        if rates is None:
+            return
+        with self.condition:
+            now = time.time()
+            self.rate_usage = rates
+            self.short.sync(rates.short_usage, rates.short_limit, now)
+            self.daily.sync(rates.long_usage, rates.long_limit, now)
+            self.condition.notify_all()
+
+    # Send a request through the buckets, retrying rate limited and failed safe requests
+    def send(self, method, send_request):
+        attempt = 0
+        while True:
+            self.acquire()
+            response = send_request()
+            self.record_response(response.headers, method)
+
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if not retryable or method not in RETRY_METHODS or attempt >= strava_max_retries:
+                return response
+
+            delay = _retry_after(response) or random.uniform(0, min(strava_backoff_max_seconds, strava_backoff_seconds * 2 ** attempt))
+            logging.warning("Strava returned %s, retrying in %.1fs (attempt %s)", response.status_code, delay, attempt + 1)
+            response.close()
+            attempt += 1
+            self.retries += 1
+            time.sleep(delay)
+
+    # Run fn once for all identical calls that are in flight at the same time
+    def coalesce(self, key, fn):
+        return self.flights.do(key, fn)
+
+    # Snapshot of the request budget and scheduling counters
+    def metrics(self):
+        with self.condition:
+            now = time.time()
+            waiting = dict.fromkeys(PRIORITIES, 0)
+            for rank, _ in self.waiting:
+                waiting[PRIORITIES[rank]] += 1
+            return {
+                "short_used": self.short.used,
+                "short_limit": self.short.limit,
+                "short_left": self.short.available(1.0, now),
+                "daily_used": self.daily.used,
+                "daily_limit": self.daily.limit,
+                "daily_left": self.daily.available(1.0, now),
+                "requests": dict(self.requests),
+                "waiting": waiting,
+                "retries": self.retries,
+                "coalesced": self.flights.shared,
+                "throttled_seconds": round(self.throttled_seconds, 2),
+            }
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ScheduledAdapter(HTTPAdapter):
+    """
+    requests transport adapter that sends every Strava API request through a RequestScheduler.
+
+    Parameters:
+    scheduler: RequestScheduler
+        The scheduler requests go through.
+    """
+
+    def __init__(self, scheduler, **kwargs):
+        self.scheduler = scheduler
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        # Every attempt is counted, retries included, by status code
+        def send_request():
+            try:
+                response = super(ScheduledAdapter, self).send(request, **kwargs)
+            except Exception:
+                api_calls.labels("strava", "error").inc()
+                raise
+            api_calls.labels("strava", str(response.status_code)).inc()
+            return response
+        return self.scheduler.send(request.method, send_request)
+
+
+# The scheduler shared by every session, since Strava's limits apply to the whole app
+scheduler = RequestScheduler()
+
+
+# Route a session's Strava API requests (but not OAuth) through the scheduler
+def mount(session, request_scheduler=scheduler):
+    prefix = "https://www.strava.com/api/"
+    # Sessions shared by many Strava clients are only mounted once, keeping the adapter's connection pool
+    if not isinstance(session.adapters.get(prefix), ScheduledAdapter):
+        session.mount(prefix, ScheduledAdapter(request_scheduler))
+    return session
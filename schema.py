@@ -0,0 +1,238 @@
+import json
+import re
+from datetime import datetime, timedelta, timezone
+
+import polars as pl
+
+# Bumped whenever the stored activity schema changes, forcing a full resync of older stores
+SCHEMA_VERSION = 3
+
+# Typed columns of the activities table, with units stripped to plain numbers
+ACTIVITY_SCHEMA = {
+    "id": pl.Int64,
+    "name": pl.String,
+    "sport_type": pl.Categorical,
+    "type": pl.Categorical,
+    "workout_type": pl.Int32,
+    "start_date": pl.Datetime("us", "UTC"),
+    "start_date_local": pl.Datetime("us"),
+    "timezone": pl.String,
+    "distance": pl.Float64,
+    "moving_time": pl.Int64,
+    "elapsed_time": pl.Int64,
+    "total_elevation_gain": pl.Float64,
+    "elev_high": pl.Float64,
+    "elev_low": pl.Float64,
+    "average_speed": pl.Float64,
+    "max_speed": pl.Float64,
+    "has_heartrate": pl.Boolean,
+    "average_heartrate": pl.Float64,
+    "max_heartrate": pl.Float64,
+    "average_cadence": pl.Float64,
+    "average_watts": pl.Float64,
+    "weighted_average_watts": pl.Float64,
+    "max_watts": pl.Float64,
+    "kilojoules": pl.Float64,
+    "calories": pl.Float64,
+    "suffer_score": pl.Float64,
+    "perceived_exertion": pl.Float64,
+    "average_temp": pl.Float64,
+    "start_lat": pl.Float64,
+    "start_lng": pl.Float64,
+    "end_lat": pl.Float64,
+    "end_lng": pl.Float64,
+    "location_city": pl.String,
+    "location_country": pl.String,
+    "gear_id": pl.String,
+    "device_name": pl.String,
+    "description": pl.String,
+    "commute": pl.Boolean,
+    "trainer": pl.Boolean,
+    "manual": pl.Boolean,
+    "private": pl.Boolean,
+    "kudos_count": pl.Int32,
+    "comment_count": pl.Int32,
+    "achievement_count": pl.Int32,
+    "pr_count": pl.Int32,
+    "athlete_count": pl.Int32,
+    "total_photo_count": pl.Int32,
+}
+
+# Units of the numeric columns, shown to the model alongside the schema
+COLUMN_UNITS = {
+    "distance": "m",
+    "moving_time": "s",
+    "elapsed_time": "s",
+    "total_elevation_gain": "m",
+    "elev_high": "m",
+    "elev_low": "m",
+    "average_speed": "m/s",
+    "max_speed": "m/s",
+    "average_heartrate": "bpm",
+    "max_heartrate": "bpm",
+    "average_cadence": "rpm",
+    "average_watts": "W",
+    "weighted_average_watts": "W",
+    "max_watts": "W",
+    "kilojoules": "kJ",
+    "average_temp": "C",
+}
+
+# Nested activity fields that are split out into their own tables, joined on activity_id
+NESTED_TABLES = {
+    "map": "maps",
+    "laps": "laps",
+    "splits_metric": "splits_metric",
+    "splits_standard": "splits_standard",
+    "best_efforts": "best_efforts",
+    "segment_efforts": "segment_efforts",
+    "photos": "photos",
+}
+
+# Short type names used in the schema description given to the model
+_TYPE_NAMES = {
+    pl.Int64: "int", pl.Int32: "int", pl.Float64: "float", pl.String: "str",
+    pl.Boolean: "bool", pl.Categorical: "category",
+}
+
+
+# Strip units from a value: pint quantities, durations and "H:MM:SS" strings become plain numbers
+def to_number(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if hasattr(value, "magnitude"):
+        return value.magnitude
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, str):
+        if re.fullmatch(r"\d+:\d{1,2}:\d{1,2}(\.\d+)?", value):
+            hours, minutes, seconds = value.split(":")
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        try:
+            return float(value.split()[0])
+        except (ValueError, IndexError):
+            return None
+    return None
+
+
+def to_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+# Parse a datetime, treating naive ones as UTC
+def to_utc(value):
+    value = to_datetime(value)
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+# Split a latlng value (a list, or an object with lat/lon attributes) into floats
+def to_latlng(value):
+    if value is None:
+        return None, None
+    if hasattr(value, "root"):
+        value = value.root
+    if hasattr(value, "lat"):
+        return value.lat, getattr(value, "lon", getattr(value, "lng", None))
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        return value[0], value[1]
+    return None, None
+
+
+def _to_text(value):
+    if value is None:
+        return None
+    return str(getattr(value, "root", value))
+
+
+# Convert a raw activity dictionary into a row of the typed activities table
+def activity_row(activity_dict):
+    row = {}
+    for column, dtype in ACTIVITY_SCHEMA.items():
+        value = activity_dict.get(column)
+        if dtype in (pl.String, pl.Categorical):
+            row[column] = _to_text(value)
+        elif isinstance(dtype, pl.Datetime):
+            value = to_datetime(value)
+            # Naive columns hold local wall-clock time, which Strava sends with a misleading Z suffix
+            if value is not None and dtype.time_zone is None:
+                value = value.replace(tzinfo=None)
+            row[column] = value
+        elif dtype == pl.Boolean:
+            row[column] = None if value is None else bool(value)
+        elif dtype in (pl.Int64, pl.Int32):
+            number = to_number(value)
+            row[column] = None if number is None else int(round(number))
+        else:
+            row[column] = to_number(value)
+
+    row["start_lat"], row["start_lng"] = to_latlng(activity_dict.get("start_latlng"))
+    row["end_lat"], row["end_lng"] = to_latlng(activity_dict.get("end_latlng"))
+    return row
+
+
+# Flatten one nested item into a row of plain values, keeping ids and names of nested objects
+def _nested_row(activity_id, item):
+    row = {}
+    for key, value in item.items():
+        if value is None or key == "bound_client":
+            continue
+        if isinstance(value, dict):
+            for field in ("id", "name"):
+                if value.get(field) is not None:
+                    row[f"{key}_{field}"] = value[field]
+        elif isinstance(value, (list, tuple)):
+            if key.endswith("latlng"):
+                row[f"{key}_lat"], row[f"{key}_lng"] = to_latlng(value)
+            else:
+                row[key] = json.dumps(value, default=str)
+        elif isinstance(value, (str, bool, int, float, datetime)):
+            row[key] = value
+        else:
+            number = to_number(value)
+            row[key] = number if number is not None else str(value)
+
+    # The parent activity id always wins over whatever the nested item carries
+    row["activity_id"] = activity_id
+    return row
+
+
+# Rows of each nested table for one raw activity dictionary
+def nested_rows(activity_dict):
+    activity_id = activity_dict.get("id")
+    tables = {}
+    for field, table in NESTED_TABLES.items():
+        value = activity_dict.get(field)
+        if not value:
+            continue
+        items = value if isinstance(value, (list, tuple)) else [value]
+        tables[table] = [_nested_row(activity_id, item) for item in items if isinstance(item, dict)]
+    return tables
+
+
+# Build a nested table DataFrame from its rows, inferring types from all rows
+def nested_frame(rows):
+    frame = pl.DataFrame(rows, strict=False, infer_schema_length=None)
+    return frame.select("activity_id", pl.all().exclude("activity_id"))
+
+
+# Describe a schema compactly for the system prompt, e.g. "distance: float (m)"
+def describe_schema(schema):
+    columns = []
+    for column, dtype in schema.items():
+        name = _TYPE_NAMES.get(dtype)
+        if name is None:
+            name = "datetime" if isinstance(dtype, pl.Datetime) else str(dtype).lower()
+        unit = COLUMN_UNITS.get(column)
+        columns.append(f"{column}: {name} ({unit})" if unit else f"{column}: {name}")
+    return ", ".join(columns)
@@ -0,0 +1,31 @@
+import re
+
+from constants import search_snippet_chars
+
+
+# Normalise a search query so trivially different spellings share a cache entry:
+# case, punctuation and spacing are ignored
+def normalise_query(query):
+    query = re.sub(r"[^\w\s'-]", " ", query.casefold())
+    return " ".join(query.split())
+
+
+# Trim a raw Tavily response to the title, url and a snippet of each result, dropping duplicate URLs
+def trim_results(response, snippet_chars=search_snippet_chars):
+    results = []
+    seen = set()
+    for result in response.get("results") or []:
+        url = result.get("url")
+        if not url or url in seen:
+            continue
+        seen.add(url)
+
+        snippet = " ".join((result.get("content") or "").split())
+        if len(snippet) > snippet_chars:
+            snippet = snippet[:snippet_chars].rsplit(" ", 1)[0] + "..."
+        results.append({"title": result.get("title"), "url": url, "snippet": snippet})
+
+    trimmed = {"results": results}
+    if response.get("answer"):
+        trimmed["answer"] = response["answer"]
+    return trimmed
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from openai import OpenAI, AsyncOpenAI
+from tavily import TavilyClient
+
+from constants import tools, session_ttl_seconds, session_memory_budget_bytes, data_dir, photo_description_cache_size, search_cache_size, search_cache_ttl_seconds
+from stream_cache import StreamCache
+from route import Gazetteer
+from singleflight import SingleFlight
+from sqlite_cache import SqliteCache
+
+
+class SharedResources:
+    """
+    Process-wide clients and read-only assets shared by every StravaGPT session.
+
+    The OpenAI and Tavily clients use the app's own API keys, so one instance (and one HTTP
+    connection pool) serves every user. Strava requests share a single requests.Session,
+    since the per-user access token is sent per request. Async OpenAI calls all run on one
+    background event loop so the async client's connection pool is shared too. The stream
+    cache is shared under one size budget but keyed by athlete, so sessions only ever see
+    the streams their own athlete fetched.
+
+    Parameters:
+    openai_key: str
+        The OpenAI API key.
+    tavily_api_key: str
+        The Tavily API key.
+    """
+
+    def __init__(self, openai_key, tavily_api_key):
+        self.openai_client = OpenAI(api_key=openai_key)
+        self.async_openai_client = AsyncOpenAI(api_key=openai_key)
+        self.tavily = TavilyClient(api_key=tavily_api_key)
+        self.strava_session = requests.Session()
+        self.stream_cache = StreamCache()
+        self.gazetteer = Gazetteer()
+        self.single_flight = SingleFlight()  # Identical OpenAI and Tavily calls in flight at once share one request
+        self.photo_descriptions = SqliteCache(os.path.join(data_dir, "photo_descriptions.sqlite"), photo_description_cache_size)
+        self.search_results = SqliteCache(os.path.join(data_dir, "search_results.sqlite"), search_cache_size, ttl_seconds=search_cache_ttl_seconds)
+        self.tools = tools
+
+        package_dir = os.path.dirname(__file__)
+        with open(os.path.join(package_dir, "system_prompt.txt"), "r") as f:
+            self.system_prompt_template = f.read()
+
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="stravagpt-async", daemon=True).start()
+
+    # Run a coroutine on the shared event loop and wait for its result
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+class SessionRegistry:
+    """
+    Process-wide registry of live StravaGPT sessions.
+
+    Sessions idle for longer than the TTL are evicted, and if the sessions together use more
+    than the memory budget the least recently used ones are evicted until they fit.
+
+    Parameters:
+    ttl_seconds: float
+        How long a session may be idle before it is evicted.
+    max_bytes: int
+        The memory budget of all sessions together.
+    """
+
+    def __init__(self, ttl_seconds=session_ttl_seconds, max_bytes=session_memory_budget_bytes):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sessions = OrderedDict()  # session id -> (session, last used), least recently used first
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    # Get a session and mark it as used
+    def get(self, session_id):
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return None
+            self.sessions[session_id] = (entry[0], time.monotonic())
+            self.sessions.move_to_end(session_id)
+            return entry[0]
+
+    def add(self, session_id, session):
+        with self.lock:
+            self.sessions[session_id] = (session, time.monotonic())
+            self.sessions.move_to_end(session_id)
+        logging.info("Registered session %s, %s active", session_id, len(self.sessions))
+
+    def remove(self, session_id):
+        with self.lock:
+            entry = self.sessions.pop(session_id, None)
+        if entry is not None:
+            entry[0].close()
+
+    # Estimated memory of each session in bytes
+    def memory_usage(self):
+        with self.lock:
+            sessions = [(session_id, session) for session_id, (session, _) in self.sessions.items()]
+        return {session_id: session.memory_usage() for session_id, session in sessions}
+
+    # Evict idle sessions, then the least recently used ones while over the memory budget
+    def evict(self):
+        now = time.monotonic()
+        with self.lock:
+            idle = [session_id for session_id, (_, last_used) in self.sessions.items() if now - last_used > self.ttl_seconds]
+            evicted = [self.sessions.pop(session_id)[0] for session_id in idle]
+        for session_id, session in zip(idle, evicted):
+            session.close()
+            logging.info("Evicted session %s after %ss idle", session_id, self.ttl_seconds)
+
+        usage = self.memory_usage()
+        total = sum(usage.values())
+        with self.lock:
+            while total > self.max_bytes and len(self.sessions) > 1:
+                session_id, (session, _) = self.sessions.popitem(last=False)
+                session.close()
+                total -= usage.get(session_id, 0)
+                logging.info("Evicted session %s to stay within the %s byte memory budget", session_id, self.max_bytes)
+        return total
+
+
+# The registry shared by every Streamlit session in this process
+registry = SessionRegistry()
@@ -0,0 +1,47 @@
+import concurrent.futures
+import threading
+
+
+class SingleFlight:
+    """
+    Run a call once for all identical calls that are in flight at the same time.
+
+    The first caller for a key runs the call; callers that arrive while it is running wait
+    on the same future and get its result, or its exception. Once the call finishes the key
+    is forgotten, so later calls run again; caching results is left to the caller.
+    """
+
+    def __init__(self):
+        self.calls = {}  # key -> future of the call in flight
+        self.lock = threading.Lock()
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = concurrent.futures.Future()
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
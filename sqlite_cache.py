@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import record_cache
+
+
+class SqliteCache:
+    """
+    Persistent key-value cache of JSON values in a SQLite file, shared by every session.
+
+    Entries older than the TTL are treated as missing, and once the cache holds more than
+    max_entries the least recently used ones are dropped.
+
+    Parameters:
+    path: str
+        The SQLite database file.
+    max_entries: int
+        The maximum number of entries kept.
+    ttl_seconds: float, optional
+        How long an entry stays valid. Entries never expire without one.
+    """
+
+    def __init__(self, path, max_entries, ttl_seconds=None):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]  # Names the cache in metrics
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def get(self, key):
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                record_cache(self.name, False)
+                return None
+            self.connection.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        record_cache(self.name, True)
+        return json.loads(row[0])
+
+    # Look up several keys at once, returning the values found
+    def get_many(self, keys):
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def put(self, key, value):
+        now = time.time()
+        try:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now),
+                )
+                self.connection.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error as e:
+            logging.error("Error writing to cache %s: %s", self.path, e)
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM entries")
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+import polars as pl
+
+from constants import data_dir
+from schema import SCHEMA_VERSION
+
+
+class ActivityStore:
+    """
+    On-disk Parquet store of one athlete's activities, keyed by activity id.
+
+    The store records the latest activity start_date it has synced (the high-water mark)
+    so later syncs only need to ask Strava for activities after that point. Nested tables
+    (laps, splits, best efforts, ...) are kept in their own Parquet files and are only read
+    when a query needs them. Stores written with an older schema version are ignored, which
+    triggers a full resync.
+
+    Parameters:
+    athlete_id: int
+        The Strava athlete id the store belongs to.
+    root: str
+        The directory that holds the per-athlete stores.
+    """
+
+    def __init__(self, athlete_id, root=data_dir):
+        self.athlete_id = athlete_id
+        self.directory = os.path.join(root, f"athlete_{athlete_id}")
+        self.path = os.path.join(self.directory, "activities.parquet")
+        self.meta_path = os.path.join(self.directory, "sync.json")
+        self.interest_path = os.path.join(self.directory, "interest.json")
+        self.lock = threading.RLock()  # Syncs and background feature indexing write to the same files
+
+    def _nested_path(self, table):
+        return os.path.join(self.directory, f"{table}.parquet")
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def exists(self):
+        return os.path.exists(self.path) and self._read_meta().get("schema_version") == SCHEMA_VERSION
+
+    # Lazily scan the stored activities without reading them into memory
+    def scan(self):
+        if not self.exists():
+            return None
+        return pl.scan_parquet(self.path)
+
+    # Lazily scan each stored nested table
+    def scan_nested(self):
+        if not self.exists():
+            return {}
+        tables = self._read_meta().get("nested_tables", [])
+        return {table: pl.scan_parquet(self._nested_path(table)) for table in tables if os.path.exists(self._nested_path(table))}
+
+    # Read the stored activities into a DataFrame
+    def load(self):
+        if not self.exists():
+            return None
+        logging.debug("Loading activities from local store: %s", self.path)
+        return pl.read_parquet(self.path)
+
+    # Read the start_date of the newest synced activity
+    def high_water_mark(self):
+        if not self.exists():
+            return None
+        try:
+            return datetime.fromisoformat(self._read_meta()["high_water_mark"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    # How often each activity has been asked about, across sessions
+    def load_interest(self):
+        try:
+            with open(self.interest_path, "r") as f:
+                return {int(activity_id): count for activity_id, count in json.load(f).items()}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def record_interest(self, activity_id):
+        with self.lock:
+            interest = self.load_interest()
+            interest[int(activity_id)] = interest.get(int(activity_id), 0) + 1
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.interest_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(interest, f)
+            os.replace(tmp_path, self.interest_path)
+
+    # Merge newly fetched activities and their nested tables into the store, deduplicating by activity id
+    def merge(self, activities_pl, nested=None, existing=None):
+        with self.lock:
+            if existing is None:
+                existing = self.load()
+            if existing is not None:
+                activities_pl = pl.concat([existing, activities_pl], how="diagonal_relaxed")
+
+            # Keep the most recently fetched copy of each activity
+            merged = activities_pl.unique(subset="id", keep="last", maintain_order=True)
+            merged = merged.sort(_start_date_expr(merged), descending=True, nulls_last=True)
+
+            nested_tables = self._merge_nested(nested or {})
+            self._write(merged, nested_tables)
+        logging.info("Local store for athlete %s now holds %s activities", self.athlete_id, merged.height)
+        return merged
+
+    # Merge rows of tables derived after ingest, such as the feature index, without rewriting the activities
+    def merge_tables(self, tables):
+        with self.lock:
+            if not self.exists():
+                return
+            meta = self._read_meta()
+            meta["nested_tables"] = self._merge_nested(tables)
+            self._write_meta(meta)
+
+    # Replace the nested rows of the newly fetched activities, keeping everything else
+    def _merge_nested(self, nested):
+        tables = set(self._read_meta().get("nested_tables", [])) if self.exists() else set()
+        for table, rows in nested.items():
+            path = self._nested_path(table)
+            if table in tables and os.path.exists(path):
+                stale = rows["activity_id"].unique().implode()
+                existing = pl.read_parquet(path).filter(~pl.col("activity_id").is_in(stale))
+                rows = pl.concat([existing, rows], how="diagonal_relaxed")
+
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = path + ".tmp"
+            rows.write_parquet(tmp_path)
+            os.replace(tmp_path, path)
+            tables.add(table)
+        return sorted(tables)
+
+    def _write(self, activities_pl, nested_tables):
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Write to a temporary file first so a crash never leaves a truncated store behind
+        tmp_path = self.path + ".tmp"
+        activities_pl.write_parquet(tmp_path)
+        os.replace(tmp_path, self.path)
+
+        meta = {"schema_version": SCHEMA_VERSION, "nested_tables": nested_tables}
+        high_water_mark = activities_pl.select(_start_date_expr(activities_pl).max()).item()
+        if high_water_mark is not None:
+            meta["high_water_mark"] = high_water_mark.isoformat()
+        self._write_meta(meta)
+
+    def _write_meta(self, meta):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+
+# Expression returning start_date as a UTC datetime, whether it was stored as text or a datetime
+def _start_date_expr(activities_pl):
+    dtype = activities_pl.schema.get("start_date")
+    if dtype == pl.String:
+        return pl.col("start_date").str.to_datetime(time_zone="UTC")
+    if isinstance(dtype, pl.Datetime):
+        if dtype.time_zone is None:
+            return pl.col("start_date").dt.replace_time_zone("UTC")
+        return pl.col("start_date").dt.convert_time_zone("UTC")
+    return pl.lit(None, dtype=pl.Datetime(time_zone="UTC"))
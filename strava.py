@@ -1,26 +1,26 @@
 import logging
+import threading
 from datetime import datetime
 from stravalib.client import Client
+import requests
+
+from scheduler import scheduler, mount
+from log_config import preview
+from metrics import strava_call_seconds
 import webbrowser
 import time
 from urllib.parse import urlparse, parse_qs
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('run.log'),  # Logs to a file
-        logging.StreamHandler()  # Logs to console
-    ]
-)
-logging.getLogger("watchdog").setLevel(logging.WARNING)
+from schema import to_utc
+
+# Start of the history synced from Strava
+HISTORY_START = datetime(2020, 1, 1)
 
 
 class Strava():
-    def __init__(self, client_id, redirect_uri, client_secret):
+    def __init__(self, client_id, redirect_uri, client_secret, requests_session=None):
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger.debug(f"Initializing Strava client with client_id: {client_id}, redirect_uri: {redirect_uri}")
+        self.logger.debug("Initializing Strava client with client_id: %s, redirect_uri: %s", client_id, redirect_uri)
         
         self.client_id = client_id
         self.redirect_uri = redirect_uri
@@ -28,14 +28,42 @@ class Strava():
         self.access_token = None
         self.refresh_token = None
         self.expires_at = None
-        self.client = Client()
+        # Every API request goes through the process-wide scheduler, which keeps the app within Strava's rate limits
+        self.scheduler = scheduler
+        self.client = Client(requests_session=mount(requests_session or requests.Session(), scheduler))
+        self.api_calls = 0
+        self._api_calls_lock = threading.Lock()
+        self._thread_api_calls = threading.local()
         self.logger.info("Strava client initialized successfully.")
 
+    # Count an API request, both in total and for the calling thread
+    def _record_call(self):
+        with self._api_calls_lock:
+            self.api_calls += 1
+        self._thread_api_calls.count = self.thread_api_calls() + 1
+
+    # Latest usage and limits reported in Strava's rate limit headers, across every client of the app
+    @property
+    def rate_usage(self):
+        return self.scheduler.rate_usage
+
+    # Make an API call once for identical calls in flight at the same time, counting it once
+    def _call(self, key, fn):
+        def call():
+            self._record_call()
+            with strava_call_seconds.labels(key[0]).time():
+                return fn()
+        return self.scheduler.coalesce((self.access_token, *key), call)
+
+    # Number of API requests made from the calling thread, used to attribute calls to tools
+    def thread_api_calls(self):
+        return getattr(self._thread_api_calls, "count", 0)
+
     def authorise(self):
         self.logger.debug("Starting authorization process...")
         try:
             authorize_url = self.client.authorization_url(client_id=self.client_id, redirect_uri=self.redirect_uri)
-            self.logger.debug(f"Generated authorization URL: {authorize_url}")
+            self.logger.debug("Generated authorization URL: %s", authorize_url)
 
             webbrowser.open_new_tab(authorize_url)
             self.logger.info("Authorization page opened in browser.")
@@ -43,18 +71,18 @@ class Strava():
             time.sleep(10)
             
             redirect_response = input("Please paste the full redirect URL here: ")
-            self.logger.debug(f"Received redirect response: {redirect_response}")
+            self.logger.debug("Received redirect response: %s", preview(redirect_response))
             
             parsed_url = urlparse(redirect_response)
             code = parse_qs(parsed_url.query).get('code', [None])[0]
-            self.logger.debug(f"Parsed authorization code: {code}")
+            self.logger.debug("Parsed authorization code: %s", code)
 
             if not code:
                 raise ValueError("No authorization code found in the URL.")
             self.logger.info("Authorization code successfully retrieved.")
 
         except Exception as e:
-            self.logger.error(f"Error during authorization: {str(e)}", exc_info=True)
+            self.logger.error("Error during authorization: %s", e, exc_info=True)
             print("Falling back to manual input method.")
             print("Please visit this URL to authorize: ", authorize_url)
             code = input("Enter the code you received after authorization: ")
@@ -65,102 +93,126 @@ class Strava():
                 client_secret=self.client_secret,
                 code=code
             )
-            self.logger.debug(f"Token exchange response: {token_response}")
+            self.logger.debug("Token exchange response: %s", preview(token_response))
             
             self.set_tokens(token_response)
             self.logger.info("Authorization and token exchange successful.")
         except Exception as e:
-            self.logger.error(f"Error exchanging code for token: {str(e)}", exc_info=True)
+            self.logger.error("Error exchanging code for token: %s", e, exc_info=True)
             raise e
 
     def get_authorisation_url(self):
         try:
             self.logger.debug("Generating authorization URL...")
             url = self.client.authorization_url(client_id=self.client_id, redirect_uri=self.redirect_uri)
-            self.logger.debug(f"Authorization URL: {url}")
+            self.logger.debug("Authorization URL: %s", url)
             return url
         except Exception as e:
-            self.logger.error(f"Failed to generate authorization URL: {str(e)}", exc_info=True)
+            self.logger.error("Failed to generate authorization URL: %s", e, exc_info=True)
             raise e
 
     def exchange_code_for_token(self, code):
         try:
-            self.logger.debug(f"Exchanging code {code} for token...")
+            self.logger.debug("Exchanging code %s for token...", code)
             token_response = self.client.exchange_code_for_token(
                 client_id=self.client_id,
                 client_secret=self.client_secret,
                 code=code
             )
-            self.logger.debug(f"Token response: {token_response}")
+            self.logger.debug("Token response: %s", preview(token_response))
             return token_response
         except Exception as e:
-            self.logger.error(f"Error during token exchange: {str(e)}", exc_info=True)
+            self.logger.error("Error during token exchange: %s", e, exc_info=True)
             raise e
 
     def set_tokens(self, token_response):
         try:
-            self.logger.debug(f"Setting tokens: {token_response}")
+            self.logger.debug("Setting tokens: %s", preview(token_response))
             self.access_token = token_response["access_token"]
             self.refresh_token = token_response["refresh_token"]
             self.expires_at = token_response["expires_at"]
             self.client.access_token = self.access_token
             self.logger.info("Tokens set successfully.")
         except Exception as e:
-            self.logger.error(f"Error setting tokens: {str(e)}", exc_info=True)
+            self.logger.error("Error setting tokens: %s", e, exc_info=True)
             raise e
 
-    def get_activities(self, start_date=None, end_date=None):
-        self.logger.debug(f"Fetching activities from {start_date} to {end_date}...")
+    def get_activities(self, start_date=None, end_date=None, newest_first=False):
+        self.logger.debug("Fetching activities from %s to %s...", start_date, end_date)
         try:
             if start_date is None:
-                start_date = datetime(2020, 1, 1)
+                start_date = HISTORY_START
             if end_date is None:
                 end_date = datetime.now()
             
-            activities = self.client.get_activities(after=start_date, before=end_date)
-            self.logger.info(f"Fetched activities between {start_date} and {end_date}")
+            self._record_call()
+            if newest_first:
+                # Strava lists activities newest first when only given an end date, so stop paging at the start date
+                activities = _started_after(self.client.get_activities(before=end_date), start_date)
+            else:
+                activities = self.client.get_activities(after=start_date, before=end_date)
+            self.logger.info("Fetched activities between %s and %s", start_date, end_date)
             return activities
         except Exception as e:
-            self.logger.error(f"Error fetching activities: {str(e)}", exc_info=True)
+            self.logger.error("Error fetching activities: %s", e, exc_info=True)
             raise e
 
     def get_activity_streams(self, activity_id, types=["time", "heartrate", "latlng"], resolution="medium"):
-        self.logger.debug(f"Fetching activity streams for activity_id: {activity_id}, types: {types}, resolution: {resolution}")
+        self.logger.debug("Fetching activity streams for activity_id: %s, types: %s, resolution: %s", activity_id, types, resolution)
         try:
-            streams = self.client.get_activity_streams(activity_id, types=types, resolution=resolution)
-            self.logger.info(f"Fetched activity streams for activity_id: {activity_id}")
+            streams = self._call(
+                ("streams", activity_id, tuple(types), resolution),
+                lambda: self.client.get_activity_streams(activity_id, types=types, resolution=resolution),
+            )
+            self.logger.info("Fetched activity streams for activity_id: %s", activity_id)
             return streams
         except Exception as e:
-            self.logger.error(f"Error fetching activity streams for activity_id: {activity_id}: {str(e)}", exc_info=True)
+            self.logger.error("Error fetching activity streams for activity_id: %s: %s", activity_id, e, exc_info=True)
             raise e
 
     def get_athlete(self):
         self.logger.debug("Fetching athlete information...")
         try:
-            athlete = self.client.get_athlete()
+            athlete = self._call(("athlete",), self.client.get_athlete)
             self.logger.info("Fetched athlete information successfully.")
             return athlete
         except Exception as e:
-            self.logger.error(f"Error fetching athlete information: {str(e)}", exc_info=True)
+            self.logger.error("Error fetching athlete information: %s", e, exc_info=True)
             raise e
 
     def get_athlete_stats(self, athlete_id):
-        self.logger.debug(f"Fetching stats for athlete_id: {athlete_id}")
+        self.logger.debug("Fetching stats for athlete_id: %s", athlete_id)
         try:
-            stats = self.client.get_athlete_stats(athlete_id)
-            self.logger.info(f"Fetched athlete stats for athlete_id: {athlete_id}")
+            stats = self._call(("athlete_stats", athlete_id), lambda: self.client.get_athlete_stats(athlete_id))
+            self.logger.info("Fetched athlete stats for athlete_id: %s", athlete_id)
             return stats
         except Exception as e:
-            self.logger.error(f"Error fetching athlete stats for athlete_id: {athlete_id}: {str(e)}", exc_info=True)
+            self.logger.error("Error fetching athlete stats for athlete_id: %s: %s", athlete_id, e, exc_info=True)
             raise e
 
     def get_activity_photos(self, activity_id, max_resolution=250):
-        self.logger.debug(f"Fetching activity photos for activity_id: {activity_id} with resolution: {max_resolution}")
+        self.logger.debug("Fetching activity photos for activity_id: %s with resolution: %s", activity_id, max_resolution)
         try:
-            batch = self.client.get_activity_photos(activity_id, max_resolution)
-            photos = [photo.urls[str(max_resolution)] for photo in batch]
-            self.logger.info(f"Fetched {len(photos)} photos for activity_id: {activity_id}")
+            photos = self._call(
+                ("photos", activity_id, max_resolution),
+                lambda: [
+                    {"id": photo.unique_id, "url": photo.urls[str(max_resolution)]}
+                    for photo in self.client.get_activity_photos(activity_id, max_resolution)
+                ],
+            )
+            self.logger.info("Fetched %s photos for activity_id: %s", len(photos), activity_id)
             return photos
         except Exception as e:
-            self.logger.error(f"Error fetching activity photos for activity_id: {activity_id}: {str(e)}", exc_info=True)
+            self.logger.error("Error fetching activity photos for activity_id: %s: %s", activity_id, e, exc_info=True)
             raise e
+
+
+# Take activities from a newest first iterator until one starts at or before the start date
+def _started_after(activities, start_date):
+    start_date = to_utc(start_date)
+    for activity in activities:
+        started = to_utc(getattr(activity, "start_date", None))
+        if started is not None and started <= start_date:
+            return
+        yield activity
+
@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from constants import data_dir, stream_cache_max_bytes
+from metrics import record_cache
+
+
+class CachedStream:
+    """
+    A single activity stream read from the cache, mirroring the stravalib Stream interface.
+
+    Parameters:
+    type: str
+        The stream type, e.g. "latlng" or "heartrate".
+    data: numpy.ndarray
+        The memory-mapped stream values. latlng streams have shape (n, 2).
+    """
+
+    def __init__(self, type, data):
+        self.type = type
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+
+class StreamCache:
+    """
+    Content-addressed on-disk cache of activity streams stored as numpy .npy files.
+
+    Each (activity_id, stream type, resolution) is stored in its own file named by the hash
+    of that key, so a request for a subset of cached types never touches the Strava API.
+    Files live in a directory per athlete and the athlete id is part of the key, so a cached
+    stream is only served to the athlete whose token fetched it from Strava.
+    Reads are memory-mapped and the least recently used files are evicted once the cache
+    grows past its size budget. Stream types Strava has no data for are cached as empty
+    arrays so they are not requested again.
+
+    Parameters:
+    directory: str
+        The directory the .npy files are written to.
+    max_bytes: int
+        The size budget of the cache on disk.
+    """
+
+    def __init__(self, directory=os.path.join(data_dir, "streams"), max_bytes=stream_cache_max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # path -> size in bytes, least recently used first
+        self.total_bytes = 0
+        self._load_index()
+
+    # Rebuild the LRU index from the files already on disk, oldest first
+    def _load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                if not name.endswith(".npy"):
+                    continue
+                if root == self.directory:
+                    # Streams cached before the cache was scoped by athlete cannot be attributed to one
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                files.append((stat.st_mtime, path, stat.st_size))
+
+        for _, path, size in sorted(files):
+            self.entries[path] = size
+            self.total_bytes += size
+        logging.debug("Stream cache holds %s streams (%s bytes)", len(self.entries), self.total_bytes)
+
+    def _path(self, athlete_id, activity_id, stream_type, resolution):
+        key = f"{athlete_id}:{activity_id}:{stream_type}:{resolution}".encode("utf-8")
+        return os.path.join(self.directory, str(int(athlete_id)), hashlib.sha256(key).hexdigest()[:32] + ".npy")
+
+    # Look up an athlete's cached streams, returning the hits and the types that still need fetching
+    def get(self, athlete_id, activity_id, types, resolution):
+        activity_id = str(activity_id).strip()
+        hits = {}
+        missing = []
+
+        for stream_type in types:
+            path = self._path(athlete_id, activity_id, stream_type, resolution)
+            with self.lock:
+                cached = path in self.entries
+                if cached:
+                    self.entries.move_to_end(path)
+            if not cached:
+                missing.append(stream_type)
+                continue
+
+            try:
+                data = np.load(path, mmap_mode="r")
+                os.utime(path)
+            except (OSError, ValueError) as e:
+                logging.warning("Dropping unreadable cached stream %s: %s", path, e)
+                self._remove(path)
+                missing.append(stream_type)
+                continue
+
+            # Empty arrays record stream types the activity has no data for
+            if len(data) > 0:
+                hits[stream_type] = CachedStream(stream_type, data)
+
+        logging.debug("Stream cache for activity %s: %s hits, %s misses", activity_id, len(types) - len(missing), len(missing))
+        record_cache("streams", True, len(types) - len(missing))
+        record_cache("streams", False, len(missing))
+        return hits, missing
+
+    # Store the streams returned by Strava for an athlete, marking requested types that came back empty
+    def put(self, athlete_id, activity_id, resolution, streams, requested=()):
+        activity_id = str(activity_id).strip()
+        arrays = {stream_type: _to_array(stream.data) for stream_type, stream in streams.items()}
+        for stream_type in requested:
+            arrays.setdefault(stream_type, np.empty(0))
+
+        os.makedirs(os.path.join(self.directory, str(int(athlete_id))), exist_ok=True)
+        for stream_type, array in arrays.items():
+            path = self._path(athlete_id, activity_id, stream_type, resolution)
+            # Per-thread temporary file, as concurrent tool calls can fetch the same stream
+            tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+
+            with self.lock:
+                self.total_bytes += size - self.entries.pop(path, 0)
+                self.entries[path] = size
+
+        self._evict()
+        return {stream_type: CachedStream(stream_type, array) for stream_type, array in arrays.items() if len(array) > 0}
+
+    # Evict least recently used streams until the cache fits its budget
+    def _evict(self):
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or not self.entries:
+                    return
+                path = next(iter(self.entries))
+            logging.debug("Evicting cached stream %s", path)
+            self._remove(path)
+
+    def _remove(self, path):
+        with self.lock:
+            self.total_bytes -= self.entries.pop(path, 0)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Convert raw stream values to a numpy array, using NaN for gaps in numeric streams
+def _to_array(values):
+    array = np.asarray(values)
+    if array.dtype == object:
+        array = np.array([np.nan if value is None else value for value in values], dtype=float)
+    return array
@@ -0,0 +1,223 @@
+import heapq
+
+import numpy as np
+
+from constants import heart_rate_zone_bounds
+
+
+# Summary statistics of a single numeric stream, ignoring gaps
+def stream_stats(values):
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return None
+
+    p10, p50, p90 = np.percentile(values, [10, 50, 90])
+    return {
+        "min": round(float(values.min()), 2),
+        "max": round(float(values.max()), 2),
+        "mean": round(float(values.mean()), 2),
+        "std": round(float(values.std()), 2),
+        "p10": round(float(p10), 2),
+        "median": round(float(p50), 2),
+        "p90": round(float(p90), 2),
+    }
+
+
+# Seconds spent in each heart rate zone, with zones defined as fractions of max heart rate
+def heart_rate_zones(heartrate, time, max_heart_rate, bounds=heart_rate_zone_bounds):
+    heartrate = np.asarray(heartrate, dtype=float)
+    time = np.asarray(time, dtype=float)
+
+    # Each sample counts for the time until the next one
+    durations = np.diff(time, append=time[-1])
+    edges = np.concatenate(([0], np.asarray(bounds) * max_heart_rate, [np.inf]))
+    seconds, _ = np.histogram(heartrate, bins=edges, weights=durations)
+
+    zones = {}
+    for zone, (low, high, total) in enumerate(zip(edges[:-1], edges[1:], seconds)):
+        label = f"zone_{zone}" if zone else "below_zone_1"
+        zones[label] = {
+            "bpm": f"{int(low)}+" if np.isinf(high) else f"{int(low)}-{int(high)}",
+            "seconds": int(total),
+        }
+    return zones
+
+
+# Time, pace and elevation change for each full split of the activity
+def splits(distance, time, split_length=1000, altitude=None, heartrate=None):
+    distance = np.asarray(distance, dtype=float)
+    time = np.asarray(time, dtype=float)
+
+    marks = np.arange(split_length, distance[-1] + 1e-9, split_length)
+    if marks.size == 0:
+        return []
+
+    # Interpolate the time and altitude at every split boundary
+    boundaries = np.concatenate(([distance[0]], marks))
+    split_times = np.diff(np.interp(boundaries, distance, time))
+
+    result = [
+        {"split": i + 1, "seconds": int(round(t)), "pace_per_km": _format_pace(t / split_length * 1000)}
+        for i, t in enumerate(split_times)
+    ]
+
+    # Streams not sampled alongside distance cannot be split by it, and are left out
+    if altitude is not None and len(altitude) != distance.size:
+        altitude = None
+    if heartrate is not None and len(heartrate) != distance.size:
+        heartrate = None
+
+    if altitude is not None:
+        elevation = np.diff(np.interp(boundaries, distance, np.asarray(altitude, dtype=float)))
+        for row, change in zip(result, elevation):
+            row["elevation_change"] = round(float(change), 1)
+
+    if heartrate is not None:
+        # Average heart rate of the samples that fall inside each split
+        split_index = np.searchsorted(boundaries, distance, side="right") - 1
+        heartrate = np.asarray(heartrate, dtype=float)
+        for i, row in enumerate(result):
+            in_split = heartrate[split_index == i]
+            if in_split.size:
+                row["average_heartrate"] = round(float(np.nanmean(in_split)), 1)
+
+    return result
+
+
+def _format_pace(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return f"{minutes}:{seconds:02d}"
+
+
+# Largest-Triangle-Three-Buckets downsampling, which keeps the visual shape of a series
+def lttb(x, y, max_points):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = x.size
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    # The first and last points are always kept, the rest are split into equal buckets
+    bucket_edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    selected = np.empty(max_points, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(max_points - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+        next_start, next_end = end, bucket_edges[i + 2] if i + 2 < len(bucket_edges) else n
+        next_x = x[next_start:next_end].mean()
+        next_y = np.nanmean(y[next_start:next_end]) if next_end > next_start else y[-1]
+
+        # Pick the point forming the largest triangle with the previous pick and the next bucket's mean
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.nanargmax(areas)) if np.any(~np.isnan(areas)) else start
+        selected[i + 1] = previous
+
+    return selected
+
+
+# Perpendicular distance of the points between start and end to the segment joining them
+def _segment_distances(points, start, end):
+    segment = points[end] - points[start]
+    inner = points[start + 1:end] - points[start]
+    length = np.hypot(*segment)
+    if length == 0:
+        return np.hypot(inner[:, 0], inner[:, 1])
+    return np.abs(segment[0] * inner[:, 1] - segment[1] * inner[:, 0]) / length
+
+
+# Ramer-Douglas-Peucker simplification of a latlng track to at most max_points
+def simplify_route(latlng, max_points):
+    points = np.asarray(latlng, dtype=float)
+    n = len(points)
+    if n <= max(max_points, 2):
+        return points
+
+    # Split the segment with the farthest outlying point first, so the most important points are kept
+    def candidate(start, end):
+        if end - start < 2:
+            return None
+        distances = _segment_distances(points, start, end)
+        farthest = int(np.argmax(distances))
+        return (-distances[farthest], start, end, start + 1 + farthest)
+
+    keep = [0, n - 1]
+    heap = [candidate(0, n - 1)]
+    while heap and len(keep) < max_points:
+        negative_distance, start, end, index = heapq.heappop(heap)
+        if negative_distance == 0:
+            break
+        keep.append(index)
+        for segment in (candidate(start, index), candidate(index, end)):
+            if segment is not None:
+                heapq.heappush(heap, segment)
+
+    return points[sorted(keep)]
+
+
+def summarise_streams(streams, max_points, max_heart_rate=None):
+    """
+    Build a compact summary of an activity's streams for the model.
+
+    Parameters:
+    streams: dict
+        Stream type to stream object with a .data array, as returned by StravaGPT.get_streams.
+    max_points: int
+        The maximum number of points kept for each downsampled series and the route.
+    max_heart_rate: float, optional
+        The athlete's max heart rate, used for zones. Defaults to the highest value in the stream.
+
+    Returns:
+    summary: dict
+        Per-stream statistics, heart rate zones, per-km splits, downsampled series
+        (as [time, value] pairs) and a simplified route.
+    """
+    data = {stream_type: np.asarray(stream.data) for stream_type, stream in streams.items()}
+    time = data.get("time")
+    distance = data.get("distance")
+    summary = {"points": int(max((len(values) for values in data.values()), default=0))}
+
+    summary["stats"] = {
+        stream_type: stream_stats(values)
+        for stream_type, values in data.items()
+        if stream_type not in ("time", "latlng", "moving")
+    }
+    if time is not None and len(time):
+        summary["duration_seconds"] = int(time[-1] - time[0])
+    if "moving" in data:
+        summary["moving_fraction"] = round(float(np.mean(data["moving"])), 3)
+
+    # Empty or all-NaN heart rate streams, e.g. from a strap that never connected, are left out
+    heartrate = data.get("heartrate")
+    if heartrate is not None and not np.any(~np.isnan(np.asarray(heartrate, dtype=float))):
+        heartrate = None
+    if heartrate is not None and time is not None and len(heartrate) == len(time):
+        max_heart_rate = max_heart_rate or float(np.nanmax(heartrate))
+        summary["heart_rate_zones"] = heart_rate_zones(heartrate, time, max_heart_rate)
+
+    if distance is not None and time is not None and len(distance) == len(time) and len(distance):
+        summary["splits"] = splits(distance, time, altitude=data.get("altitude"), heartrate=heartrate)
+
+    # Downsample every other numeric stream against time, keeping its shape
+    if time is not None:
+        summary["series"] = {}
+        for stream_type, values in data.items():
+            if stream_type in ("time", "latlng", "moving", "distance") or len(values) != len(time):
+                continue
+            if summary["stats"].get(stream_type) is None:
+                continue
+            indices = lttb(time, values, max_points)
+            summary["series"][stream_type] = [
+                [int(time[i]), round(float(values[i]), 2)] for i in indices if not np.isnan(values[i])
+            ]
+
+    if "latlng" in data and len(data["latlng"]):
+        summary["route"] = np.round(simplify_route(data["latlng"], max_points), 5).tolist()
+
+    return summary
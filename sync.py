@@ -0,0 +1,147 @@
+import concurrent.futures
+import itertools
+import threading
+from datetime import datetime, timedelta, timezone
+
+from schema import to_utc
+from constants import sync_shards, sync_shard_min_days
+
+
+# Split an iterable into lists of up to size items, consuming it lazily
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+# Number of time shards to split a sync range into: one per sync_shard_min_days, up to sync_shards
+def shard_count(start, end, max_shards=sync_shards, min_days=sync_shard_min_days):
+    days = (to_utc(end) - to_utc(start)).total_seconds() / 86400
+    return max(1, min(max_shards, int(days // min_days)))
+
+
+# Split a date range into consecutive shards, newest first. Neighbouring shards overlap by a second, since
+# Strava's after and before bounds both exclude the boundary; the overlap is removed by deduplicating ids
+def shard_ranges(start, end, count):
+    start, end = to_utc(start), to_utc(end)
+    step = (end - start) / count
+    overlap = timedelta(seconds=1)
+    ranges = [(start + i * step - (overlap if i else timedelta(0)), end if i == count - 1 else start + (i + 1) * step) for i in range(count)]
+    return ranges[::-1]
+
+
+# Fetch every shard with fetch(start, end) on a bounded pool, yielding (start, end, result) as each finishes
+def fetch_shards(fetch, ranges, workers):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stravagpt-shard") as executor:
+        futures = {executor.submit(fetch, start, end): (start, end) for start, end in ranges}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                start, end = futures[future]
+                yield start, end, future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+# Drop the activities already seen, e.g. a second copy where shards overlap, and remember the rest
+def unseen(activities, seen):
+    activities = [activity for activity in activities if activity.id not in seen]
+    seen.update(activity.id for activity in activities)
+    return activities
+
+
+# Sort key putting the frame with the newest start_date first
+def newest_first(frame):
+    newest = frame["start_date"].max() if frame.height else None
+    return -to_utc(newest).timestamp() if newest is not None else float("inf")
+
+
+class SyncProgress:
+    """
+    Progress of an activity sync, written by the sync thread and read by the UI.
+
+    How much history is loaded is measured in time, out of the whole range being synced: from
+    now back to the oldest activity fetched when paging newest first, or the total span of
+    the shards fetched so far when fetching time shards concurrently.
+
+    Parameters:
+    since: datetime, optional
+        The start date the sync goes back to. Set once the sync knows it.
+    """
+
+    def __init__(self, since=None):
+        self.lock = threading.Lock()
+        self.started_at = datetime.now(timezone.utc)
+        self.since = to_utc(since)
+        self.state = "running"  # running, done or failed
+        self.pages = 0
+        self.fetched = 0  # New activities fetched from Strava
+        self.stored = 0  # Activities already in the local store
+        self.oldest = None  # Start date of the oldest activity fetched
+        self.covered = 0.0  # Seconds of the synced range loaded
+        self.error = None
+        self.available = threading.Event()  # Set once there are activities to chat about
+
+    def start(self, since, stored=0):
+        with self.lock:
+            self.since = to_utc(since)
+            self.stored = stored
+        if stored:
+            self.available.set()
+
+    # Record a page of activities, newest first, or the activities of a whole shard and its span in seconds
+    def page(self, activities_pl, span=None):
+        with self.lock:
+            self.pages += 1
+            self.fetched += activities_pl.height
+            if activities_pl.height:
+                oldest = to_utc(activities_pl["start_date"].min())
+                self.oldest = oldest if self.oldest is None else min(self.oldest, oldest)
+            if span is not None:
+                self.covered += span
+            elif self.oldest is not None:
+                self.covered = (self.started_at - self.oldest).total_seconds()
+        if activities_pl.height:
+            self.available.set()
+
+    def finish(self):
+        with self.lock:
+            self.state = "done"
+        self.available.set()
+
+    def fail(self, error):
+        with self.lock:
+            self.state = "failed"
+            self.error = str(error)
+        self.available.set()
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    # Share of the synced range loaded so far, between 0 and 1
+    @property
+    def fraction(self):
+        with self.lock:
+            if self.state != "running":
+                return 1.0
+            if self.since is None:
+                return 0.0
+            total = (self.started_at - self.since).total_seconds()
+            if total <= 0:
+                return 1.0
+            return min(max(self.covered / total, 0.0), 1.0)
+
+    def to_dict(self):
+        fraction = self.fraction
+        with self.lock:
+            return {
+                "state": self.state,
+                "pages": self.pages,
+                "fetched": self.fetched,
+                "stored": self.stored,
+                "oldest": self.oldest.isoformat() if self.oldest else None,
+                "since": self.since.isoformat() if self.since else None,
+                "fraction": fraction,
+                "error": self.error,
+            }
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Keep the tests away from the real store and caches, before any module reads the data directory
+os.environ.setdefault("STRAVAGPT_DATA_DIR", tempfile.mkdtemp(prefix="stravagpt-test-"))
+os.environ.setdefault("SILENCE_TOKEN_WARNINGS", "true")
@@ -0,0 +1,31 @@
+import numpy as np
+
+from features import climbs, CLIMB_MIN_GAIN
+
+
+def test_flat_profile_has_no_climbs():
+    distance = np.arange(0, 3000, 10.0)
+    assert climbs(distance, np.full(distance.size, 1500.0)) == []
+
+
+def test_monotone_climb_to_the_last_sample_is_recorded():
+    distance = np.arange(0, 3000, 10.0)
+    found = climbs(distance, np.linspace(100, 400, distance.size))
+    assert len(found) == 1
+    gain, length = found[0]
+    assert 295 <= gain <= 300
+    assert length == distance[-1] - distance[0]
+
+
+def test_climb_and_descent():
+    distance = np.arange(0, 3000, 10.0)
+    altitude = np.concatenate([np.linspace(100, 400, 150), np.linspace(400, 100, 150)])
+    found = climbs(distance, altitude)
+    assert len(found) == 1
+    assert 295 <= found[0][0] <= 300
+
+
+def test_short_rise_is_not_a_climb():
+    distance = np.arange(0, 1000, 10.0)
+    altitude = np.concatenate([np.linspace(100, 100 + CLIMB_MIN_GAIN / 2, 50), np.full(50, 100 + CLIMB_MIN_GAIN / 2)])
+    assert climbs(distance, altitude) == []
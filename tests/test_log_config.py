@@ -0,0 +1,22 @@
+import logging
+import queue
+
+from log_config import Preview, _QueueListener
+
+
+def record(msg, args):
+    return logging.LogRecord("test", logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_listener_formats_message_once():
+    prepared = _QueueListener(queue.SimpleQueue(), logging.NullHandler()).prepare(record("rows %s", (Preview([1, 2]),)))
+    assert prepared.msg == "rows [1, 2]"
+    assert prepared.args is None
+
+
+def test_listener_survives_bad_arguments(monkeypatch):
+    monkeypatch.setattr(logging, "raiseExceptions", False)
+    prepared = _QueueListener(queue.SimpleQueue(), logging.NullHandler()).prepare(record("bad %d", ("x",)))
+    assert prepared.msg.startswith("bad %d")
+    assert "'x'" in prepared.msg
+    assert prepared.getMessage() == prepared.msg
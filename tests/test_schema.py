@@ -0,0 +1,19 @@
+from datetime import datetime, timezone
+
+import polars as pl
+from stravalib.model import SummaryActivity
+
+from ingest import ingest_activities
+from schema import ACTIVITY_SCHEMA
+
+
+def test_start_date_local_is_naive_wall_clock_time():
+    activity = SummaryActivity.model_validate({
+        "id": 1, "name": "Morning Run", "distance": 1000,
+        "start_date": "2024-05-01T06:00:00Z", "start_date_local": "2024-05-01T07:00:00Z",
+    })
+    activities_pl, _ = ingest_activities([activity])
+    assert activities_pl.schema["start_date"] == ACTIVITY_SCHEMA["start_date"]
+    assert activities_pl.schema["start_date_local"] == ACTIVITY_SCHEMA["start_date_local"] == pl.Datetime("us")
+    assert activities_pl["start_date"][0] == datetime(2024, 5, 1, 6, tzinfo=timezone.utc)
+    assert activities_pl["start_date_local"][0] == datetime(2024, 5, 1, 7)
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from summarise import summarise_streams
+
+
+def stream(values):
+    return SimpleNamespace(data=values)
+
+
+@pytest.mark.parametrize("heartrate", [np.full(600, np.nan), np.array([])])
+def test_missing_heartrate_is_left_out(heartrate):
+    time = np.arange(0, 600.0)
+    summary = summarise_streams({"time": stream(time), "distance": stream(time * 3), "heartrate": stream(heartrate)}, 50)
+    assert "heart_rate_zones" not in summary
+    assert summary["stats"]["heartrate"] is None
+    assert "heartrate" not in summary["series"]
+    assert summary["splits"][0] == {"split": 1, "seconds": 333, "pace_per_km": "5:33"}
+
+
+def test_heartrate_zones():
+    time = np.arange(0, 600.0)
+    heartrate = np.full(600, 150.0)
+    summary = summarise_streams({"time": stream(time), "heartrate": stream(heartrate)}, 50, max_heart_rate=190)
+    assert sum(zone["seconds"] for zone in summary["heart_rate_zones"].values()) == 599
+
+
+@pytest.mark.parametrize("length", [300, 900])
+def test_streams_of_another_length_are_left_out_of_splits(length):
+    time = np.arange(0, 600.0)
+    streams = {
+        "time": stream(time),
+        "distance": stream(time * 3),
+        "heartrate": stream(np.full(length, 150.0)),
+        "altitude": stream(np.linspace(0, 100, length)),
+    }
+    summary = summarise_streams(streams, 50)
+    assert summary["splits"][0] == {"split": 1, "seconds": 333, "pace_per_km": "5:33"}
+    assert "heart_rate_zones" not in summary
+    assert summary["stats"]["heartrate"]["mean"] == 150.0
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta, timezone
+
+import polars as pl
+
+import client
+from benchmarks.fixtures import FakeStravaClient, SyntheticAthlete, offline_session
+from strava import _started_after
+from sync import fetch_shards, shard_ranges, unseen
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+END = datetime(2025, 1, 2, tzinfo=timezone.utc)
+
+
+def move(activity, when):
+    activity.data["start_date"] = when.isoformat()
+    activity.start_date = activity.data["start_date"]
+
+
+def started(activity):
+    return datetime.fromisoformat(activity.data["start_date"])
+
+
+# The ids of a sharded fetch, deduplicated and ordered newest first like the paged fetch
+def sharded_ids(strava, ranges):
+    shards = list(fetch_shards(lambda after, before: list(strava.get_activities(after=after, before=before)), ranges, 4))
+    seen, ids = set(), []
+    for _, _, activities in sorted(shards, key=lambda shard: shard[1], reverse=True):
+        ids += [activity.id for activity in unseen(activities, seen)[::-1]]
+    return ids
+
+
+def test_shards_match_paged_newest_first():
+    athlete = SyntheticAthlete(3000, seed=1)
+    ranges = shard_ranges(START, END, 8)
+
+    # Put activities exactly on a shard edge, and inside the second the neighbouring shards overlap by
+    edge = ranges[4][1]
+    later = next(i for i, activity in enumerate(athlete.activities) if started(activity) > edge)
+    move(athlete.activities[later - 1], edge - timedelta(seconds=0.5))
+    move(athlete.activities[later], edge)
+
+    strava = FakeStravaClient(athlete)
+    paged = [activity.id for activity in _started_after(strava.get_activities(before=END), START)]
+    sharded = sharded_ids(strava, ranges)
+    assert sharded == paged
+    assert len(paged) == athlete.count
+    assert athlete.activities[later].id in sharded
+    assert athlete.activities[later - 1].id in sharded
+
+
+def test_shard_ranges_cover_the_range_newest_first():
+    ranges = shard_ranges(START, END, 8)
+    assert len(ranges) == 8
+    assert ranges[0][1] == END and ranges[-1][0] == START
+    for newer, older in zip(ranges, ranges[1:]):
+        assert newer[0] == older[1] - timedelta(seconds=1)
+
+
+def comparable(frame):
+    return frame.with_columns(pl.col("id") % 10_000_000).drop("gear_id", strict=False)
+
+
+def test_sharded_sync_matches_paged_sync(monkeypatch):
+    sharded = offline_session(SyntheticAthlete(2000, seed=2))
+    sharded.fetch_activities()
+
+    monkeypatch.setattr(client, "shard_count", lambda start, end: 1)
+    paged = offline_session(SyntheticAthlete(2000, seed=2))
+    paged.fetch_activities()
+
+    assert sharded.sync_progress.state == paged.sync_progress.state == "done"
+    assert sharded.sync_progress.pages < paged.sync_progress.pages
+    assert sharded.activities_pl["id"].is_sorted(descending=True)
+    assert comparable(sharded.activities_pl).equals(comparable(paged.activities_pl))
+    for table, frame in paged.store.scan_nested().items():
+        assert sharded.store.scan_nested()[table].collect().height == frame.collect().height
+    for session in (sharded, paged):
+        session.feature_thread.join()
@@ -0,0 +1,80 @@
+import time
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+
+
+@dataclass
+class ToolSpan:
+    """A single tool call within one iteration of the tool loop."""
+    name: str
+    tool_call_id: str
+    seconds: float
+    strava_calls: int = 0
+    error: bool = False
+
+
+@dataclass
+class IterationTrace:
+    """One chat completion request of the tool loop and the tool calls it asked for."""
+    index: int
+    model_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    finish_reason: str = None
+    tools: list = field(default_factory=list)
+
+    @property
+    def tool_seconds(self):
+        # Tools in one iteration run concurrently, so the slowest one bounds the wait
+        return max((tool.seconds for tool in self.tools), default=0.0)
+
+
+@dataclass
+class QuestionTrace:
+    """
+    Profile of answering one question: every iteration of the tool loop with its token
+    usage, model latency and the latency and Strava API calls of each tool it ran.
+    """
+    question: str
+    started_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    seconds: float = 0.0
+    time_to_first_token: float = None
+    iterations: list = field(default_factory=list)
+
+    def __post_init__(self):
+        self._started = time.perf_counter()
+
+    # Start timing a new chat completion request
+    def start_iteration(self):
+        iteration = IterationTrace(index=len(self.iterations))
+        self.iterations.append(iteration)
+        return iteration
+
+    # Record the token usage reported by the API, if any
+    def record_usage(self, iteration, usage):
+        if usage is not None:
+            iteration.prompt_tokens = usage.prompt_tokens
+            iteration.completion_tokens = usage.completion_tokens
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._started
+        return self
+
+    @property
+    def prompt_tokens(self):
+        return sum(iteration.prompt_tokens for iteration in self.iterations)
+
+    @property
+    def completion_tokens(self):
+        return sum(iteration.completion_tokens for iteration in self.iterations)
+
+    @property
+    def strava_calls(self):
+        return sum(tool.strava_calls for iteration in self.iterations for tool in iteration.tools)
+
+    def to_dict(self):
+        trace = asdict(self)
+        trace["prompt_tokens"] = self.prompt_tokens
+        trace["completion_tokens"] = self.completion_tokens
+        trace["strava_calls"] = self.strava_calls
+        return trace